@@ -2,48 +2,824 @@ import os
 import re
 import base64
 import uuid
-from flask import Flask, render_template, request, redirect, url_for, make_response, send_file, abort
+import hashlib
+import hmac
+import itertools
+import random
+import signal
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from flask import (Flask, render_template, request, redirect, url_for, make_response, send_file, abort, g,
+                   session, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
-from flask_wtf.csrf import CSRFProtect
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from sqlalchemy.orm import validates
+from flask_wtf.csrf import CSRFProtect, generate_csrf
 from datetime import datetime
+from render_limiter import RenderLimiter, RenderBusy
+from render_recycler import RenderRecycler
+from signatures import signature_from_strokes, is_valid_signature
+from thumbnails import schedule_thumbnail, find_thumbnail, remove_thumbnail
+from dictionary_codec import DictionaryCodec, build_dictionary
+from packfile import PackSlice
+from pdf_writer import SIGNED_ON_FORMAT
+from document_export import EXPORT_FORMATS, export_chunks, bulk_export_chunks
+from clauses import ClauseComposer, ClauseError, SLUG_PATTERN, include_placeholder, included_slugs
+from profiling import StackSampler, Tracer, write_profile, list_profiles, prune_profiles, PROFILE_NAME_PATTERN
+
+try:
+    import brotli
+except ImportError:  # optional; responses fall back to gzip
+    brotli = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SESSION_SECRET', 'dev-secret-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///contracts.db'
+# Relative SQLite paths are in the instance folder
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///contracts.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-CONTRACTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generated_contracts')
+# Templates are compiled once into a bytecode cache shared by all workers and are not checked
+# for changes on every render; TEMPLATES_AUTO_RELOAD=1 turns reloading back on while editing them
+app.config['TEMPLATES_AUTO_RELOAD'] = os.environ.get('TEMPLATES_AUTO_RELOAD') == '1'
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+if TEMPLATE_CACHE_DIR:
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+CONTRACTS_DIR = os.environ.get('CONTRACTS_DIR',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generated_contracts'))
 if not os.path.exists(CONTRACTS_DIR):
     os.makedirs(CONTRACTS_DIR)
+# Pack files holding archived PDFs (see pdf_archive.py)
+PACKS_DIR = os.environ.get('PDF_PACKS_DIR', os.path.join(CONTRACTS_DIR, 'packs'))
+
+# WeasyPrint write_pdf() options per render profile. WeasyPrint subsets
+# fonts and compresses streams unless full_fonts/uncompressed_pdf are set.
+RENDER_PROFILES = {
+    'standard': {},
+    'compact': {'optimize_images': True, 'jpeg_quality': 60, 'dpi': 150},
+    'archival': {'pdf_variant': 'pdf/a-3b', 'optimize_images': True, 'jpeg_quality': 85, 'dpi': 300},
+    'archival-full-fonts': {'pdf_variant': 'pdf/a-3b', 'full_fonts': True},
+    'uncompressed': {'uncompressed_pdf': True},
+}
+DEFAULT_RENDER_PROFILE = os.environ.get('PDF_RENDER_PROFILE', 'standard')
+# 'auto' writes plain-text contracts with pdf_writer.py and everything else
+# with WeasyPrint; 'weasyprint' always uses WeasyPrint
+PDF_ENGINE = os.environ.get('PDF_ENGINE', 'auto')
+# Profile options the native writer cannot honour; profiles using them always go to WeasyPrint
+WEASYPRINT_ONLY_OPTIONS = {'pdf_variant', 'full_fonts'}
+
+# PKCS#12 file whose key signs every generated PDF (requires pyHanko); unset disables signing
+PDF_SIGNING_P12 = os.environ.get('PDF_SIGNING_P12')
+
+# 'full' stores the filled text on every contract; 'delta' stores only the
+# template revision and variables and rebuilds the text with fill_template()
+CONTRACT_STORAGE = os.environ.get('CONTRACT_STORAGE', 'full')
+CONTRACT_TEXT_CACHE_SIZE = int(os.environ.get('CONTRACT_TEXT_CACHE_SIZE', '256'))
+# 'zstd' compresses stored contract text and variables against a shared
+# dictionary built from the templates (requires the zstandard package)
+CONTRACT_COMPRESSION = os.environ.get('CONTRACT_COMPRESSION', 'none')
+CONTRACT_SUMMARY_LENGTH = 100
+# Contract titles come from the preview form and end up in email subjects
+CONTRACT_TITLE_LENGTH = 200
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '500'))
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+                          'application/json', 'image/svg+xml'}
+
+# Templates per page on the home page and in /templates.json
+TEMPLATE_PAGE_SIZE = 24
+TEMPLATE_EXCERPT_LENGTH = 120
+# Values suggested per keystroke on the generate form; longer values are not indexed
+SUGGESTION_LIMIT = 8
+SUGGESTION_VALUE_LENGTH = 200
+# Variables whose names contain one of these are amounts, entered with a currency selector
+CURRENCY_VARIABLE_KEYWORDS = ('amount', 'price', 'fee', 'cost', 'salary', 'rent', 'payment')
+# How date fields are written into the contract text
+DATE_VALUE_FORMAT = '%B %d, %Y'
+# Date variables with a name part starting with one of these are deadlines deadline_scheduler.py
+# notifies about, DEADLINE_NOTICE_DAYS ahead; renewal ones mark the end of a term and get
+# RENEWAL_NOTICE_DAYS of notice
+DEADLINE_VARIABLE_KEYWORDS = ('due', 'deadline', 'end', 'termination', 'closing', 'completion', 'expir',
+                              'renewal', 'event', 'balance', 'deposit', 'payment')
+RENEWAL_VARIABLE_KEYWORDS = ('end', 'termination', 'expir', 'renewal')
+DEADLINE_NOTICE_DAYS = int(os.environ.get('DEADLINE_NOTICE_DAYS', '7'))
+RENEWAL_NOTICE_DAYS = int(os.environ.get('RENEWAL_NOTICE_DAYS', '30'))
+DEADLINE_PAGE_LIMIT = 500
+# Where deadline_scheduler.py POSTs due deadlines (signed with the secret when set); without
+# a URL it only logs them. PUBLIC_BASE_URL makes the contract links in notifications absolute
+DEADLINE_WEBHOOK_URL = os.environ.get('DEADLINE_WEBHOOK_URL')
+DEADLINE_WEBHOOK_SECRET = os.environ.get('DEADLINE_WEBHOOK_SECRET')
+PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL', '').rstrip('/')
+
+# 'inline' renders PDFs in the web request; 'queue' stores a RenderJob that
+# render_worker.py processes (on any node sharing generated_contracts/)
+RENDER_MODE = os.environ.get('RENDER_MODE', 'inline')
+RENDER_JOB_MAX_ATTEMPTS = int(os.environ.get('RENDER_JOB_MAX_ATTEMPTS', '5'))
+
+# Contracts sent by email are queued as ContractDelivery rows and sent by mail_worker.py
+# through this SMTP server; MAIL_DOMAIN_CONCURRENCY caps the messages in flight to any one
+# recipient domain across all workers
+SMTP_HOST = os.environ.get('SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '25'))
+SMTP_USERNAME = os.environ.get('SMTP_USERNAME')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS') == '1'
+MAIL_FROM = os.environ.get('MAIL_FROM', 'contracts@localhost')
+MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', '6'))
+MAIL_DOMAIN_CONCURRENCY = int(os.environ.get('MAIL_DOMAIN_CONCURRENCY', '2'))
+MAIL_MAX_RECIPIENTS = 20
+# /contract/<uuid>/send is open to anyone who can see /contracts: cap the messages queued per
+# contract and per client address over the last hour so the relay cannot be used to spam
+MAIL_CONTRACT_HOURLY_LIMIT = int(os.environ.get('MAIL_CONTRACT_HOURLY_LIMIT', '20'))
+MAIL_CLIENT_HOURLY_LIMIT = int(os.environ.get('MAIL_CLIENT_HOURLY_LIMIT', '50'))
+
+# Bulk deletes (contract_purge.py and /contracts/delete) delete this many contracts per
+# transaction; CONTRACT_RETENTION_DAYS is the default age `contract_purge.py retention` purges
+CONTRACT_DELETE_BATCH_SIZE = 500
+BULK_DELETE_LIMIT = 1000
+CONTRACT_RETENTION_DAYS = int(os.environ.get('CONTRACT_RETENTION_DAYS', '0'))
+# ProcessCursor names of the contract_purge.py processes, reported by /admin/purge-status
+PURGE_PROCESSES = ('retention', 'bulk-delete', 'unlink')
+
+# ADMIN_TOKEN unlocks /admin/profiles, the /admin JSON monitoring endpoints and on-demand request
+# profiling (unset: all disabled);
+# PROFILE_SAMPLE_RATE=N also profiles 1 in N requests with the stack sampler (0: off)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# Browser sign-in stores the admin flag in the signed session cookie, which anyone can forge while
+# the secret key is the built-in default; without SESSION_SECRET only X-Admin-Token is accepted
+ADMIN_SESSIONS = bool(ADMIN_TOKEN and os.environ.get('SESSION_SECRET'))
+if ADMIN_TOKEN and not ADMIN_SESSIONS:
+    app.logger.warning('ADMIN_TOKEN is set but SESSION_SECRET is not: admin browser sign-in is disabled')
+PROFILE_SAMPLE_RATE = int(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILES_DIR = os.environ.get('PROFILES_DIR', os.path.join(app.instance_path, 'profiles'))
+PROFILES_KEEP = int(os.environ.get('PROFILES_KEEP', '500'))
+# Pruning lists and sorts the whole directory, so each worker does it once every this many
+# profiles it writes; the directory holds up to about PROFILES_KEEP + workers x this many
+PROFILES_PRUNE_EVERY = max(1, PROFILES_KEEP // 10)
+profiles_written = itertools.count(1)
+stack_sampler = StackSampler(interval=float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000)
+
+# Admission control for PDF renders, shared by all workers on this host
+render_limiter = RenderLimiter(
+    lock_dir=os.environ.get('RENDER_LOCK_DIR', os.path.join(app.instance_path, 'render_slots')),
+    concurrency=int(os.environ.get('RENDER_CONCURRENCY', str(os.cpu_count() or 2))),
+    queue_size=int(os.environ.get('RENDER_QUEUE_SIZE', '8')),
+    timeout=float(os.environ.get('RENDER_QUEUE_TIMEOUT', '10')),
+)
+# Processes that render retire after this many renders or this much RSS growth (0 disables either)
+render_recycler = RenderRecycler(
+    max_renders=int(os.environ.get('RENDER_RECYCLE_RENDERS', '1000')),
+    max_growth_mb=int(os.environ.get('RENDER_RECYCLE_GROWTH_MB', '256')),
+)
 
 db = SQLAlchemy(app)
 csrf = CSRFProtect(app)
 
+# Every clause a template depends on, directly or through other clauses: editing a clause
+# recomposes exactly the templates listed here for it
+template_clauses = db.Table(
+    'template_clause',
+    db.Column('template_id', db.Integer, db.ForeignKey('template.id'), primary_key=True),
+    db.Column('clause_id', db.Integer, db.ForeignKey('clause.id'), primary_key=True, index=True),
+)
+
 class Template(db.Model):
+    # (category, title) serves the category facet counts and each category's pages of templates
+    __table_args__ = (db.Index('ix_template_category_title', 'category', 'title'),)
+    
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
+    # Lower-cased title, so case-insensitive prefix search is an index range scan
+    title_key = db.Column(db.String(200), index=True)
     category = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text, nullable=False)
+    # content with clause includes resolved; NULL when it includes no clauses
+    composed_content = db.Column(db.Text)
+    render_profile = db.Column(db.String(50))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     contracts = db.relationship('Contract', backref='template', lazy=True)
+    clauses = db.relationship('Clause', secondary=template_clauses, back_populates='templates', lazy=True)
+    revisions = db.relationship('TemplateRevision', backref='template', lazy=True,
+                                cascade='all, delete-orphan', order_by='TemplateRevision.revision')
+    
+    @validates('title')
+    def _set_title_key(self, key, title):
+        self.title_key = title.lower() if title is not None else None
+        return title
+    
+    @property
+    def resolved_content(self):
+        """Content with clause includes resolved: what revisions store and contracts are filled from"""
+        return self.composed_content if self.composed_content is not None else self.content
+    
+    def current_revision(self):
+        """Revision matching the template's current content, or None if none was recorded yet"""
+        if self.id is None:
+            return None
+        return TemplateRevision.query.filter_by(template_id=self.id,
+                                                content_hash=content_hash(self.resolved_content)).first()
     
     def __repr__(self):
         return f'<Template {self.title}>'
 
+class Clause(db.Model):
+    """Reusable clause that templates and other clauses include with [[clause:<slug>]]"""
+    id = db.Column(db.Integer, primary_key=True)
+    slug = db.Column(db.String(100), unique=True, nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    templates = db.relationship('Template', secondary=template_clauses, back_populates='clauses', lazy=True)
+    
+    def __repr__(self):
+        return f'<Clause {self.slug}>'
+
+class TemplateRevision(db.Model):
+    """Immutable snapshot of a template's composed content, addressed by the SHA-256 of that content.
+    Contracts point at the one they were filled from."""
+    __table_args__ = (db.UniqueConstraint('template_id', 'revision'),
+                      db.Index('ix_template_revision_template_hash', 'template_id', 'content_hash'))
+    
+    id = db.Column(db.Integer, primary_key=True)
+    template_id = db.Column(db.Integer, db.ForeignKey('template.id'), nullable=False, index=True)
+    revision = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(64))
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<TemplateRevision {self.template_id}@{self.revision}>'
+
+class CompressionDictionary(db.Model):
+    """Immutable zstd dictionary; compressed contracts record the id of the one they need"""
+    id = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    sample_count = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Contract(db.Model):
+    # Retention purges and bulk deletes walk contracts oldest first by this index
+    __table_args__ = (db.Index('ix_contract_created_at_id', 'created_at', 'id'),)
+    
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
     template_id = db.Column(db.Integer, db.ForeignKey('template.id'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
-    filled_content = db.Column(db.Text, nullable=False)
+    # Empty when content_storage is 'delta' or 'zstd'; use the filled_content property.
+    # Text columns are deferred so list views only load the summary.
+    stored_content = db.deferred(db.Column('filled_content', db.Text, nullable=False))
+    content_storage = db.Column(db.String(10))
+    compressed_content = db.deferred(db.Column(db.LargeBinary))
+    summary = db.Column(db.String(CONTRACT_SUMMARY_LENGTH))
+    template_revision_id = db.Column(db.Integer, db.ForeignKey('template_revision.id'), index=True)
     signature_data = db.Column(db.Text)
-    pdf_filename = db.Column(db.String(255), nullable=False)
-    variables_json = db.Column(db.Text)
+    pdf_filename = db.Column(db.String(255), nullable=False, index=True)
+    # NULL when the variables are compressed; use the variables_json property
+    stored_variables_json = db.deferred(db.Column('variables_json', db.Text))
+    compressed_variables = db.deferred(db.Column(db.LargeBinary))
+    dictionary_id = db.Column(db.Integer, db.ForeignKey('compression_dictionary.id'))
+    render_profile = db.Column(db.String(50))
+    pdf_size = db.Column(db.Integer)
+    render_seconds = db.Column(db.Float)
+    pdf_signed_at = db.Column(db.DateTime)
+    # NULL until first sent by email; then queued, sent, partial (some recipients failed) or failed
+    delivery_status = db.Column(db.String(10))
+    delivered_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    template_revision = db.relationship('TemplateRevision', lazy=True)
+    page = db.relationship('ContractPage', uselist=False, lazy=True, cascade='all, delete-orphan')
+    render_job = db.relationship('RenderJob', uselist=False, lazy=True, cascade='all, delete-orphan')
+    deadlines = db.relationship('ContractDeadline', lazy=True, cascade='all, delete-orphan')
+    deliveries = db.relationship('ContractDelivery', lazy=True, cascade='all, delete-orphan',
+                                 order_by='ContractDelivery.id')
+    
+    @property
+    def filled_content(self):
+        if self.content_storage == 'delta':
+            return reconstruct_filled_content(self.template_revision_id, self.variables_json)
+        if self.content_storage == 'zstd':
+            return contract_codec.decompress(self.compressed_content, self.dictionary_id)
+        return self.stored_content
+    
+    @filled_content.setter
+    def filled_content(self, value):
+        self.stored_content = value
+        self.compressed_content = None
+        self.content_storage = 'full'
+    
+    @property
+    def variables_json(self):
+        if self.dictionary_id is not None and self.stored_variables_json is None:
+            if self.compressed_variables is None:
+                return None
+            return contract_codec.decompress(self.compressed_variables, self.dictionary_id)
+        return self.stored_variables_json
+    
+    @variables_json.setter
+    def variables_json(self, value):
+        self.stored_variables_json = value
+        self.compressed_variables = None
+    
+    def compress(self, dictionary_id):
+        """Store text (unless delta-stored) and variables zstd-compressed against the given dictionary"""
+        content, variables_json = self.filled_content, self.variables_json
+        self.dictionary_id = dictionary_id
+        self.compressed_variables = contract_codec.compress(variables_json, dictionary_id) if variables_json else None
+        self.stored_variables_json = None
+        if self.content_storage != 'delta':
+            self.compressed_content = contract_codec.compress(content, dictionary_id)
+            self.stored_content = ''
+            self.content_storage = 'zstd'
+    
+    def decompress(self):
+        """Store text and variables uncompressed again"""
+        content, variables_json = self.filled_content, self.variables_json
+        if self.content_storage == 'zstd':
+            self.filled_content = content
+        self.variables_json = variables_json
+        self.dictionary_id = None
+    
     def __repr__(self):
         return f'<Contract {self.title}>'
 
+def load_compression_dictionary(dictionary_id):
+    data = db.session.query(CompressionDictionary.data).filter_by(id=dictionary_id).scalar()
+    if data is None:
+        raise LookupError(f'Compression dictionary {dictionary_id} does not exist')
+    return data
+
+contract_codec = DictionaryCodec(load_compression_dictionary)
+
+@lru_cache(maxsize=256)
+def static_fingerprint(filename, mtime):
+    """Short content hash of a static file; mtime is part of the cache key so edits are picked up"""
+    with open(os.path.join(app.static_folder, filename), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+def asset_url(filename):
+    """Fingerprinted URL of a static file, which is then served with far-future cache headers"""
+    mtime = os.stat(os.path.join(app.static_folder, filename)).st_mtime
+    return url_for('static', filename=filename, v=static_fingerprint(filename, mtime))
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+fragment_cache = {}
+
+def cached_fragment(name, **context):
+    """A template fragment that depends only on its arguments, rendered once per process.
+    Used for the static parts of base.html; not cached while templates auto-reload."""
+    key = (name, tuple(sorted(context.items())))
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(app.jinja_env.get_template(name).render(context))
+        if not app.jinja_env.auto_reload:
+            fragment_cache[key] = html
+    return html
+
+app.jinja_env.globals['cached_fragment'] = cached_fragment
+
+def precompile_templates():
+    """Compile every template now, through the bytecode cache, so no request pays for it"""
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def preferred_encoding():
+    """Best content coding the client accepts: 'br', 'gzip' or None"""
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compressor(encoding):
+    """Return (compress, finish, flush) callables of an incremental compressor"""
+    if encoding == 'br':
+        stream = brotli.Compressor(quality=5)
+        return stream.process, stream.finish, stream.flush
+    stream = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return stream.compress, stream.flush, lambda: stream.flush(zlib.Z_SYNC_FLUSH)
+
+def compress_bytes(data, encoding):
+    compress, finish, _ = compressor(encoding)
+    return compress(data) + finish()
+
+def compress_stream(chunks, encoding):
+    """Compress a streamed body chunk by chunk, flushing so each chunk reaches the client promptly"""
+    compress, finish, flush = compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+compressed_static_cache = {}
+
+def is_admin_token(token):
+    return hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+def is_admin():
+    """True for requests carrying ADMIN_TOKEN in X-Admin-Token, or from a session signed in at /admin/login"""
+    if not ADMIN_TOKEN:
+        return False
+    token = request.headers.get('X-Admin-Token')
+    if token is not None:
+        return is_admin_token(token)
+    return ADMIN_SESSIONS and session.get('admin') is True
+
+@app.before_request
+def start_profiling():
+    """Profile this request if an admin asked for it (X-Profile header or ?profile=), or 1 in PROFILE_SAMPLE_RATE"""
+    requested = request.headers.get('X-Profile') or request.args.get('profile')
+    if requested and is_admin():
+        mode = 'trace' if requested == 'trace' else 'sample'
+    elif PROFILE_SAMPLE_RATE and random.randrange(PROFILE_SAMPLE_RATE) == 0:
+        mode, requested = 'sample', None
+    else:
+        return
+    profiler = Tracer() if mode == 'trace' else stack_sampler
+    g.profile = {'profiler': profiler, 'mode': mode, 'on_demand': bool(requested), 'started': time.perf_counter()}
+    profiler.start()
+
+def stop_profiling():
+    profile = g.pop('profile', None)
+    if profile is None:
+        return None
+    counts = profile['profiler'].stop()
+    profile['seconds'] = time.perf_counter() - profile['started']
+    profile['counts'] = counts
+    return profile
+
+# Registered before optimize_response, so it runs after it and the profile includes compression
+@app.after_request
+def finish_profiling(response):
+    profile = stop_profiling()
+    if profile is None:
+        return response
+    try:
+        name = write_profile(PROFILES_DIR, profile['counts'], {
+            'method': request.method, 'path': request.full_path.rstrip('?'), 'endpoint': request.endpoint,
+            'status': response.status_code, 'mode': profile['mode'], 'on_demand': profile['on_demand'],
+            'duration_ms': round(profile['seconds'] * 1000, 1), 'created_at': datetime.utcnow().isoformat(),
+            'weight_unit': 'microseconds' if profile['mode'] == 'trace' else 'samples'})
+        if next(profiles_written) % PROFILES_PRUNE_EVERY == 0:
+            prune_profiles(PROFILES_DIR, PROFILES_KEEP)
+    except OSError as e:
+        app.logger.warning('Could not store request profile: %s', e)
+        return response
+    if profile['on_demand']:
+        response.headers['X-Profile-Id'] = name
+    return response
+
+@app.teardown_request
+def discard_profiling(error=None):
+    """Requests that failed before after_request still have to stop their profiler"""
+    stop_profiling()
+
+@app.after_request
+def recycle_worker(response):
+    """Retire a gunicorn worker that is due for recycling once this response is sent"""
+    if render_recycler.due and not render_recycler.retiring:
+        if request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+            # gunicorn treats SIGTERM to a worker as a graceful stop: it finishes the requests in
+            # flight, accepts no new ones and exits, and the arbiter starts a fresh worker
+            app.logger.info('Recycling worker %s after %s', os.getpid(), render_recycler.reason)
+            os.kill(os.getpid(), signal.SIGTERM)
+        else:
+            app.logger.warning('Render process is due for recycling (%s); restart it', render_recycler.reason)
+        render_recycler.retiring = True
+    return response
+
+@app.after_request
+def optimize_response(response):
+    """Long-lived caching for fingerprinted static files and gzip/brotli compression"""
+    if request.endpoint == 'static' and request.args.get('v'):
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = preferred_encoding()
+    if (encoding is None or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or (response.direct_passthrough and request.endpoint != 'static')):
+        return response
+    
+    etag, weak = response.get_etag()
+    if etag and request.if_none_match.contains_weak(f'{etag}-{encoding}'):
+        # Revalidation of a compressed copy the client already has
+        response.direct_passthrough = False
+        response.status_code = 304
+        response.set_data(b'')
+        response.set_etag(f'{etag}-{encoding}', weak)
+        return response
+    
+    if response.is_streamed and not response.direct_passthrough:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.direct_passthrough = False
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        if request.endpoint == 'static':
+            key = (request.path, response.get_etag()[0], encoding)
+            if key not in compressed_static_cache:
+                compressed_static_cache[key] = compress_bytes(data, encoding)
+            response.set_data(compressed_static_cache[key])
+        else:
+            response.set_data(compress_bytes(data, encoding))
+    
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        # Each encoding is a different representation, so it gets its own ETag
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+def etag_matches(etag):
+    """True if If-None-Match names this ETag, in identity or any compressed encoding"""
+    return any(request.if_none_match.contains_weak(candidate)
+               for candidate in (etag, f'{etag}-gzip', f'{etag}-br'))
+
+class ContractPage(db.Model):
+    """Rendered view_contract page; contracts never change, so it is rendered once and reused"""
+    id = db.Column(db.Integer, primary_key=True)
+    contract_id = db.Column(db.Integer, db.ForeignKey('contract.id'), nullable=False, unique=True)
+    layout_version = db.Column(db.String(16), nullable=False)
+    etag = db.Column(db.String(64), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class RenderJob(db.Model):
+    """Pending or finished PDF render for a contract, claimed by render workers under a lease"""
+    __table_args__ = (db.Index('ix_render_job_status_run_after', 'status', 'run_after'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    contract_id = db.Column(db.Integer, db.ForeignKey('contract.id'), nullable=False, unique=True)
+    # queued -> running -> done, or back to queued (retry) and finally dead
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=RENDER_JOB_MAX_ATTEMPTS)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime, index=True)
+    heartbeat_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    @property
+    def pending(self):
+        return self.status in ('queued', 'running')
+
+class ContractDelivery(db.Model):
+    """One recipient of a contract sent by email, claimed by mail_worker.py under a lease"""
+    __table_args__ = (
+        db.Index('ix_contract_delivery_status_run_after', 'status', 'run_after'),
+        # Messages in flight per domain, for MAIL_DOMAIN_CONCURRENCY
+        db.Index('ix_contract_delivery_status_domain', 'status', 'domain'),
+        # Recent deliveries per client, for MAIL_CLIENT_HOURLY_LIMIT
+        db.Index('ix_contract_delivery_requested_by_created_at', 'requested_by', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    contract_id = db.Column(db.Integer, db.ForeignKey('contract.id'), nullable=False, index=True)
+    recipient = db.Column(db.String(254), nullable=False)
+    domain = db.Column(db.String(253), nullable=False)
+    # queued -> sending -> sent, or back to queued (retry) and finally failed
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=MAIL_MAX_ATTEMPTS)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime, index=True)
+    last_error = db.Column(db.Text)
+    # The server's reply accepting the message (usually its queue id)
+    smtp_reply = db.Column(db.String(200))
+    # Address of the client that queued it
+    requested_by = db.Column(db.String(45))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    @property
+    def pending(self):
+        return self.status in ('queued', 'sending')
+
+class ContractDeadline(db.Model):
+    """A deadline or renewal date from a contract's variables, notified about at notify_at
+    by deadline_scheduler.py"""
+    __table_args__ = (
+        # The scheduler's cursor walks this index; the deadlines page scans a range of the other
+        db.Index('ix_contract_deadline_notify_at_id', 'notify_at', 'id'),
+        db.Index('ix_contract_deadline_due_on_id', 'due_on', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    contract_id = db.Column(db.Integer, db.ForeignKey('contract.id'), nullable=False, index=True)
+    variable = db.Column(db.String(100), nullable=False)
+    # 'deadline' or 'renewal'
+    kind = db.Column(db.String(10), nullable=False)
+    due_on = db.Column(db.Date, nullable=False)
+    notify_at = db.Column(db.DateTime, nullable=False)
+
+class ProcessCursor(db.Model):
+    """How far a background process got through its work, so a restart resumes there"""
+    name = db.Column(db.String(50), primary_key=True)
+    # Sort key and id of the last row processed; NULL before the first
+    position_at = db.Column(db.DateTime)
+    position_id = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.BigInteger, nullable=False, default=0)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    
+    @property
+    def rate(self):
+        """Rows processed per second since started_at, or None"""
+        if not self.started_at or not self.updated_at or self.updated_at <= self.started_at:
+            return None
+        return self.processed / (self.updated_at - self.started_at).total_seconds()
+
+class PendingUnlink(db.Model):
+    """PDF (and thumbnail) of a bulk-deleted contract, removed by `contract_purge.py unlink`"""
+    id = db.Column(db.Integer, primary_key=True)
+    pdf_filename = db.Column(db.String(255), nullable=False)
+    queued_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PdfPack(db.Model):
+    """Append-only pack file of archived PDFs; live_* shrink as contracts are deleted"""
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False, unique=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    live_count = db.Column(db.Integer, nullable=False)
+    live_bytes = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ArchivedPdf(db.Model):
+    """Where in a pack the PDF named pdf_filename lives once it no longer has a file of its own"""
+    id = db.Column(db.Integer, primary_key=True)
+    pdf_filename = db.Column(db.String(255), nullable=False, unique=True)
+    pack_id = db.Column(db.Integer, db.ForeignKey('pdf_pack.id'), nullable=False, index=True)
+    offset = db.Column(db.BigInteger, nullable=False)
+    length = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UsageRollup(db.Model):
+    """Contract counters per template per day, kept up to date by record_usage()"""
+    __table_args__ = (db.UniqueConstraint('day', 'template_id', name='uq_usage_rollup_day_template'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    # Not a foreign key: the counters outlive deleted templates
+    template_id = db.Column(db.Integer, nullable=False)
+    category = db.Column(db.String(100))
+    contracts = db.Column(db.Integer, nullable=False, default=0)
+    pdf_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    # Contracts rendered before render times were recorded count in contracts but not here
+    renders = db.Column(db.Integer, nullable=False, default=0)
+    render_seconds = db.Column(db.Float, nullable=False, default=0.0)
+
+class UsageTotal(db.Model):
+    """All-time UsageRollup counters of one template, updated with the day rows so the dashboard
+    never sums the whole history"""
+    template_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    category = db.Column(db.String(100))
+    contracts = db.Column(db.Integer, nullable=False, default=0)
+    pdf_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    renders = db.Column(db.Integer, nullable=False, default=0)
+    render_seconds = db.Column(db.Float, nullable=False, default=0.0)
+
+class VariableValue(db.Model):
+    """Distinct values entered for each variable name and how many contracts use them,
+    kept up to date by record_variable_values() and served as suggestions"""
+    __table_args__ = (
+        db.UniqueConstraint('variable', 'value_key', name='uq_variable_value_key'),
+        # Covers the suggestion query, so a prefix lookup never reads the table itself
+        db.Index('ix_variable_value_prefix', 'variable', 'value_key', 'uses', 'value'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    variable = db.Column(db.String(100), nullable=False)
+    # Case-folded, whitespace-collapsed value; the value shown is the latest spelling entered
+    value_key = db.Column(db.String(SUGGESTION_VALUE_LENGTH), nullable=False)
+    value = db.Column(db.String(SUGGESTION_VALUE_LENGTH), nullable=False)
+    uses = db.Column(db.Integer, nullable=False, default=0)
+
+@app.context_processor
+def inject_render_profiles():
+    return {'render_profiles': RENDER_PROFILES, 'default_render_profile': DEFAULT_RENDER_PROFILE}
+
+CATEGORY_ICONS = {
+    'Business & Employment': 'bi-briefcase',
+    'Real Estate': 'bi-house',
+    'Financial & Loans': 'bi-cash-stack',
+    'Services & Freelance': 'bi-tools',
+    'Legal & Personal': 'bi-shield-check',
+    'Purchase & Sales': 'bi-cart',
+    'Tech & IP': 'bi-laptop',
+}
+
+# First match wins
+TEMPLATE_ICONS = [
+    (('NDA', 'Non-Disclosure'), 'bi-shield-lock-fill'),
+    (('Employment', 'Offer Letter'), 'bi-person-badge-fill'),
+    (('Contractor', 'Freelance'), 'bi-person-workspace'),
+    (('Partnership',), 'bi-people-fill'),
+    (('Non-Compete',), 'bi-ban'),
+    (('Consulting',), 'bi-diagram-3-fill'),
+    (('Lease', 'Rental'), 'bi-house-door-fill'),
+    (('Sale', 'Purchase'), 'bi-cart-check-fill'),
+    (('Roommate',), 'bi-people'),
+    (('Loan', 'Promissory'), 'bi-bank'),
+    (('Payment', 'Debt'), 'bi-credit-card-fill'),
+    (('Service',), 'bi-gear-fill'),
+    (('Maintenance',), 'bi-wrench'),
+    (('Event', 'Catering'), 'bi-calendar-event-fill'),
+    (('Power of Attorney',), 'bi-file-earmark-person-fill'),
+    (('Will',), 'bi-file-earmark-medical-fill'),
+    (('Release',), 'bi-hand-thumbs-up-fill'),
+    (('Cease and Desist',), 'bi-stop-circle-fill'),
+    (('Affidavit',), 'bi-file-earmark-check-fill'),
+    (('Bill of Sale', 'Vehicle'), 'bi-receipt'),
+    (('Commission',), 'bi-percent'),
+    (('Software', 'App'), 'bi-code-square'),
+    (('Website',), 'bi-globe'),
+    (('IP', 'Intellectual'), 'bi-lightbulb-fill'),
+    (('Data',), 'bi-database-fill'),
+    (('Trademark',), 'bi-tag-fill'),
+    (('Equipment',), 'bi-box-seam'),
+    (('Severance',), 'bi-door-open-fill'),
+    (('Terminate',), 'bi-x-octagon-fill'),
+]
+
+def template_icon(title):
+    for words, icon in TEMPLATE_ICONS:
+        if any(word in title for word in words):
+            return icon
+    return 'bi-file-earmark-text-fill'
+
+@app.context_processor
+def inject_template_icons():
+    return {'template_icon': template_icon, 'category_icons': CATEGORY_ICONS}
+
+def is_date_variable(variable):
+    """Variables entered with a date picker and written as DATE_VALUE_FORMAT"""
+    name = variable.lower()
+    return 'date' in name or name.endswith('deadline')
+
+@app.context_processor
+def inject_variable_helpers():
+    return {'is_date_variable': is_date_variable}
+
+def category_facets():
+    """[(category, template count)] from one GROUP BY over the (category, title) index"""
+    from sqlalchemy import func
+    
+    return (db.session.query(Template.category, func.count(Template.id))
+            .group_by(Template.category).order_by(Template.category).all())
+
+def template_page(category=None, prefix=None, after=None, limit=TEMPLATE_PAGE_SIZE):
+    """One page of template cards, keyset-paginated so every page costs the same.
+    
+    Filtered by category and/or case-insensitive title prefix; after is the
+    (sort key, id) of the previous page's last row. Returns (cards, next after or None).
+    """
+    from sqlalchemy import func, or_, and_
+    
+    # Category pages use the (category, title) index, searches the title_key index
+    sort_column = Template.title_key if prefix else Template.title
+    query = db.session.query(Template.id, Template.title, Template.category, sort_column,
+                             func.substr(func.coalesce(Template.composed_content, Template.content), 1,
+                                         TEMPLATE_EXCERPT_LENGTH))
+    if category is not None:
+        query = query.filter(Template.category == category)
+    if prefix:
+        prefix = prefix.lower()
+        # A range rather than LIKE, which most databases cannot serve from a plain index
+        query = query.filter(Template.title_key >= prefix, Template.title_key < prefix + '\U0010ffff')
+    if after is not None:
+        after_key, after_id = after
+        query = query.filter(or_(sort_column > after_key, and_(sort_column == after_key, Template.id > after_id)))
+    rows = query.order_by(sort_column, Template.id).limit(limit + 1).all()
+    
+    cards = [{'id': template_id, 'title': title, 'category': template_category, 'excerpt': excerpt,
+              'icon': template_icon(title), 'url': url_for('generate_contract', id=template_id)}
+             for template_id, title, template_category, _, excerpt in rows[:limit]]
+    next_after = (rows[limit - 1][3], rows[limit - 1][0]) if len(rows) > limit else None
+    return cards, next_after
+
 def extract_variables(content):
     """Extract variables from template content (e.g., {client_name})"""
     pattern = r'\{([^}]+)\}'
@@ -57,19 +833,392 @@ def fill_template(content, variables_dict):
         filled_content = filled_content.replace(f'{{{var}}}', value)
     return filled_content
 
-@app.route('/')
-def index():
-    templates = Template.query.order_by(Template.category, Template.title).all()
+def content_hash(content):
+    """Content address of a template revision"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+class RevisionCache:
+    """Thread-safe LRU of values derived from revision content, keyed by content hash.
+    Revisions never change, so entries never need invalidating."""
     
-    templates_by_category = {}
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        value = compute()
+        with self.lock:
+            self.entries[key] = value
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+template_variables_cache = RevisionCache()
+revision_diff_cache = RevisionCache(maxsize=64)
+
+def template_variables(content):
+    """extract_variables() cached by content hash"""
+    return list(template_variables_cache.get(content_hash(content), lambda: tuple(extract_variables(content))))
+
+def revision_diff(old, new):
+    """Unified diff between two revisions, cached by the pair of content hashes"""
+    import difflib
+    
+    def compute():
+        return list(difflib.unified_diff(old.content.splitlines(), new.content.splitlines(),
+                                         fromfile=f'revision {old.revision}', tofile=f'revision {new.revision}',
+                                         lineterm=''))
+    return revision_diff_cache.get((old.content_hash, new.content_hash), compute)
+
+@lru_cache(maxsize=CONTRACT_TEXT_CACHE_SIZE)
+def reconstruct_filled_content(template_revision_id, variables_json):
+    """Rebuild a delta-stored contract's text; revisions are immutable so results never go stale"""
+    import json
+    
+    revision = db.session.get(TemplateRevision, template_revision_id)
+    return fill_template(revision.content, json.loads(variables_json) if variables_json else {})
+
+def record_template_revision(template):
+    """Return the revision for the template's composed content, storing a new one if this content is new"""
+    existing = template.current_revision()
+    if existing is not None:
+        return existing
+    latest_number = 0
+    if template.id is not None:
+        latest_number = (db.session.query(db.func.max(TemplateRevision.revision))
+                         .filter_by(template_id=template.id).scalar() or 0)
+    revision = TemplateRevision(template=template, revision=latest_number + 1,
+                                content_hash=content_hash(template.resolved_content),
+                                content=template.resolved_content)
+    db.session.add(revision)
+    return revision
+
+def clause_composer(overrides=None):
+    """ClauseComposer over the clause library; overrides maps slugs to not yet saved clause content"""
+    overrides = overrides or {}
+    
+    def load(slug):
+        if slug in overrides:
+            return overrides[slug]
+        return db.session.query(Clause.content).filter_by(slug=slug).scalar()
+    return ClauseComposer(load)
+
+def compose_template(template, content, composer=None):
+    """Set template content, its composed text and clause dependencies; raises ClauseError"""
+    composed, slugs = (composer or clause_composer()).compose(content)
+    template.content = content
+    template.composed_content = composed if slugs else None
+    template.clauses = Clause.query.filter(Clause.slug.in_(slugs)).all() if slugs else []
+
+def recompose_dependents(clause, composer):
+    """Recompose the templates that use clause and record their new revisions; returns how many"""
+    templates = list(clause.templates)
     for template in templates:
-        if template.category not in templates_by_category:
-            templates_by_category[template.category] = []
-        templates_by_category[template.category].append(template)
+        compose_template(template, template.content, composer)
+        record_template_revision(template)
+    return len(templates)
+
+def including_clauses(slug):
+    """Clauses that include the given one directly"""
+    candidates = Clause.query.filter(Clause.content.contains(include_placeholder(slug))).all()
+    return [clause for clause in candidates if slug in included_slugs(clause.content)]
+
+def usage_increment(contract, sign=1):
+    """Rollup column deltas for adding (sign=1) or removing (sign=-1) one contract"""
+    timed = contract.render_seconds is not None
+    return {'contracts': sign, 'pdf_bytes': sign * (contract.pdf_size or 0),
+            'renders': sign if timed else 0, 'render_seconds': sign * (contract.render_seconds or 0.0)}
+
+def add_counters(model, keys, category, increments):
+    """Add to the counter row identified by keys in the current transaction, creating it if needed"""
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        # An atomic upsert, so concurrent workers never lose an increment or collide on the insert
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(model).values(category=category, **keys, **increments)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: getattr(model, name) + statement.excluded[name] for name in increments})
+        db.session.execute(statement)
+        return
+    updated = (model.query.filter_by(**keys)
+               .update({getattr(model, name): getattr(model, name) + value for name, value in increments.items()},
+                       synchronize_session=False))
+    if not updated:
+        db.session.add(model(category=category, **keys, **increments))
+
+def add_usage(day, template_id, category, increments):
+    """Add to one day's rollup row and to the template's all-time totals in the current transaction.
+    
+    Removals (negative increments) only apply to a day row that counted at least as many contracts:
+    contracts saved before the rollup existed were never added, so they are not subtracted either
+    and no negative rows appear. `usage_stats.py rebuild` counts those contracts.
+    """
+    if increments.get('contracts', 0) < 0:
+        def change(model):
+            return {getattr(model, name): getattr(model, name) + value for name, value in increments.items()}
+        
+        removed = (UsageRollup.query
+                   .filter(UsageRollup.day == day, UsageRollup.template_id == template_id,
+                           UsageRollup.contracts >= -increments['contracts'])
+                   .update(change(UsageRollup), synchronize_session=False))
+        if removed:
+            UsageTotal.query.filter_by(template_id=template_id).update(change(UsageTotal), synchronize_session=False)
+        return
+    add_counters(UsageRollup, {'day': day, 'template_id': template_id}, category, increments)
+    add_counters(UsageTotal, {'template_id': template_id}, category, increments)
+
+def record_usage(contract, category=None, sign=1):
+    """Count a contract being saved (sign=1) or deleted (sign=-1) in the usage rollup.
+    Runs in the caller's transaction, so the counters commit or roll back with the contract."""
+    add_usage(contract.created_at.date(), contract.template_id, category, usage_increment(contract, sign))
+
+def suggests_values(variable):
+    """Free-text variables; dates and amounts have their own inputs and are not suggested"""
+    name = variable.lower()
+    return not is_date_variable(variable) and not any(keyword in name for keyword in CURRENCY_VARIABLE_KEYWORDS)
+
+def suggestion_key(value):
+    return ' '.join(value.split()).casefold()
+
+def variable_value_counts(variables, counts=None, sign=1):
+    """Add a contract's suggestible values to counts: {(variable, key): [latest value, uses]}"""
+    counts = {} if counts is None else counts
+    for variable, value in (variables or {}).items():
+        value = ' '.join(str(value).split())
+        if not value or len(value) > SUGGESTION_VALUE_LENGTH or len(variable) > 100 or not suggests_values(variable):
+            continue
+        entry = counts.setdefault((variable, suggestion_key(value)), [value, 0])
+        entry[0] = value
+        entry[1] += sign
+    return counts
+
+def add_variable_values(counts):
+    """Apply variable_value_counts() deltas in the current transaction; values no contract uses are dropped"""
+    counts = {key: entry for key, entry in counts.items() if entry[1]}
+    if not counts:
+        return
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        # An atomic upsert, like add_usage(), so concurrent saves never lose a count
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(VariableValue).values([
+            {'variable': variable, 'value_key': key, 'value': value, 'uses': uses}
+            for (variable, key), (value, uses) in counts.items()])
+        statement = statement.on_conflict_do_update(
+            index_elements=['variable', 'value_key'],
+            set_={'uses': VariableValue.uses + statement.excluded.uses, 'value': statement.excluded.value})
+        db.session.execute(statement)
+    else:
+        for (variable, key), (value, uses) in counts.items():
+            row = VariableValue.query.filter_by(variable=variable, value_key=key).first()
+            if row is None:
+                db.session.add(VariableValue(variable=variable, value_key=key, value=value, uses=uses))
+            else:
+                row.uses += uses
+                row.value = value
+    if any(uses < 0 for _, uses in counts.values()):
+        from sqlalchemy import tuple_
+        
+        db.session.flush()
+        (VariableValue.query.filter(tuple_(VariableValue.variable, VariableValue.value_key).in_(list(counts)),
+                                    VariableValue.uses <= 0)
+         .delete(synchronize_session=False))
+
+def record_variable_values(variables, sign=1):
+    """Count a contract's variable values in the suggestion index when it is saved (sign=1) or
+    deleted (sign=-1); runs in the caller's transaction like record_usage()"""
+    add_variable_values(variable_value_counts(variables, sign=sign))
+
+def contract_variables(contract):
+    import json
+    
+    variables_json = contract.variables_json
+    return json.loads(variables_json) if variables_json else {}
+
+def suggestion_query(variable, prefix, limit=SUGGESTION_LIMIT):
+    """SELECT of the most used values of a variable that start with prefix, ignoring case and extra spaces.
+    A range rather than LIKE, so the lookup is a scan of one slice of the covering index."""
+    key = suggestion_key(prefix)
+    return (db.select(VariableValue.value)
+            .where(VariableValue.variable == variable, VariableValue.value_key >= key,
+                   VariableValue.value_key < key + '\U0010ffff')
+            .order_by(VariableValue.uses.desc(), VariableValue.value_key).limit(limit))
+
+def variable_suggestions(variable, prefix, limit=SUGGESTION_LIMIT):
+    """Suggested values; none without a prefix, which would rank every value of the variable"""
+    if not suggestion_key(prefix):
+        return []
+    return list(db.session.execute(suggestion_query(variable, prefix, limit)).scalars())
+
+def parse_date_value(value):
+    """The date a date variable was filled with, or None"""
+    for date_format in (DATE_VALUE_FORMAT, '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            continue
+    return None
+
+def deadline_kind(variable):
+    """'renewal', 'deadline', or None for date variables that are not deadlines (signing, start dates)"""
+    if not is_date_variable(variable):
+        return None
+    parts = variable.lower().split('_')
+    if any(part.startswith(keyword) for part in parts for keyword in RENEWAL_VARIABLE_KEYWORDS):
+        return 'renewal'
+    if any(part.startswith(keyword) for part in parts for keyword in DEADLINE_VARIABLE_KEYWORDS):
+        return 'deadline'
+    return None
+
+def contract_deadlines(variables, now=None):
+    """ContractDeadline rows for the deadlines still ahead in a contract's variables"""
+    from datetime import timedelta
+    
+    now = now or datetime.utcnow()
+    deadlines = []
+    for variable, value in (variables or {}).items():
+        kind = deadline_kind(variable)
+        due_on = parse_date_value(str(value)) if kind and len(variable) <= 100 else None
+        if due_on is None or due_on < now.date():
+            continue
+        notice = RENEWAL_NOTICE_DAYS if kind == 'renewal' else DEADLINE_NOTICE_DAYS
+        notify_at = datetime.combine(due_on - timedelta(days=notice), datetime.min.time())
+        # Never in the past: the scheduler's cursor may already be beyond it, and the notice is due now anyway
+        deadlines.append(ContractDeadline(variable=variable, kind=kind, due_on=due_on, notify_at=max(notify_at, now)))
+    return deadlines
+
+def upcoming_deadlines(start, days, limit=DEADLINE_PAGE_LIMIT):
+    """[(day, [(deadline, contract title, contract uuid)])] due in the days from start, from one range scan"""
+    from datetime import timedelta
+    
+    rows = (db.session.query(ContractDeadline, Contract.title, Contract.uuid)
+            .join(Contract, Contract.id == ContractDeadline.contract_id)
+            .filter(ContractDeadline.due_on >= start, ContractDeadline.due_on < start + timedelta(days=days))
+            .order_by(ContractDeadline.due_on, ContractDeadline.id).limit(limit).all())
+    grouped = []
+    for deadline, title, contract_uuid in rows:
+        if not grouped or grouped[-1][0] != deadline.due_on:
+            grouped.append((deadline.due_on, []))
+        grouped[-1][1].append((deadline, title, contract_uuid))
+    return grouped
+
+def due_deadlines_query(after_at, after_id, now, limit):
+    """Select of the deadlines whose notice is due, after the cursor (after_at, after_id) in
+    (notify_at, id) order; one range scan of ix_contract_deadline_notify_at_id"""
+    from sqlalchemy import select, and_, or_
+
+    query = (select(ContractDeadline.id, ContractDeadline.notify_at, ContractDeadline.variable, ContractDeadline.kind,
+                    ContractDeadline.due_on, Contract.uuid, Contract.title)
+             .join(Contract, Contract.id == ContractDeadline.contract_id)
+             .where(ContractDeadline.notify_at <= now))
+    if after_at is not None:
+        # The redundant lower bound keeps SQLite on one ordered index range instead of
+        # a MULTI-INDEX OR that sorts the whole backlog
+        query = query.where(ContractDeadline.notify_at >= after_at,
+                            or_(ContractDeadline.notify_at > after_at,
+                                and_(ContractDeadline.notify_at == after_at, ContractDeadline.id > after_id)))
+    return query.order_by(ContractDeadline.notify_at, ContractDeadline.id).limit(limit)
+
+def usage_summary(days=30):
+    """Dashboard figures: one row per template from UsageTotal and the day rows of the last `days`
+    days; the cost depends on neither the number of contracts nor the length of the history"""
+    from datetime import timedelta
+    from sqlalchemy import func
+    
+    totals = db.session.query(UsageTotal.template_id, UsageTotal.category, UsageTotal.contracts,
+                              UsageTotal.pdf_bytes, UsageTotal.renders, UsageTotal.render_seconds).all()
+    titles = dict(db.session.query(Template.id, Template.title))
+    templates = []
+    categories = {}
+    for template_id, category, contracts, pdf_bytes, renders, render_seconds in totals:
+        if contracts <= 0:
+            continue
+        row = {'template_id': template_id, 'title': titles.get(template_id, f'Deleted template #{template_id}'),
+               'category': category or 'Uncategorised', 'contracts': contracts, 'pdf_bytes': pdf_bytes,
+               'renders': renders, 'render_seconds': render_seconds,
+               'average_render_ms': render_seconds / renders * 1000 if renders else None}
+        templates.append(row)
+        total = categories.setdefault(row['category'], {'category': row['category'], 'contracts': 0,
+                                                        'pdf_bytes': 0, 'renders': 0, 'render_seconds': 0.0})
+        for name in ('contracts', 'pdf_bytes', 'renders', 'render_seconds'):
+            total[name] += row[name]
+    for total in categories.values():
+        total['average_render_ms'] = (total['render_seconds'] / total['renders'] * 1000
+                                      if total['renders'] else None)
+    
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    per_day = (db.session.query(UsageRollup.day, func.sum(UsageRollup.contracts), func.sum(UsageRollup.pdf_bytes))
+               .filter(UsageRollup.day >= since).group_by(UsageRollup.day).order_by(UsageRollup.day.desc()).all())
+    return {
+        'templates': sorted(templates, key=lambda row: -row['contracts']),
+        'categories': sorted(categories.values(), key=lambda row: -row['contracts']),
+        'days': [{'day': day, 'contracts': contracts, 'pdf_bytes': pdf_bytes} for day, contracts, pdf_bytes in per_day],
+        'total_contracts': sum(row['contracts'] for row in templates),
+        'total_pdf_bytes': sum(row['pdf_bytes'] for row in templates),
+        'days_shown': days,
+    }
+
+@app.route('/')
+def index():
+    """Category facets and the first page of one category; further pages come from /templates.json"""
+    facets = category_facets()
+    category = request.args.get('category')
+    if category not in dict(facets):
+        category = facets[0][0] if facets else None
+    templates, next_after = template_page(category) if category is not None else ([], None)
     
     success_message = request.args.get('success_message')
     
-    return render_template('index.html', templates_by_category=templates_by_category, success_message=success_message)
+    return render_template('index.html', facets=facets, category=category, templates=templates,
+                           next_url=templates_page_url(category, None, next_after),
+                           success_message=success_message)
+
+def templates_page_url(category, prefix, after):
+    if after is None:
+        return None
+    return url_for('templates_json', category=category, q=prefix or None, after_key=after[0], after_id=after[1])
+
+@app.route('/templates.json')
+def templates_json():
+    """A page of template cards for a category (category=) and/or title prefix (q=)"""
+    category = request.args.get('category') or None
+    prefix = request.args.get('q', '').strip() or None
+    if category is None and prefix is None:
+        abort(400, description='category or q is required')
+    after = None
+    if 'after_id' in request.args:
+        after_id = request.args.get('after_id', type=int)
+        if after_id is None:
+            abort(400, description='after_id must be an integer')
+        after = (request.args.get('after_key', ''), after_id)
+    templates, next_after = template_page(category, prefix, after)
+    return {'templates': templates, 'next': templates_page_url(category, prefix, next_after)}
+
+@app.route('/variable-suggestions.json')
+def variable_suggestions_json():
+    """Values entered for variable= in earlier contracts that start with q=, most used first"""
+    variable = request.args.get('variable', '')
+    if not variable:
+        abort(400, description='variable is required')
+    prefix = request.args.get('q', '')[:SUGGESTION_VALUE_LENGTH]
+    suggestions = variable_suggestions(variable, prefix) if suggests_values(variable) else []
+    response = make_response({'suggestions': suggestions})
+    # Short enough that new values show up soon, long enough to absorb backspacing
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    return response
 
 @app.route('/create-template', methods=['GET', 'POST'])
 def create_template():
@@ -80,6 +1229,7 @@ def create_template():
         title = request.form.get('title', '').strip()
         category = request.form.get('category', '').strip()
         content = request.form.get('content', '').strip()
+        render_profile = request.form.get('render_profile', '').strip() or None
         
         if not title or not category or not content:
             message = 'All fields are required!'
@@ -96,8 +1246,20 @@ def create_template():
             message_type = 'danger'
             return render_template('create_template.html', message=message, message_type=message_type)
         
-        new_template = Template(title=title, category=category, content=content)  # type: ignore
+        if render_profile and render_profile not in RENDER_PROFILES:
+            message = 'Unknown PDF render profile!'
+            message_type = 'danger'
+            return render_template('create_template.html', message=message, message_type=message_type)
+        
+        new_template = Template(title=title, category=category, render_profile=render_profile)  # type: ignore
+        try:
+            compose_template(new_template, content)
+        except ClauseError as e:
+            message = f'{e}!'
+            message_type = 'danger'
+            return render_template('create_template.html', message=message, message_type=message_type)
         db.session.add(new_template)
+        record_template_revision(new_template)
         db.session.commit()
         
         return redirect(url_for('index', success_message=f'Template "{title}" created successfully!'))
@@ -114,6 +1276,7 @@ def edit_template(id):
         title = request.form.get('title', '').strip()
         category = request.form.get('category', '').strip()
         content = request.form.get('content', '').strip()
+        render_profile = request.form.get('render_profile', '').strip() or None
         
         if not title or not category or not content:
             message = 'All fields are required!'
@@ -130,9 +1293,21 @@ def edit_template(id):
             message_type = 'danger'
             return render_template('edit_template.html', template=template, message=message, message_type=message_type)
         
+        if render_profile and render_profile not in RENDER_PROFILES:
+            message = 'Unknown PDF render profile!'
+            message_type = 'danger'
+            return render_template('edit_template.html', template=template, message=message, message_type=message_type)
+        
+        try:
+            compose_template(template, content)
+        except ClauseError as e:
+            message = f'{e}!'
+            message_type = 'danger'
+            return render_template('edit_template.html', template=template, message=message, message_type=message_type)
         template.title = title
         template.category = category
-        template.content = content
+        template.render_profile = render_profile
+        record_template_revision(template)
         
         db.session.commit()
         return redirect(url_for('index', success_message=f'Template "{template.title}" updated successfully!'))
@@ -152,7 +1327,7 @@ def delete_template(id):
 @app.route('/generate-contract/<int:id>', methods=['GET', 'POST'])
 def generate_contract(id):
     template = Template.query.get_or_404(id)
-    variables = extract_variables(template.content)
+    variables = template_variables(template.resolved_content)
     
     if request.method == 'POST':
         variables_dict = {}
@@ -161,15 +1336,15 @@ def generate_contract(id):
         for var in variables:
             value = request.form.get(var, '')
             # Format date fields nicely
-            if 'date' in var.lower() and value:
+            if is_date_variable(var) and value:
                 try:
                     date_obj = datetime.strptime(value, '%Y-%m-%d')
-                    value = date_obj.strftime('%B %d, %Y')
+                    value = date_obj.strftime(DATE_VALUE_FORMAT)
                 except ValueError:
                     error_message = f'Invalid date format for {var.replace("_", " ").title()}. Please use a valid date.'
                     break
             # Handle currency fields
-            elif any(keyword in var.lower() for keyword in ['amount', 'price', 'fee', 'cost', 'salary', 'rent', 'payment']) and value:
+            elif any(keyword in var.lower() for keyword in CURRENCY_VARIABLE_KEYWORDS) and value:
                 currency = request.form.get(f'{var}_currency', '$')
                 try:
                     float(value)
@@ -179,16 +1354,26 @@ def generate_contract(id):
                     break
             variables_dict[var] = value
         
+        signature_data = request.form.get('signature')
+        signature_strokes = request.form.get('signature_strokes')
+        if not error_message and signature_strokes:
+            # Vector capture; 'signature' (a PNG data URL) is still accepted from older clients
+            try:
+                signature_data = signature_from_strokes(signature_strokes,
+                                                        request.form.get('signature_width', 0, type=float),
+                                                        request.form.get('signature_height', 0, type=float))
+            except ValueError as e:
+                error_message = f'{e}. Please sign again.'
+        
         if error_message:
             return render_template('generate_contract.html', template=template, variables=variables, 
                                  error_message=error_message)
         
-        signature_data = request.form.get('signature')
-        
-        filled_content = fill_template(template.content, variables_dict)
+        filled_content = fill_template(template.resolved_content, variables_dict)
         
         return render_template('preview.html', 
                              template=template, 
+                             template_revision=template.current_revision(),
                              content=filled_content, 
                              signature=signature_data,
                              variables=variables_dict,
@@ -206,7 +1391,141 @@ def admin():
             templates_by_category[template.category] = []
         templates_by_category[template.category].append(template)
     
-    return render_template('admin.html', templates_by_category=templates_by_category)
+    return render_template('admin.html', templates_by_category=templates_by_category, usage=usage_summary())
+
+@app.route('/clauses')
+def clauses_list():
+    """The clause library, with how many templates use each clause"""
+    clauses = Clause.query.order_by(Clause.title).all()
+    usage = dict(db.session.query(template_clauses.c.clause_id, db.func.count())
+                 .group_by(template_clauses.c.clause_id).all())
+    return render_template('clauses.html', clauses=clauses, usage=usage)
+
+def clause_form_error(clause, title, content):
+    """Validation message for the clause form, or None"""
+    if not title or not content or (clause.id is None and not clause.slug):
+        return 'All fields are required!'
+    if clause.id is None and not SLUG_PATTERN.fullmatch(clause.slug):
+        return 'Clause slug must be lowercase letters, digits, "-" or "_", at most 100 characters!'
+    if clause.id is None and Clause.query.filter_by(slug=clause.slug).first() is not None:
+        return f'A clause with slug "{clause.slug}" already exists!'
+    if len(title) > 200:
+        return 'Clause title must be 200 characters or less!'
+    return None
+
+@app.route('/create-clause', methods=['GET', 'POST'])
+@app.route('/edit-clause/<int:id>', methods=['GET', 'POST'])
+def edit_clause(id=None):
+    """Create or edit a clause; saving one recomposes only the templates that use it"""
+    clause = Clause.query.get_or_404(id) if id is not None else Clause(slug='')
+    
+    if request.method == 'POST':
+        title = request.form.get('title', '').strip()
+        content = request.form.get('content', '').strip()
+        if clause.id is None:
+            clause.slug = request.form.get('slug', '').strip().lower()
+        
+        message = clause_form_error(clause, title, content)
+        composer = clause_composer({clause.slug: content})
+        if message is None:
+            try:
+                # Also catches an edit that would make the clause include itself through others
+                composer.clause(clause.slug)
+            except ClauseError as e:
+                message = f'{e}!'
+        if message is not None:
+            return render_template('edit_clause.html', clause=clause, title=title, content=content,
+                                   message=message, message_type='danger')
+        
+        clause.title = title
+        clause.content = content
+        clause.updated_at = datetime.utcnow()
+        if clause.id is None:
+            db.session.add(clause)
+        recomposed = recompose_dependents(clause, composer)
+        db.session.commit()
+        
+        success_message = f'Clause "{title}" saved'
+        if recomposed:
+            success_message += f'; {recomposed} template{"s" if recomposed != 1 else ""} updated'
+        return redirect(url_for('clauses_list', success_message=success_message + '!'))
+    
+    return render_template('edit_clause.html', clause=clause, title=clause.title or '', content=clause.content or '')
+
+@app.route('/delete-clause/<int:id>', methods=['POST'])
+def delete_clause(id):
+    """Delete a clause nothing includes any more"""
+    clause = Clause.query.get_or_404(id)
+    users = [template.title for template in clause.templates] + [c.title for c in including_clauses(clause.slug)]
+    if users:
+        return redirect(url_for('clauses_list', error_message=f'Clause "{clause.title}" is still used by '
+                                                              f'{", ".join(sorted(users))}.'))
+    title = clause.title
+    db.session.delete(clause)
+    db.session.commit()
+    return redirect(url_for('clauses_list', success_message=f'Clause "{title}" deleted successfully!'))
+
+@app.route('/admin/login', methods=['GET', 'POST'])
+def admin_login():
+    """Sign this browser in as admin with ADMIN_TOKEN, posted (never in the URL) with a CSRF token"""
+    if not ADMIN_TOKEN:
+        abort(404)
+    if not ADMIN_SESSIONS:
+        abort(403, description='Admin sign-in needs SESSION_SECRET to be set; use the X-Admin-Token header')
+    error_message = None
+    if request.method == 'POST':
+        if is_admin_token(request.form.get('token', '')):
+            session['admin'] = True
+            return redirect(url_for('admin_profiles'))
+        error_message = 'Wrong admin token'
+    return render_template('admin_login.html', error_message=error_message), 403 if error_message else 200
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    """Stored request profiles (admins only; browsers sign in at /admin/login)"""
+    if not is_admin():
+        if ADMIN_SESSIONS:
+            return redirect(url_for('admin_login'))
+        abort(404 if not ADMIN_TOKEN else 403)
+    return render_template('admin_profiles.html', profiles=list_profiles(PROFILES_DIR),
+                           sample_rate=PROFILE_SAMPLE_RATE)
+
+@app.route('/admin/profiles/<name>.folded')
+def download_profile(name):
+    """Folded stacks of one profile, for flamegraph.pl, inferno or speedscope"""
+    if not is_admin():
+        abort(404 if not ADMIN_TOKEN else 403)
+    if not PROFILE_NAME_PATTERN.fullmatch(name):
+        abort(404)
+    path = os.path.join(PROFILES_DIR, name + '.folded')
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=f'profile-{name}.folded')
+
+@app.route('/template/<int:id>/revisions')
+def template_revisions(id):
+    """List a template's revisions and optionally diff two of them"""
+    from sqlalchemy.orm import defer
+    
+    template = Template.query.get_or_404(id)
+    revisions = (TemplateRevision.query.filter_by(template_id=id)
+                 .options(defer(TemplateRevision.content))
+                 .order_by(TemplateRevision.revision.desc()).all())
+    contract_counts = dict(db.session.query(Contract.template_revision_id, db.func.count(Contract.id))
+                           .filter(Contract.template_id == id)
+                           .group_by(Contract.template_revision_id).all())
+    
+    diff = None
+    old_hash = request.args.get('from')
+    new_hash = request.args.get('to')
+    if old_hash and new_hash:
+        old = TemplateRevision.query.filter_by(template_id=id, content_hash=old_hash).first_or_404()
+        new = TemplateRevision.query.filter_by(template_id=id, content_hash=new_hash).first_or_404()
+        diff = revision_diff(old, new)
+    
+    return render_template('template_revisions.html', template=template, revisions=revisions,
+                           current_hash=content_hash(template.resolved_content), contract_counts=contract_counts,
+                           diff=diff, old_hash=old_hash, new_hash=new_hash)
 
 def generate_pdf_html(title, content, signature):
     """Generate HTML for PDF conversion"""
@@ -215,7 +1534,7 @@ def generate_pdf_html(title, content, signature):
     escaped_title = html_module.escape(title)
     escaped_content = html_module.escape(content)
     
-    if signature and not signature.startswith('data:image/'):
+    if signature and not is_valid_signature(signature):
         signature = ''
     
     escaped_signature = html_module.escape(signature, quote=True) if signature else ''
@@ -226,7 +1545,7 @@ def generate_pdf_html(title, content, signature):
         <div class="signature-section">
             <p><strong>Electronic Signature:</strong></p>
             <img src="{escaped_signature}" class="signature-image" alt="Signature" />
-            <p style="margin-top: 20px;"><small>Signed on: {datetime.now().strftime("%B %d, %Y at %I:%M %p")}</small></p>
+            <p style="margin-top: 20px;"><small>Signed on: {datetime.now().strftime(SIGNED_ON_FORMAT)}</small></p>
         </div>
         '''
     
@@ -276,30 +1595,140 @@ def generate_pdf_html(title, content, signature):
     </html>
     '''
 
-def save_contract_pdf(template_id, title, content, signature, variables_dict):
+def resolve_render_profile(*candidates):
+    """Return the first known render profile name among candidates, else the default"""
+    for name in candidates:
+        if name in RENDER_PROFILES:
+            return name
+    return DEFAULT_RENDER_PROFILE if DEFAULT_RENDER_PROFILE in RENDER_PROFILES else 'standard'
+
+@lru_cache(maxsize=1)
+def pdf_signing_service():
+    """Signing key and settings, loaded once per process on first use; None when signing is off"""
+    if not PDF_SIGNING_P12:
+        return None
+    from pdf_signing import PdfSigningService
+    
+    return PdfSigningService(PDF_SIGNING_P12, os.environ.get('PDF_SIGNING_P12_PASSWORD'),
+                             reason=os.environ.get('PDF_SIGNING_REASON', 'Contract generated and sealed'),
+                             location=os.environ.get('PDF_SIGNING_LOCATION'))
+
+@lru_cache(maxsize=1)
+def native_pdf_writer():
+    """Fonts for the native PDF writer, loaded once per process; None when it is disabled or unusable"""
+    if PDF_ENGINE != 'auto':
+        return None
+    from pdf_writer import PlainTextPdfWriter
+    try:
+        return PlainTextPdfWriter()
+    except (OSError, ValueError, struct.error) as e:
+        app.logger.warning('Native PDF writer unavailable, using WeasyPrint for every contract: %s', e)
+        return None
+
+def render_pdf_bytes(title, content, signature, options):
+    """PDF for the contract from the native writer when it can, else None"""
+    writer = native_pdf_writer()
+    if writer is None or WEASYPRINT_ONLY_OPTIONS & options.keys():
+        return None
+    if signature and not is_valid_signature(signature):
+        signature = ''
+    if not writer.can_render(title, content, signature):
+        return None
+    return writer.render(title, content, signature, compress=not options.get('uncompressed_pdf'))
+
+def render_contract_pdf(pdf_path, title, content, signature, render_profile=None):
+    """Render contract text and signature to a PDF file at pdf_path; returns True if it was digitally signed"""
+    try:
+        return write_contract_pdf(pdf_path, title, content, signature, render_profile)
+    finally:
+        render_recycler.record()
+
+def write_contract_pdf(pdf_path, title, content, signature, render_profile):
+    options = RENDER_PROFILES[resolve_render_profile(render_profile)]
+    signing = pdf_signing_service()
+    pdf_bytes = render_pdf_bytes(title, content, signature, options)
+    if pdf_bytes is None:
+        from weasyprint import HTML
+        
+        html_content = generate_pdf_html(title, content, signature)
+        if signing is None:
+            HTML(string=html_content, encoding='utf-8').write_pdf(pdf_path, **options)
+            return False
+        pdf_bytes = HTML(string=html_content, encoding='utf-8').write_pdf(**options)
+    if signing is None:
+        with open(pdf_path, 'wb') as f:
+            f.write(pdf_bytes)
+        return False
+    # Sign in memory so the PDF is written to disk once, already signed
+    signing.sign_to_file(pdf_bytes, pdf_path)
+    return True
+
+def save_contract_pdf(template_id, title, content, signature, variables_dict, render_profile=None,
+                      template_revision_id=None):
     """Save a contract to the database and generate PDF file"""
-    from weasyprint import HTML
     import json
     
+    template = db.session.get(Template, template_id)
+    render_profile = resolve_render_profile(render_profile, template.render_profile if template else None)
+    
+    revision = db.session.get(TemplateRevision, template_revision_id) if template_revision_id else None
+    if revision is None or revision.template_id != template_id:
+        revision = template.current_revision() if template else None
+    variables_json = json.dumps(variables_dict) if variables_dict else None
+    # Only store the delta when the text can be rebuilt exactly from it
+    use_delta = (CONTRACT_STORAGE == 'delta' and revision is not None
+                 and fill_template(revision.content, variables_dict or {}) == content)
+    dictionary_id = current_compression_dictionary_id() if CONTRACT_COMPRESSION == 'zstd' else None
+    
     contract_uuid = str(uuid.uuid4())
     safe_filename = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).replace(' ', '_')
     pdf_filename = f"{safe_filename}_{contract_uuid[:8]}.pdf"
     pdf_path = os.path.join(CONTRACTS_DIR, pdf_filename)
     
-    html_content = generate_pdf_html(title, content, signature)
-    HTML(string=html_content, encoding='utf-8').write_pdf(pdf_path)
+    render_seconds = None
+    signed = False
+    if RENDER_MODE != 'queue':
+        with render_limiter.slot():
+            render_start = time.perf_counter()
+            signed = render_contract_pdf(pdf_path, title, content, signature, render_profile)
+            render_seconds = time.perf_counter() - render_start
     
     contract = Contract(
         uuid=contract_uuid,
         template_id=template_id,
         title=title,
-        filled_content=content,
+        stored_content='' if use_delta else content,
+        content_storage='delta' if use_delta else 'full',
+        summary=content[:CONTRACT_SUMMARY_LENGTH],
+        template_revision_id=revision.id if revision else None,
         signature_data=signature,
         pdf_filename=pdf_filename,
-        variables_json=json.dumps(variables_dict) if variables_dict else None
+        variables_json=variables_json,
+        render_profile=render_profile,
+        pdf_size=os.path.getsize(pdf_path) if render_seconds is not None else None,
+        render_seconds=render_seconds,
+        pdf_signed_at=datetime.utcnow() if signed else None,
+        created_at=datetime.utcnow()
     )
+    if dictionary_id is not None:
+        contract.compress(dictionary_id)
+    if render_seconds is None:
+        contract.render_job = RenderJob()
+    contract.deadlines = contract_deadlines(variables_dict, contract.created_at)
     db.session.add(contract)
-    db.session.commit()
+    try:
+        record_usage(contract, template.category if template else None)
+        record_variable_values(variables_dict)
+        db.session.commit()
+    except Exception:
+        # Don't leave an orphan PDF behind when the row could not be stored
+        db.session.rollback()
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+        raise
+    
+    if render_seconds is not None:
+        schedule_thumbnail(pdf_path)
     
     return contract
 
@@ -310,6 +1739,8 @@ def save_and_download(template_id):
     signature = request.form.get('signature', '')
     template_title = request.form.get('template_title', 'contract')
     variables_json = request.form.get('variables_json', '{}')
+    render_profile = request.form.get('render_profile') or None
+    template_revision_id = request.form.get('template_revision_id', type=int)
     
     import json
     try:
@@ -317,25 +1748,379 @@ def save_and_download(template_id):
     except json.JSONDecodeError:
         variables_dict = {}
     
-    contract = save_contract_pdf(template_id, template_title, content, signature, variables_dict)
+    if render_profile and render_profile not in RENDER_PROFILES:
+        abort(400, description="Unknown PDF render profile")
+    
+    if signature and not is_valid_signature(signature):
+        signature = ''
+    
+    try:
+        template_title = parse_contract_title(template_title)
+    except ValueError as exc:
+        abort(400, description=str(exc))
+    
+    recipients = []
+    if request.form.get('send_to', '').strip():
+        try:
+            recipients = parse_recipients(request.form['send_to'])
+        except ValueError as exc:
+            abort(400, description=str(exc))
+        try:
+            check_delivery_limits(recipients, request.remote_addr)
+        except ValueError as exc:
+            abort(429, description=str(exc))
+    
+    contract = save_contract_pdf(template_id, template_title, content, signature, variables_dict, render_profile,
+                                 template_revision_id)
+    if recipients:
+        queue_delivery(contract, recipients, request.remote_addr)
+        db.session.commit()
     
     return redirect(url_for('download_contract', contract_uuid=contract.uuid))
 
+@app.errorhandler(RenderBusy)
+def render_busy(error):
+    """Shed load quickly instead of letting renders pile up in every worker"""
+    response = make_response(f'PDF rendering is busy ({error.reason}). Please try again shortly.', 503)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.route('/admin/render-queue')
+def render_queue_status():
+    """Render admission control and this process's recycling state for monitoring (admins only)"""
+    if not is_admin():
+        abort(404 if not ADMIN_TOKEN else 403)
+    return dict(render_limiter.snapshot(), recycler=render_recycler.snapshot())
+
+@app.route('/admin/render-jobs')
+def render_jobs_status():
+    """Render job queue state for monitoring (admins only)"""
+    from sqlalchemy import func
+    
+    if not is_admin():
+        abort(404 if not ADMIN_TOKEN else 403)
+    counts = dict(db.session.query(RenderJob.status, func.count(RenderJob.id)).group_by(RenderJob.status).all())
+    oldest = (db.session.query(func.min(RenderJob.created_at))
+              .filter(RenderJob.status.in_(['queued', 'running'])).scalar())
+    return {
+        'render_mode': RENDER_MODE,
+        'jobs': {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'dead')},
+        'oldest_pending_seconds': round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else None,
+    }
+
+@app.route('/admin/mail-queue')
+def mail_queue_status():
+    """Email delivery queue state for monitoring (admins only)"""
+    from sqlalchemy import func
+    
+    if not is_admin():
+        abort(404 if not ADMIN_TOKEN else 403)
+    counts = dict(db.session.query(ContractDelivery.status, func.count()).group_by(ContractDelivery.status).all())
+    sending = dict(db.session.query(ContractDelivery.domain, func.count())
+                   .filter(ContractDelivery.status == 'sending').group_by(ContractDelivery.domain).all())
+    oldest = (db.session.query(func.min(ContractDelivery.created_at))
+              .filter(ContractDelivery.status.in_(['queued', 'sending'])).scalar())
+    return {
+        'deliveries': {status: counts.get(status, 0) for status in ('queued', 'sending', 'sent', 'failed')},
+        'sending_by_domain': sending,
+        'domain_concurrency': MAIL_DOMAIN_CONCURRENCY,
+        'oldest_pending_seconds': round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else None,
+    }
+
+@app.route('/admin/purge-status')
+def purge_status():
+    """Progress and rate of contract_purge.py's bulk deletes and of its file unlinker, for monitoring (admins only)"""
+    from sqlalchemy import func
+    
+    if not is_admin():
+        abort(404 if not ADMIN_TOKEN else 403)
+    cursors = {cursor.name: cursor
+               for cursor in ProcessCursor.query.filter(ProcessCursor.name.in_(PURGE_PROCESSES))}
+    oldest_unlink = db.session.query(func.min(PendingUnlink.queued_at)).scalar()
+    return {
+        'processes': {name: {
+            'processed': cursor.processed,
+            'position': cursor.position_at.isoformat() if cursor.position_at else None,
+            'started_at': cursor.started_at.isoformat() if cursor.started_at else None,
+            'updated_at': cursor.updated_at.isoformat() if cursor.updated_at else None,
+            'per_second': round(cursor.rate, 1) if cursor.rate is not None else None,
+        } for name, cursor in cursors.items()},
+        'pending_unlinks': db.session.query(func.count(PendingUnlink.id)).scalar(),
+        'oldest_pending_unlink_seconds': (round((datetime.utcnow() - oldest_unlink).total_seconds(), 1)
+                                          if oldest_unlink else None),
+        'oldest_contract': (lambda oldest: oldest.isoformat() if oldest else None)(
+            db.session.query(func.min(Contract.created_at)).scalar()),
+    }
+
+def open_archived_pdf(pdf_filename):
+    """PackSlice of an archived PDF, or None if it is not archived"""
+    for _ in range(2):
+        location = (db.session.query(PdfPack.filename, ArchivedPdf.offset, ArchivedPdf.length)
+                    .join(PdfPack, PdfPack.id == ArchivedPdf.pack_id)
+                    .filter(ArchivedPdf.pdf_filename == pdf_filename).first())
+        if location is None:
+            return None
+        try:
+            return PackSlice(os.path.join(PACKS_DIR, location.filename), location.offset, location.length)
+        except FileNotFoundError:
+            # Compaction moved it to a new pack between the lookup and the open; look it up again
+            db.session.rollback()
+    return None
+
+def release_archived_pdf(pdf_filename):
+    """Drop an archived PDF from its pack's live counters, in the caller's transaction"""
+    archived = ArchivedPdf.query.filter_by(pdf_filename=pdf_filename).first()
+    if archived is None:
+        return
+    (PdfPack.query.filter_by(id=archived.pack_id)
+     .update({PdfPack.live_count: PdfPack.live_count - 1, PdfPack.live_bytes: PdfPack.live_bytes - archived.length},
+             synchronize_session=False))
+    db.session.delete(archived)
+
+class ConcurrentDelete(Exception):
+    """Some contracts of a bulk delete were deleted by someone else; the batch is rolled back"""
+
+def purge_batch_query(before, position=None, after=None, template_id=None, limit=CONTRACT_DELETE_BATCH_SIZE):
+    """Select of the oldest contracts created before `before` (and from `after`), past position
+    (created_at, id), loaded with what delete_contracts() reads; a range scan of ix_contract_created_at_id"""
+    from sqlalchemy import select, and_, or_
+    
+    query = (select(Contract).options(db.undefer(Contract.stored_variables_json),
+                                      db.undefer(Contract.compressed_variables))
+             .where(Contract.created_at < before))
+    if after is not None:
+        query = query.where(Contract.created_at >= after)
+    if template_id is not None:
+        query = query.where(Contract.template_id == template_id)
+    if position is not None:
+        # The redundant lower bound keeps SQLite on one ordered index range, as in due_deadlines_query()
+        query = query.where(Contract.created_at >= position[0],
+                            or_(Contract.created_at > position[0],
+                                and_(Contract.created_at == position[0], Contract.id > position[1])))
+    return query.order_by(Contract.created_at, Contract.id).limit(limit)
+
+def delete_contracts(contracts):
+    """Delete a batch of contracts with set-based statements in the caller's transaction.
+    
+    Does what delete_contract() does per row: the usage rollup, the suggestion index and the
+    pack counters are decremented (one upsert per day and template, per value, per pack), and
+    the rows the ORM would cascade to are deleted. Files are not touched: they are queued in
+    pending_unlink for `contract_purge.py unlink`. Raises ConcurrentDelete if any contract was
+    already gone. The contracts need their variables loaded (see purge_batch_query()).
+    """
+    from sqlalchemy import delete, insert
+    
+    if not contracts:
+        return 0
+    ids = [contract.id for contract in contracts]
+    filenames = [contract.pdf_filename for contract in contracts]
+    usage = {}
+    values = {}
+    for contract in contracts:
+        increments = usage.setdefault((contract.created_at.date(), contract.template_id), {})
+        for name, value in usage_increment(contract, sign=-1).items():
+            increments[name] = increments.get(name, 0) + value
+        variable_value_counts(contract_variables(contract), values, sign=-1)
+    for (day, template_id), increments in usage.items():
+        add_usage(day, template_id, None, increments)
+    add_variable_values(values)
+    
+    released = {}
+    archived_ids = []
+    for archived_id, pack_id, length in (db.session.query(ArchivedPdf.id, ArchivedPdf.pack_id, ArchivedPdf.length)
+                                         .filter(ArchivedPdf.pdf_filename.in_(filenames))):
+        count, size = released.get(pack_id, (0, 0))
+        released[pack_id] = (count + 1, size + length)
+        archived_ids.append(archived_id)
+    for pack_id, (count, size) in released.items():
+        (PdfPack.query.filter_by(id=pack_id)
+         .update({PdfPack.live_count: PdfPack.live_count - count, PdfPack.live_bytes: PdfPack.live_bytes - size},
+                 synchronize_session=False))
+    if archived_ids:
+        ArchivedPdf.query.filter(ArchivedPdf.id.in_(archived_ids)).delete(synchronize_session=False)
+    
+    # What the delete-orphan relationships cascade to when a single contract is deleted
+    for relationship in Contract.__mapper__.relationships:
+        if relationship.cascade.delete_orphan:
+            foreign_key, = relationship.remote_side
+            db.session.execute(delete(relationship.mapper.class_).where(foreign_key.in_(ids))
+                               .execution_options(synchronize_session=False))
+    result = db.session.execute(delete(Contract).where(Contract.id.in_(ids))
+                                .execution_options(synchronize_session=False))
+    if result.rowcount != len(ids):
+        raise ConcurrentDelete(f'{len(ids) - result.rowcount} of {len(ids)} contracts were already deleted')
+    db.session.execute(insert(PendingUnlink), [{'pdf_filename': filename} for filename in filenames])
+    return len(ids)
+
+def parse_recipients(text):
+    """Distinct email addresses from a comma, semicolon or newline separated list; ValueError names a bad one"""
+    from email.utils import getaddresses
+    
+    recipients = {}
+    for name, address in getaddresses([text.replace(';', ',').replace('\n', ',')]):
+        local, _, domain = address.rpartition('@')
+        if (not local or '.' not in domain or len(address) > 254
+                or any(c.isspace() or c in '<>,"' for c in address)):
+            raise ValueError(f'"{address or name}" is not an email address')
+        recipients.setdefault(address.lower(), address)
+    if not recipients:
+        raise ValueError('Enter at least one email address')
+    if len(recipients) > MAIL_MAX_RECIPIENTS:
+        raise ValueError(f'At most {MAIL_MAX_RECIPIENTS} recipients at a time')
+    return list(recipients.values())
+
+def parse_contract_title(text):
+    """The contract title from the preview form; ValueError if it is too long or has control characters"""
+    import unicodedata
+    
+    title = text.strip() or 'contract'
+    if len(title) > CONTRACT_TITLE_LENGTH:
+        raise ValueError(f'The title is longer than {CONTRACT_TITLE_LENGTH} characters')
+    if any(unicodedata.category(c) in ('Cc', 'Zl', 'Zp') for c in title):
+        raise ValueError('The title cannot contain line breaks or control characters')
+    return title
+
+def check_delivery_limits(recipients, client, contract=None):
+    """Raise ValueError if queueing recipients would exceed MAIL_CONTRACT_HOURLY_LIMIT for the contract
+    or MAIL_CLIENT_HOURLY_LIMIT for the client. Concurrent requests can overshoot by a request or two."""
+    from datetime import timedelta
+    
+    since = datetime.utcnow() - timedelta(hours=1)
+    recent = db.session.query(db.func.count(ContractDelivery.id)).filter(ContractDelivery.created_at >= since)
+    if contract is not None:
+        sent = recent.filter(ContractDelivery.contract_id == contract.id).scalar()
+        if sent + len(recipients) > MAIL_CONTRACT_HOURLY_LIMIT:
+            raise ValueError(f'This contract was already sent to many recipients in the last hour; '
+                             f'at most {MAIL_CONTRACT_HOURLY_LIMIT} per hour')
+    if recent.filter(ContractDelivery.requested_by == client).scalar() + len(recipients) > MAIL_CLIENT_HOURLY_LIMIT:
+        raise ValueError(f'Too many emails requested in the last hour; at most {MAIL_CLIENT_HOURLY_LIMIT} per hour')
+
+def queue_delivery(contract, recipients, requested_by=None):
+    """Queue the contract's PDF to each recipient, in the caller's transaction"""
+    for recipient in recipients:
+        contract.deliveries.append(ContractDelivery(recipient=recipient, domain=recipient.rpartition('@')[2].lower(),
+                                                    requested_by=requested_by))
+    contract.delivery_status = 'queued'
+
+def update_delivery_status(contract_id):
+    """Recompute a contract's delivery_status from its deliveries, in the caller's transaction"""
+    counts = dict(db.session.query(ContractDelivery.status, db.func.count())
+                  .filter(ContractDelivery.contract_id == contract_id).group_by(ContractDelivery.status).all())
+    if counts.get('queued') or counts.get('sending'):
+        status = 'queued'
+    elif counts.get('failed'):
+        status = 'partial' if counts.get('sent') else 'failed'
+    else:
+        status = 'sent' if counts.get('sent') else None
+    Contract.query.filter_by(id=contract_id).update({Contract.delivery_status: status}, synchronize_session=False)
+
 @app.route('/download/<contract_uuid>')
 def download_contract(contract_uuid):
     """Server-side download of stored contract PDF"""
     contract = Contract.query.filter_by(uuid=contract_uuid).first_or_404()
     pdf_path = os.path.join(CONTRACTS_DIR, contract.pdf_filename)
     
-    if not os.path.exists(pdf_path):
-        abort(404, description="PDF file not found")
+    if os.path.exists(pdf_path):
+        try:
+            return send_file(
+                pdf_path,
+                mimetype='application/pdf',
+                as_attachment=True,
+                download_name=contract.pdf_filename
+            )
+        except FileNotFoundError:
+            # Moved into a pack by pdf_archive.py since the check
+            pass
     
-    return send_file(
-        pdf_path,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=contract.pdf_filename
-    )
+    member = open_archived_pdf(contract.pdf_filename)
+    if member is not None:
+        from werkzeug.wsgi import wrap_file
+        
+        # wrap_file uses the server's file_wrapper, which can sendfile() straight from the pack
+        response = app.response_class(wrap_file(request.environ, member), mimetype='application/pdf',
+                                      direct_passthrough=True)
+        response.content_length = member.length
+        response.headers.set('Content-Disposition', 'attachment', filename=contract.pdf_filename)
+        return response
+    
+    job = contract.render_job
+    if job is not None and job.pending:
+        # Queued render: a page that reloads itself until the worker has written the PDF
+        response = make_response(render_template('rendering.html', contract=contract, job=job), 202)
+        response.headers['Retry-After'] = '2'
+        response.headers['Refresh'] = '2'
+        response.cache_control.no_store = True
+        return response
+    if job is not None and job.status == 'dead':
+        abort(500, description="The PDF could not be generated. Please try again later.")
+    abort(404, description="PDF file not found")
+
+EXPORT_BATCH_SIZE = 100
+
+def export_filename(contract, fmt):
+    return os.path.splitext(contract.pdf_filename)[0] + '.' + fmt
+
+def export_document(contract, fmt):
+    """(filename, title, content, signature, signed on, created) of a contract, as document_export takes them"""
+    signed_on = contract.created_at.strftime(SIGNED_ON_FORMAT) if contract.created_at else ''
+    return (export_filename(contract, fmt), contract.title, contract.filled_content, contract.signature_data or '',
+            signed_on, contract.created_at)
+
+def exported_documents(fmt, uuids=None):
+    """Documents for a bulk export, loaded in id order a batch at a time"""
+    query = Contract.query.options(db.undefer(Contract.stored_content), db.undefer(Contract.compressed_content),
+                                   db.undefer(Contract.stored_variables_json),
+                                   db.undefer(Contract.compressed_variables))
+    if uuids:
+        query = query.filter(Contract.uuid.in_(uuids))
+    last_id = 0
+    while True:
+        batch = query.filter(Contract.id > last_id).order_by(Contract.id).limit(EXPORT_BATCH_SIZE).all()
+        if not batch:
+            return
+        for contract in batch:
+            yield export_document(contract, fmt)
+        last_id = batch[-1].id
+        db.session.expunge_all()
+
+@app.route('/download/<contract_uuid>/<any(docx, odt):fmt>')
+def export_contract(contract_uuid, fmt):
+    """Contract as an editable Word or OpenDocument file, streamed as it is written"""
+    contract = Contract.query.filter_by(uuid=contract_uuid).first_or_404()
+    filename, *document = export_document(contract, fmt)
+    response = app.response_class(export_chunks(fmt, *document), mimetype=EXPORT_FORMATS[fmt])
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    return response
+
+@app.route('/contracts/export/<any(docx, odt):fmt>')
+def export_contracts(fmt):
+    """ZIP of every contract, or of those given as ?uuid=..., as Word or OpenDocument files"""
+    uuids = request.args.getlist('uuid')
+    if uuids and not db.session.query(Contract.query.filter(Contract.uuid.in_(uuids)).exists()).scalar():
+        abort(404, description="No such contracts")
+    response = app.response_class(stream_with_context(bulk_export_chunks(fmt, exported_documents(fmt, uuids))),
+                                  mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment',
+                         filename=f'contracts-{fmt}-{datetime.now().strftime("%Y%m%d")}.zip')
+    return response
+
+@app.route('/contract/<contract_uuid>/thumbnail.png')
+def contract_thumbnail(contract_uuid):
+    """First-page thumbnail, or a placeholder while it is still being generated"""
+    pdf_filename = (db.session.query(Contract.pdf_filename)
+                    .filter(Contract.uuid == contract_uuid).scalar())
+    if pdf_filename is None:
+        abort(404)
+    path = find_thumbnail(os.path.join(CONTRACTS_DIR, pdf_filename))
+    if path is not None:
+        response = send_file(path, mimetype='image/png', max_age=31536000)
+        response.cache_control.immutable = True
+        return response
+    
+    response = send_file(os.path.join(app.static_folder, 'img', 'thumbnail-placeholder.svg'),
+                         mimetype='image/svg+xml')
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/contracts')
 def contracts_list():
@@ -343,30 +2128,215 @@ def contracts_list():
     contracts = Contract.query.order_by(Contract.created_at.desc()).all()
     return render_template('contracts.html', contracts=contracts)
 
+@app.route('/deadlines')
+def deadlines_list():
+    """Contract deadlines and renewals coming up, day by day"""
+    from datetime import date
+    
+    days = max(1, min(request.args.get('days', 30, type=int), 366))
+    upcoming = upcoming_deadlines(date.today(), days)
+    truncated = sum(len(deadlines) for _, deadlines in upcoming) >= DEADLINE_PAGE_LIMIT
+    return render_template('deadlines.html', upcoming=upcoming, days=days, truncated=truncated)
+
+@lru_cache(maxsize=1)
+def contract_page_layout_version():
+    """Hash of everything a stored contract page depends on besides the contract itself"""
+    digest = hashlib.sha256()
+    for name in ('base.html', 'view_contract.html', 'fragments/head.html', 'fragments/nav.html',
+                 'fragments/scripts.html'):
+        digest.update(app.jinja_env.loader.get_source(app.jinja_env, name)[0].encode('utf-8'))
+    for filename in ('css/app.css', 'vendor/bootstrap/bootstrap.min.css',
+                     'vendor/bootstrap-icons/bootstrap-icons.min.css', 'vendor/bootstrap/bootstrap.min.js'):
+        digest.update(asset_url(filename).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def contract_page_response(html, etag, status=200):
+    """The stored page, revalidated on every use: the URL is not versioned, and a deleted contract
+    or a new layout version must reach the browser. Revalidating costs one indexed lookup and a 304."""
+    response = make_response(html, status)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/contract/<contract_uuid>')
 def view_contract(contract_uuid):
-    """View a specific contract"""
+    """View a specific contract, served from its stored page with a strong ETag"""
+    layout_version = contract_page_layout_version()
+    stored = (db.session.query(ContractPage.etag, ContractPage.layout_version)
+              .join(Contract, Contract.id == ContractPage.contract_id)
+              .filter(Contract.uuid == contract_uuid).first())
+    if stored is not None and stored.layout_version == layout_version:
+        if etag_matches(stored.etag):
+            return contract_page_response('', stored.etag, 304)
+        html = (db.session.query(ContractPage.html).join(Contract, Contract.id == ContractPage.contract_id)
+                .filter(Contract.uuid == contract_uuid).scalar())
+        return contract_page_response(html, stored.etag)
+    
+    contract = Contract.query.filter_by(uuid=contract_uuid).first_or_404()
+    html = render_template('view_contract.html', contract=contract)
+    etag = hashlib.sha256(html.encode('utf-8')).hexdigest()
+    if contract.page is None:
+        contract.page = ContractPage(layout_version=layout_version, etag=etag, html=html)
+    else:
+        contract.page.layout_version = layout_version
+        contract.page.etag = etag
+        contract.page.html = html
+    db.session.commit()
+    return contract_page_response(html, etag)
+
+@app.route('/csrf-token')
+def csrf_token_json():
+    """Fresh CSRF token for forms on cached pages, which cannot embed one"""
+    response = make_response({'csrf_token': generate_csrf()})
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/contract/<contract_uuid>/send', methods=['POST'])
+def send_contract(contract_uuid):
+    """Queue the contract's PDF to be emailed to the recipients by mail_worker.py"""
     contract = Contract.query.filter_by(uuid=contract_uuid).first_or_404()
-    return render_template('view_contract.html', contract=contract)
+    try:
+        recipients = parse_recipients(request.form.get('recipients', ''))
+        check_delivery_limits(recipients, request.remote_addr, contract)
+    except ValueError as exc:
+        return redirect(url_for('contracts_list', error_message=str(exc)))
+    queue_delivery(contract, recipients, request.remote_addr)
+    db.session.commit()
+    return redirect(url_for('contracts_list',
+                            success_message=f'"{contract.title}" queued for {", ".join(recipients)}'))
+
+@app.route('/contract/<contract_uuid>/deliveries.json')
+def contract_deliveries_json(contract_uuid):
+    """Email delivery status of a contract, per recipient (the stored contract page cannot show it)"""
+    contract = Contract.query.filter_by(uuid=contract_uuid).first_or_404()
+    response = make_response({
+        'status': contract.delivery_status,
+        'delivered_at': contract.delivered_at.isoformat() if contract.delivered_at else None,
+        'deliveries': [{'recipient': delivery.recipient, 'status': delivery.status, 'attempts': delivery.attempts,
+                        'sent_at': delivery.sent_at.isoformat() if delivery.sent_at else None,
+                        'last_error': delivery.last_error if delivery.status != 'sent' else None}
+                       for delivery in contract.deliveries],
+    })
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/contracts/delete', methods=['POST'])
+def delete_contracts_bulk():
+    """Delete the contracts given as repeated uuid fields, CONTRACT_DELETE_BATCH_SIZE per transaction.
+    Their files are queued for `contract_purge.py unlink`; ranges and retention go through contract_purge.py."""
+    uuids = list(dict.fromkeys(request.form.getlist('uuid')))
+    if not uuids:
+        abort(400, description='No contracts given')
+    if len(uuids) > BULK_DELETE_LIMIT:
+        abort(400, description=f'At most {BULK_DELETE_LIMIT} contracts per request')
+    deleted = 0
+    for start in range(0, len(uuids), CONTRACT_DELETE_BATCH_SIZE):
+        batch = db.session.execute(
+            db.select(Contract).options(db.undefer(Contract.stored_variables_json),
+                                        db.undefer(Contract.compressed_variables))
+            .where(Contract.uuid.in_(uuids[start:start + CONTRACT_DELETE_BATCH_SIZE]))).scalars().all()
+        try:
+            deleted += delete_contracts(batch)
+        except ConcurrentDelete as exc:
+            db.session.rollback()
+            abort(409, description=f'{exc}; nothing in this batch was deleted, please retry')
+        db.session.commit()
+        db.session.expunge_all()
+    return {'deleted': deleted, 'not_found': len(uuids) - deleted}
 
 @app.route('/delete-contract/<contract_uuid>', methods=['POST'])
 def delete_contract(contract_uuid):
     """Delete a contract and its PDF file"""
     contract = Contract.query.filter_by(uuid=contract_uuid).first_or_404()
-    
     pdf_path = os.path.join(CONTRACTS_DIR, contract.pdf_filename)
-    if os.path.exists(pdf_path):
-        os.remove(pdf_path)
     
+    # Remove the row first: a crash after the commit leaves an orphan file
+    # (which sweeper.py cleans up) rather than a row pointing at nothing.
+    # The stored view page and render job go with it through the cascade.
+    record_usage(contract, sign=-1)
+    record_variable_values(contract_variables(contract), sign=-1)
+    release_archived_pdf(contract.pdf_filename)
     db.session.delete(contract)
     db.session.commit()
     
+    if os.path.exists(pdf_path):
+        os.remove(pdf_path)
+    remove_thumbnail(pdf_path)
+    
     return redirect(url_for('contracts_list', success_message='Contract deleted successfully!'))
 
+def upgrade_schema():
+    """Add columns and indexes that create_all() does not add to already existing tables"""
+    from sqlalchemy import inspect, text
+    
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                with db.engine.begin() as connection:
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(db.engine)
+
+def ensure_template_revisions():
+    """Hash revisions and record a first revision for templates that predate revision history"""
+    for revision in TemplateRevision.query.filter(TemplateRevision.content_hash.is_(None)).all():
+        revision.content_hash = content_hash(revision.content)
+    
+    missing = (Template.query.outerjoin(TemplateRevision, TemplateRevision.template_id == Template.id)
+               .filter(TemplateRevision.id.is_(None)).all())
+    for template in missing:
+        record_template_revision(template)
+    db.session.commit()
+
+def ensure_usage_totals():
+    """Fill usage_total from the day rows of a rollup recorded before it existed"""
+    from sqlalchemy import func
+    
+    if UsageTotal.query.first() is not None:
+        return
+    for template_id, category, contracts, pdf_bytes, renders, render_seconds in (
+            db.session.query(UsageRollup.template_id, func.max(UsageRollup.category),
+                             func.sum(UsageRollup.contracts), func.sum(UsageRollup.pdf_bytes),
+                             func.sum(UsageRollup.renders), func.sum(UsageRollup.render_seconds))
+            .group_by(UsageRollup.template_id)):
+        db.session.add(UsageTotal(template_id=template_id, category=category, contracts=contracts,
+                                  pdf_bytes=pdf_bytes, renders=renders, render_seconds=render_seconds))
+    db.session.commit()
+
+def ensure_template_title_keys():
+    """Fill title_key for templates created before title search"""
+    for template in Template.query.filter(Template.title_key.is_(None)).all():
+        template.title_key = template.title.lower()
+    db.session.commit()
+
+def current_compression_dictionary_id():
+    """Newest dictionary, used for new contracts; None if zstandard or a dictionary is missing"""
+    if not contract_codec.available:
+        return None
+    return db.session.query(db.func.max(CompressionDictionary.id)).scalar()
+
+def create_compression_dictionary(samples=None, trained=False):
+    """Build and store a new dictionary, by default from every template revision"""
+    if samples is None:
+        samples = [content for (content,) in
+                   db.session.query(TemplateRevision.content).order_by(TemplateRevision.id)]
+    dictionary = CompressionDictionary(data=build_dictionary(samples, trained=trained), sample_count=len(samples))
+    db.session.add(dictionary)
+    db.session.commit()
+    return dictionary
+
 def init_db():
     """Initialize database with sample templates"""
     with app.app_context():
         db.create_all()
+        upgrade_schema()
         
         if Template.query.count() == 0:
             templates_data = [
@@ -1528,6 +3498,13 @@ Borrower: _______________  Date: _______________'''
             
             db.session.commit()
             print(f"Database initialized with {len(templates_data)} templates!")
+        
+        ensure_template_revisions()
+        ensure_template_title_keys()
+        ensure_usage_totals()
+        if (CONTRACT_COMPRESSION == 'zstd' and contract_codec.available
+                and current_compression_dictionary_id() is None):
+            create_compression_dictionary()
 
 if __name__ == '__main__':
     init_db()
@@ -0,0 +1 @@
+"""Performance reports. Run from the project root, e.g. `python -m benchmarks.render_profiles`."""
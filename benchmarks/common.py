@@ -0,0 +1,46 @@
+"""Helpers shared by the benchmark scripts"""
+import base64
+import time
+
+from app import Template, extract_variables, fill_template
+
+
+def seeded_templates():
+    """Return all templates in a stable order"""
+    return Template.query.order_by(Template.id).all()
+
+
+def sample_variables(content):
+    """Fill every variable with a plausible placeholder value"""
+    return {var: f'Sample {var.replace("_", " ").title()}' for var in extract_variables(content)}
+
+
+def sample_contract_text(template):
+    """Template content with every variable filled in"""
+    content = template.resolved_content
+    return fill_template(content, sample_variables(content))
+
+
+def signature_data_url(path):
+    """Read a PNG from disk and return it as a data URL, or '' when no path is given"""
+    if not path:
+        return ''
+    with open(path, 'rb') as f:
+        return 'data:image/png;base64,' + base64.b64encode(f.read()).decode('ascii')
+
+
+def timed(func, *args, **kwargs):
+    """Call func and return (result, elapsed seconds)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def print_table(headers, rows):
+    """Print rows as a plain aligned text table"""
+    widths = [max(len(str(cell)) for cell in column) for column in zip(headers, *rows)]
+    line = '  '.join(f'{{:<{width}}}' for width in widths)
+    print(line.format(*headers))
+    print(line.format(*('-' * width for width in widths)))
+    for row in rows:
+        print(line.format(*row))
@@ -0,0 +1,145 @@
+"""Database size and read/write latency of contract text storage modes.
+
+Writes the same synthetic contracts (seeded templates filled with random
+values) into one SQLite file per mode, then times random single-contract
+reads (including decompression) and a summary-only list page.
+
+    python -m benchmarks.contract_compression [--count 100000] [--reads 2000]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import uuid
+
+import zstandard
+
+from app import app, init_db, extract_variables, fill_template, CONTRACT_SUMMARY_LENGTH
+from benchmarks.common import seeded_templates, print_table
+from dictionary_codec import DictionaryCodec, build_dictionary, DEFAULT_LEVEL
+
+SCHEMA = '''CREATE TABLE contract (
+    id INTEGER PRIMARY KEY, uuid TEXT, title TEXT, filled_content TEXT, variables_json TEXT,
+    compressed_content BLOB, compressed_variables BLOB, dictionary_id INTEGER, summary TEXT,
+    created_at TEXT)'''
+INSERT = '''INSERT INTO contract (uuid, title, filled_content, variables_json, compressed_content,
+    compressed_variables, dictionary_id, summary, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+WORDS = ['Acme', 'Northwind', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Stark', 'Wayne', 'Tyrell',
+         'Street', 'Avenue', 'Road', 'Lagos', 'Abuja', 'London', 'Berlin', 'Services', 'Holdings', 'Ltd']
+
+
+def random_value(rng, name):
+    if 'date' in name:
+        return f'{rng.randint(2020, 2030)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+    if any(word in name for word in ('amount', 'price', 'fee', 'rent', 'salary', 'deposit')):
+        return f'{rng.randint(100, 500000):,}'
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+
+
+def synthetic_contracts(templates, count, seed=1):
+    rng = random.Random(seed)
+    for _ in range(count):
+        template = rng.choice(templates)
+        variables = {name: random_value(rng, name) for name in extract_variables(template.resolved_content)}
+        yield template.title, fill_template(template.resolved_content, variables), json.dumps(variables)
+
+
+def mode_encoders(dictionary):
+    """name -> (encode, decode) pairs; encode(text) returns the value stored for it"""
+    codec = DictionaryCodec(lambda dictionary_id: dictionary)
+    plain_compressor = zstandard.ZstdCompressor(level=DEFAULT_LEVEL)
+    plain_decompressor = zstandard.ZstdDecompressor()
+    return {
+        'text': None,
+        'zstd': (lambda text: plain_compressor.compress(text.encode('utf-8')),
+                 lambda data: plain_decompressor.decompress(data).decode('utf-8')),
+        'zstd + dictionary': (lambda text: codec.compress(text, 1),
+                              lambda data: codec.decompress(data, 1)),
+    }
+
+
+def write_database(path, contracts, encoder, batch_size=1000):
+    connection = sqlite3.connect(path)
+    connection.execute(SCHEMA)
+    created_at = time.strftime('%Y-%m-%d %H:%M:%S')
+    rows = []
+    start = time.perf_counter()
+    for title, content, variables_json in contracts:
+        summary = content[:CONTRACT_SUMMARY_LENGTH]
+        if encoder is None:
+            row = (str(uuid.uuid4()), title, content, variables_json, None, None, None, summary, created_at)
+        else:
+            encode = encoder[0]
+            row = (str(uuid.uuid4()), title, '', None, encode(content), encode(variables_json), 1, summary,
+                   created_at)
+        rows.append(row)
+        if len(rows) >= batch_size:
+            connection.executemany(INSERT, rows)
+            connection.commit()
+            rows = []
+    if rows:
+        connection.executemany(INSERT, rows)
+        connection.commit()
+    elapsed = time.perf_counter() - start
+    connection.execute('VACUUM')
+    connection.close()
+    return elapsed
+
+
+def read_latencies(path, encoder, ids):
+    connection = sqlite3.connect(path)
+    latencies = []
+    for contract_id in ids:
+        start = time.perf_counter()
+        content, variables_json, compressed_content, compressed_variables = connection.execute(
+            'SELECT filled_content, variables_json, compressed_content, compressed_variables '
+            'FROM contract WHERE id = ?', (contract_id,)).fetchone()
+        if encoder is not None:
+            content, variables_json = encoder[1](compressed_content), encoder[1](compressed_variables)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(100):
+        connection.execute('SELECT id, uuid, title, summary, created_at FROM contract '
+                           'ORDER BY id DESC LIMIT 50').fetchall()
+    list_latency = (time.perf_counter() - start) / 100
+    connection.close()
+    latencies.sort()
+    return latencies, list_latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100000, help='contracts written per mode')
+    parser.add_argument('--reads', type=int, default=2000, help='random single-contract reads per mode')
+    args = parser.parse_args()
+
+    init_db()
+    with app.app_context():
+        templates = seeded_templates()
+        dictionary = build_dictionary([template.resolved_content for template in templates])
+
+    ids = [random.Random(2).randint(1, args.count) for _ in range(args.reads)]
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, encoder in mode_encoders(dictionary).items():
+            path = os.path.join(directory, name.replace(' ', '') + '.db')
+            write_seconds = write_database(path, synthetic_contracts(templates, args.count), encoder)
+            latencies, list_latency = read_latencies(path, encoder, ids)
+            size = os.path.getsize(path)
+            rows.append((name, f'{size / 1048576:.1f} MiB', f'{size / args.count:.0f}',
+                         f'{write_seconds / args.count * 1e6:.0f}',
+                         f'{latencies[len(latencies) // 2] * 1e6:.0f}',
+                         f'{latencies[int(len(latencies) * 0.95)] * 1e6:.0f}',
+                         f'{list_latency * 1e3:.2f}'))
+
+    print(f'{args.count} contracts, {len(dictionary)} byte dictionary\n')
+    print_table(('mode', 'database', 'bytes/contract', 'write us', 'read p50 us', 'read p95 us', 'list page ms'),
+                rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Deleting many contracts: one per request against contract_purge.py's batches.
+
+Adds --contracts synthetic contracts (counted in the usage rollup and the
+suggestion index, with a deadline and a small PDF each) to the app's
+database, dated in 1990 and 1991 so no real contract is in range. Then it
+deletes the 1990 half the way /delete-contract/<uuid> does, a commit and a
+file removal per contract, and the 1991 half the way contract_purge.py
+does: purge() in --batch-size transactions, then the queued files removed
+unthrottled. The counters are checked to be back where they started. PDFs
+go to a temporary directory.
+
+    python -m benchmarks.contract_purge [--contracts 5000] [--batch-size 500]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import app as app_module
+import contract_purge
+from app import (app, db, init_db, Contract, PendingUnlink, ProcessCursor, UsageRollup, VariableValue,
+                 contract_deadlines, contract_variables, record_usage, record_variable_values, release_archived_pdf)
+from benchmarks.common import print_table
+from thumbnails import remove_thumbnail
+
+CURSOR_NAME = 'benchmark'
+
+
+def add_contracts(template_id, year, count, pdf_dir):
+    start = datetime(year, 1, 1)
+    for number in range(count):
+        key = uuid.uuid4().hex
+        contract = Contract(uuid=key, template_id=template_id, title=f'Purge benchmark {number}',
+                            pdf_filename=f'purge_benchmark_{key}.pdf', filled_content='Purge benchmark',
+                            pdf_size=4, created_at=start + timedelta(minutes=number))
+        contract.variables_json = json.dumps({'party_name': f'Party {number % 100}', 'due_date': f'{year + 40}-01-01'})
+        contract.deadlines = contract_deadlines(contract_variables(contract), datetime.utcnow())
+        db.session.add(contract)
+        db.session.flush()
+        record_usage(contract)
+        record_variable_values(contract_variables(contract))
+        with open(os.path.join(pdf_dir, contract.pdf_filename), 'wb') as pdf_file:
+            pdf_file.write(b'%PDF')
+        if number % 1000 == 999:
+            db.session.commit()
+            db.session.expunge_all()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def delete_one_by_one(year, pdf_dir):
+    """What /delete-contract/<uuid> does, for every contract of the year"""
+    uuids = [key for (key,) in db.session.query(Contract.uuid)
+             .filter(Contract.created_at >= datetime(year, 1, 1), Contract.created_at < datetime(year + 1, 1, 1))]
+    for key in uuids:
+        contract = Contract.query.filter_by(uuid=key).first()
+        pdf_path = os.path.join(pdf_dir, contract.pdf_filename)
+        record_usage(contract, sign=-1)
+        record_variable_values(contract_variables(contract), sign=-1)
+        release_archived_pdf(contract.pdf_filename)
+        db.session.delete(contract)
+        db.session.commit()
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+        remove_thumbnail(pdf_path)
+    return len(uuids)
+
+
+def unlink_queued():
+    """Remove the benchmark's queued files, without touching other queued ones or the unlink cursor"""
+    pending = PendingUnlink.query.filter(PendingUnlink.pdf_filename.like('purge_benchmark_%')).all()
+    for entry in pending:
+        contract_purge.unlink_file(entry.pdf_filename)
+        db.session.delete(entry)
+    db.session.commit()
+    return len(pending)
+
+
+def counters():
+    return (db.session.query(db.func.count(Contract.id)).scalar(),
+            db.session.query(db.func.sum(UsageRollup.contracts)).scalar() or 0,
+            db.session.query(db.func.sum(VariableValue.uses)).scalar() or 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--contracts', type=int, default=5000, help='contracts added, half deleted each way')
+    parser.add_argument('--batch-size', type=int, default=500, help='contracts per purge transaction')
+    args = parser.parse_args()
+
+    init_db()
+    half = args.contracts // 2
+    with app.app_context(), tempfile.TemporaryDirectory() as pdf_dir:
+        contracts_dir = app_module.CONTRACTS_DIR
+        app_module.CONTRACTS_DIR = contract_purge.CONTRACTS_DIR = pdf_dir
+        template_id = app_module.Template.query.order_by(app_module.Template.id).first().id
+        baseline = counters()
+        add_contracts(template_id, 1990, half, pdf_dir)
+        add_contracts(template_id, 1991, half, pdf_dir)
+
+        rows = []
+        start = time.perf_counter()
+        deleted = delete_one_by_one(1990, pdf_dir)
+        seconds = time.perf_counter() - start
+        rows.append(('one per request (rows and files)', deleted, f'{seconds:.2f}', f'{deleted / seconds:.0f}'))
+
+        start = time.perf_counter()
+        deleted = contract_purge.purge(CURSOR_NAME, datetime(1992, 1, 1), datetime(1991, 1, 1),
+                                       batch_size=args.batch_size, log=lambda message: None)
+        purge_seconds = time.perf_counter() - start
+        rows.append((f'purge, {args.batch_size} per transaction (rows)', deleted, f'{purge_seconds:.2f}',
+                     f'{deleted / purge_seconds:.0f}'))
+        start = time.perf_counter()
+        removed = unlink_queued()
+        seconds = time.perf_counter() - start
+        rows.append(('unlinker, unthrottled (files)', removed, f'{seconds:.2f}', f'{removed / seconds:.0f}'))
+
+        ProcessCursor.query.filter_by(name=CURSOR_NAME).delete()
+        db.session.commit()
+        left = counters()
+        app_module.CONTRACTS_DIR = contract_purge.CONTRACTS_DIR = contracts_dir
+    print_table(('method', 'contracts', 'seconds', 'per second'), rows)
+    print(f'\ncounters (contracts, rollup, value uses): before {baseline}, after {left}'
+          + ('' if left == baseline else '  MISMATCH'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Cost of the deadline scheduler's poll and of the deadlines page with many contracts.
+
+Fills a temporary SQLite database with --contracts contracts (default a
+million) carrying two deadlines each, due over the next two years, then
+times what deadline_scheduler.py runs every poll (the next batch of due
+notices after the cursor, from anywhere in the index) and the per-day
+listing behind /deadlines for one week and one month. The query plans are
+printed so a full scan would show.
+
+    python -m benchmarks.deadline_scan [--contracts 1000000] [--lookups 200]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from app import app, db, Contract, ContractDeadline, due_deadlines_query
+from benchmarks.common import print_table
+
+START = datetime(2030, 1, 1)
+SPAN_DAYS = 730
+END = START + timedelta(days=SPAN_DAYS)
+
+
+def fill(path, count, seed=1):
+    rng = random.Random(seed)
+    engine = create_engine(f'sqlite:///{path}')
+    Contract.__table__.create(engine)
+    ContractDeadline.__table__.create(engine)
+    connection = engine.raw_connection()
+    contracts = []
+    deadlines = []
+    for contract_id in range(1, count + 1):
+        contracts.append((contract_id, f'{contract_id:032x}', f'Contract {contract_id}', f'c{contract_id}.pdf'))
+        for variable, kind, notice in (('due_date', 'deadline', 7), ('end_date', 'renewal', 30)):
+            due_on = (START + timedelta(days=rng.randrange(SPAN_DAYS))).date()
+            notify_at = START + timedelta(days=(due_on - START.date()).days - notice, seconds=rng.randrange(86400))
+            deadlines.append((contract_id, variable, kind, due_on.isoformat(), notify_at.isoformat(' ')))
+        if len(contracts) >= 50000:
+            flush(connection, contracts, deadlines)
+    flush(connection, contracts, deadlines)
+    connection.commit()
+    connection.execute('ANALYZE')
+    connection.close()
+    return engine
+
+
+def flush(connection, contracts, deadlines):
+    connection.executemany("INSERT INTO contract (id, uuid, template_id, title, pdf_filename, filled_content) "
+                           "VALUES (?, ?, 1, ?, ?, '')", contracts)
+    connection.executemany('INSERT INTO contract_deadline (contract_id, variable, kind, due_on, notify_at) '
+                           'VALUES (?, ?, ?, ?, ?)', deadlines)
+    contracts.clear()
+    deadlines.clear()
+
+
+def upcoming_query(start, days):
+    """The select upcoming_deadlines() runs"""
+    return (db.select(ContractDeadline, Contract.title, Contract.uuid)
+            .join(Contract, Contract.id == ContractDeadline.contract_id)
+            .where(ContractDeadline.due_on >= start, ContractDeadline.due_on < start + timedelta(days=days))
+            .order_by(ContractDeadline.due_on, ContractDeadline.id).limit(500))
+
+
+def caught_up_query(after_at, after_id):
+    """A poll by a scheduler whose cursor is at now"""
+    return due_deadlines_query(after_at, after_id, after_at, 100)
+
+
+def percentiles(latencies):
+    latencies.sort()
+    return (f'{statistics.median(latencies):.2f}', f'{latencies[int(len(latencies) * 0.95)]:.2f}',
+            f'{latencies[-1]:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--contracts', type=int, default=1000000, help='contracts, with two deadlines each')
+    parser.add_argument('--lookups', type=int, default=200, help='queries per measurement')
+    args = parser.parse_args()
+
+    rng = random.Random(2)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'deadlines.db')
+        start = time.perf_counter()
+        engine = fill(path, args.contracts)
+        print(f'{args.contracts} contracts with {args.contracts * 2} deadlines in {time.perf_counter() - start:.0f} s, '
+              f'{os.path.getsize(path) / 1048576:.0f} MiB\n')
+
+        def cursor_at():
+            at = START + timedelta(days=rng.randrange(SPAN_DAYS), seconds=rng.randrange(86400))
+            return at, rng.randrange(args.contracts * 2)
+
+        with app.app_context(), engine.connect() as connection:
+            cases = [
+                ('scheduler poll, 100 due', lambda: due_deadlines_query(*cursor_at(), END, 100)),
+                ('scheduler poll, none due', lambda: caught_up_query(*cursor_at())),
+                ('deadlines page, 7 days', lambda: upcoming_query(cursor_at()[0].date(), 7)),
+                ('deadlines page, 30 days', lambda: upcoming_query(cursor_at()[0].date(), 30)),
+            ]
+            rows = []
+            for label, build in cases:
+                latencies = []
+                for _ in range(args.lookups):
+                    query = build()
+                    begin = time.perf_counter()
+                    connection.execute(query).all()
+                    latencies.append((time.perf_counter() - begin) * 1000)
+                rows.append((label,) + percentiles(latencies))
+                # Bound parameters, as the app runs it: literal values can get a different plan
+                compiled = build().compile(engine)
+                params = tuple(str(compiled.params[name]) for name in compiled.positiontup)
+                plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).all()
+                print(f'{label}: ' + '; '.join(row[-1] for row in plan))
+        engine.dispose()
+    print()
+    print_table(('query', 'p50 ms', 'p95 ms', 'max ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
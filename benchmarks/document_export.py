@@ -0,0 +1,102 @@
+"""Cost of the DOCX/ODT exports against rendering the PDF.
+
+For every seeded template (with a vector signature unless --no-signature)
+it reports the best-of---repeat time and the peak Python allocation of
+building the DOCX and ODT packages, of the native PDF writer and, when it
+can run here, of WeasyPrint. The PNG rendering of the signature that DOCX
+files carry is cached per signature in the app; the cache is cleared before
+every export so each one pays for it, as the first export of a contract
+does. Finally --bulk documents are streamed into one ZIP the way
+/contracts/export does.
+
+    python -m benchmarks.document_export [--repeat 5] [--bulk 200] [--no-signature]
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+
+from app import app, init_db
+from benchmarks.common import seeded_templates, sample_contract_text, timed, print_table
+from benchmarks.pdf_engines import weasyprint_renderer
+from benchmarks.signature_formats import synthetic_strokes, CANVAS_WIDTH, CANVAS_HEIGHT
+from document_export import export_chunks, bulk_export_chunks, signature_png
+from pdf_writer import PlainTextPdfWriter, SIGNED_ON_FORMAT
+from signatures import signature_from_strokes
+
+
+def exporter(fmt):
+    def export(title, content, signature, signed_on):
+        signature_png.cache_clear()
+        return b''.join(export_chunks(fmt, title, content, signature, signed_on))
+    return export
+
+
+def measure(func, repeat, *args):
+    """(output, best time in ms, peak traced KiB)"""
+    runs = [timed(func, *args) for _ in range(repeat)]
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return runs[-1][0], min(elapsed for _, elapsed in runs) * 1000, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per template and format')
+    parser.add_argument('--bulk', type=int, default=200, help='documents in the bulk export')
+    parser.add_argument('--no-signature', action='store_true', help='export without a signature section')
+    args = parser.parse_args()
+
+    init_db()
+    signature = ('' if args.no_signature
+                 else signature_from_strokes(json.dumps(synthetic_strokes()), CANVAS_WIDTH, CANVAS_HEIGHT))
+    signed_on = datetime.now().strftime(SIGNED_ON_FORMAT)
+    writer = PlainTextPdfWriter()
+    renderers = [('docx', exporter('docx')), ('odt', exporter('odt')),
+                 ('native pdf', lambda title, content, signature, signed_on:
+                     writer.render(title, content, signature, signed_on)
+                     if writer.can_render(title, content, signature) else None)]
+    weasyprint = weasyprint_renderer()
+    if weasyprint is not None:
+        renderers.append(('weasyprint pdf', lambda title, content, signature, signed_on:
+                          weasyprint(title, content, signature)))
+
+    rows = []
+    times = {name: [] for name, _ in renderers}
+    with app.app_context():
+        documents = [(template.title, sample_contract_text(template)) for template in seeded_templates()]
+    for title, content in documents:
+        for name, render in renderers:
+            output, ms, peak_kib = measure(render, args.repeat, title, content, signature, signed_on)
+            if output is None:
+                rows.append((title[:40], name, 'not eligible', '', ''))
+                continue
+            times[name].append(ms)
+            rows.append((title[:40], name, f'{ms:.2f}', f'{len(output) / 1024:.1f}', f'{peak_kib:.0f}'))
+
+    print(f'Best of {args.repeat} runs per template; peak is Python allocations during one run\n')
+    print_table(('template', 'format', 'ms', 'KiB', 'peak KiB'), rows)
+    print()
+    for name, values in times.items():
+        if values:
+            print(f'{name}: mean {statistics.mean(values):.2f} ms over {len(values)} templates')
+    if weasyprint is None:
+        print('WeasyPrint is not available here; the PDF baseline is the native writer only')
+
+    for fmt in ('docx', 'odt'):
+        batch = [(f'{number}.{fmt}', title, content, signature, signed_on, None)
+                 for number, (title, content) in enumerate(documents * (args.bulk // len(documents) + 1))][:args.bulk]
+        signature_png.cache_clear()
+        start = time.perf_counter()
+        size = sum(len(chunk) for chunk in bulk_export_chunks(fmt, batch))
+        seconds = time.perf_counter() - start
+        print(f'bulk {fmt}: {len(batch)} documents, {size / 1048576:.1f} MiB ZIP in {seconds:.2f} s '
+              f'({len(batch) / seconds:.0f} documents/s)')
+
+
+if __name__ == '__main__':
+    main()
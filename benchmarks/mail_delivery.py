@@ -0,0 +1,156 @@
+"""Throughput and memory of emailing contracts: pooled streaming against a connection per message.
+
+Starts a sink SMTP server in this process that accepts and discards
+everything, optionally delaying its greeting by --handshake-ms to stand in
+for the network round trips and TLS/AUTH handshakes of a real relay. Then
+it sends --messages contract emails with a --pdf-kib PDF attached, first
+the usual way (an email.message.EmailMessage built in memory and
+smtplib.sendmail() on a new connection per message), then the way
+mail_worker.py does (contract_message_chunks() over SmtpPool, on
+--connections threads). Finally it compares the peak Python allocation of
+both for one message with a --large-mib PDF.
+
+    python -m benchmarks.mail_delivery [--messages 200] [--connections 4] [--handshake-ms 20]
+"""
+import argparse
+import io
+import os
+import smtplib
+import socketserver
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+from benchmarks.common import print_table
+from mail_delivery import SmtpPool, contract_message_chunks, send_message
+
+SENDER = 'contracts@example.com'
+TEXT = 'Please find attached the contract "Benchmark".\n'
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept messages"""
+
+    def handle(self):
+        time.sleep(self.server.handshake_seconds)
+        self.wfile.write(b'220 sink ESMTP\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.wfile.write(b'250-sink\r\n250 8BITMIME\r\n')
+            elif command == b'DATA':
+                self.wfile.write(b'354 go ahead\r\n')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.count()
+                self.wfile.write(b'250 OK queued\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 bye\r\n')
+                return
+            else:
+                self.wfile.write(b'250 OK\r\n')
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handshake_seconds):
+        super().__init__(('127.0.0.1', 0), SinkHandler)
+        self.handshake_seconds = handshake_seconds
+        self.received = 0
+        self.lock = threading.Lock()
+
+    def count(self):
+        with self.lock:
+            self.received += 1
+
+
+def connection_per_message(port, recipient, pdf_path):
+    """Build the whole message in memory and send it on a fresh connection"""
+    message = EmailMessage()
+    message['From'] = SENDER
+    message['To'] = recipient
+    message['Subject'] = 'Benchmark'
+    message.set_content(TEXT)
+    with open(pdf_path, 'rb') as pdf_file:
+        message.add_attachment(pdf_file.read(), maintype='application', subtype='pdf',
+                               filename=os.path.basename(pdf_path))
+    with smtplib.SMTP('127.0.0.1', port) as smtp:
+        smtp.send_message(message)
+
+
+def pooled_stream(pool, recipient, pdf_path):
+    with open(pdf_path, 'rb') as pdf_file, pool.connection() as smtp:
+        send_message(smtp, SENDER, recipient, contract_message_chunks(SENDER, recipient, 'Benchmark', TEXT,
+                                                                      os.path.basename(pdf_path), pdf_file))
+
+
+def throughput(send, messages, connections, *args):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        for future in [executor.submit(send, *args, f'user{number}@example.org') for number in range(messages)]:
+            future.result()
+    return time.perf_counter() - start
+
+
+def peak_kib(func, *args):
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def write_pdf(path, size):
+    with open(path, 'wb') as pdf_file:
+        pdf_file.write(b'%PDF-1.7\n')
+        pdf_file.write(os.urandom(size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200, help='messages sent per method')
+    parser.add_argument('--connections', type=int, default=4, help='sender threads (and pooled connections)')
+    parser.add_argument('--handshake-ms', type=float, default=20, help='delay before the server greeting')
+    parser.add_argument('--pdf-kib', type=int, default=60, help='PDF size for the throughput runs')
+    parser.add_argument('--large-mib', type=int, default=20, help='PDF size for the memory comparison')
+    args = parser.parse_args()
+
+    server = SinkServer(args.handshake_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    with tempfile.TemporaryDirectory() as directory:
+        pdf_path = os.path.join(directory, 'contract.pdf')
+        write_pdf(pdf_path, args.pdf_kib * 1024)
+        rows = []
+        seconds = throughput(lambda recipient: connection_per_message(port, recipient, pdf_path),
+                             args.messages, args.connections)
+        rows.append(('connection per message', args.messages, f'{seconds:.2f}', f'{args.messages / seconds:.0f}'))
+        pool = SmtpPool('127.0.0.1', port, size=args.connections)
+        seconds = throughput(lambda recipient: pooled_stream(pool, recipient, pdf_path),
+                             args.messages, args.connections)
+        rows.append((f'pooled ({pool.stats["connections"]} connections)', args.messages, f'{seconds:.2f}',
+                     f'{args.messages / seconds:.0f}'))
+        print(f'{args.pdf_kib} KiB PDF, {args.connections} threads, {args.handshake_ms:.0f} ms handshake\n')
+        print_table(('method', 'messages', 'seconds', 'messages/s'), rows)
+
+        write_pdf(pdf_path, args.large_mib * 1048576)
+        in_memory = peak_kib(connection_per_message, port, 'large@example.org', pdf_path)
+        streamed = peak_kib(pooled_stream, pool, 'large@example.org', pdf_path)
+        pool.close_idle()
+        print(f'\npeak Python allocation sending a {args.large_mib} MiB PDF: in memory {in_memory / 1024:.1f} MiB, '
+              f'streamed {streamed / 1024:.2f} MiB')
+    server.shutdown()
+    print(f'{server.received} messages received')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""First-request and steady-state render time of the main pages.
+
+Each configuration runs in a fresh Python process, so the first GET of every
+page includes whatever template loading and compiling that configuration
+leaves to the request:
+
+- reload, no cache: the old setup, every template compiled from source in
+  each process and its file checked for changes on every render
+- cold bytecode cache: compiled from source, bytecode written to the cache
+- warm bytecode cache: a second process that loads the cached bytecode
+- precompiled: warm cache and precompile_templates() at startup, as main.py
+  does; the startup time is reported separately
+
+    python -m benchmarks.page_render [--requests 200]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import print_table
+
+PAGES = ['/', '/generate-contract/1', '/create-template', '/contracts', '/admin', '/template/1/revisions']
+
+
+def worker(requests, precompile):
+    """Measure every page in this process and print the results as JSON"""
+    from app import app, init_db, precompile_templates
+
+    init_db()
+    startup_ms = 0.0
+    if precompile:
+        start = time.perf_counter()
+        precompile_templates()
+        startup_ms = (time.perf_counter() - start) * 1000
+    client = app.test_client()
+    results = {'startup_ms': startup_ms, 'pages': {}}
+    for page in PAGES:
+        start = time.perf_counter()
+        status = client.get(page).status_code
+        first_ms = (time.perf_counter() - start) * 1000
+        if status != 200:
+            continue
+        times = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            client.get(page)
+            times.append((time.perf_counter() - start) * 1000)
+        results['pages'][page] = {'first_ms': first_ms, 'mean_ms': statistics.mean(times),
+                                  'p95_ms': statistics.quantiles(times, n=20)[-1]}
+    print(json.dumps(results))
+
+
+def run_worker(requests, cache_dir, auto_reload, precompile):
+    env = dict(os.environ, TEMPLATE_CACHE_DIR=cache_dir, TEMPLATES_AUTO_RELOAD='1' if auto_reload else '0')
+    command = [sys.executable, '-m', 'benchmarks.page_render', '--worker', '--requests', str(requests)]
+    if precompile:
+        command.append('--precompile')
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='steady-state GETs per page')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--precompile', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.requests, args.precompile)
+        return
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        configurations = [
+            ('reload, no cache', run_worker(args.requests, '', True, False)),
+            ('cold bytecode cache', run_worker(args.requests, cache_dir, False, False)),
+            ('warm bytecode cache', run_worker(args.requests, cache_dir, False, False)),
+            ('precompiled', run_worker(args.requests, cache_dir, False, True)),
+        ]
+
+    rows = []
+    for page in PAGES:
+        for name, results in configurations:
+            timing = results['pages'].get(page)
+            if timing is None:
+                continue
+            rows.append((page, name, f'{timing["first_ms"]:.1f}', f'{timing["mean_ms"]:.2f}',
+                         f'{timing["p95_ms"]:.2f}'))
+    print(f'{args.requests} GETs per page after the first\n')
+    print_table(('page', 'configuration', 'first ms', 'mean ms', 'p95 ms'), rows)
+    print()
+    for name, results in configurations:
+        pages = results['pages'].values()
+        print(f'{name}: first requests {sum(p["first_ms"] for p in pages):.0f} ms in total, '
+              f'mean {statistics.mean(p["mean_ms"] for p in pages):.2f} ms per page'
+              + (f', startup precompile {results["startup_ms"]:.0f} ms' if results['startup_ms'] else ''))
+
+
+if __name__ == '__main__':
+    main()
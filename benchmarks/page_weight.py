@@ -0,0 +1,66 @@
+"""Transfer size of the main pages and the static assets they reference.
+
+Fetches each page through the test client with and without compression and
+adds up the local stylesheets, scripts and fonts it links to. Assets still
+loaded from a CDN are listed but not counted.
+
+    python -m benchmarks.page_weight
+"""
+import re
+from urllib.parse import urlsplit
+
+from app import app, init_db
+from benchmarks.common import print_table
+
+PAGES = ['/', '/admin', '/contracts', '/create-template', '/generate-contract/1']
+ASSET_PATTERN = re.compile(r'(?:href|src)="([^"]+\.(?:css|js)(?:\?[^"]*)?)"')
+FONT_PATTERN = re.compile(r'url\("?([^")]+\.woff2)[^)]*\)')
+
+
+def fetch(client, url, encoding):
+    response = client.get(url, headers={'Accept-Encoding': encoding})
+    response.direct_passthrough = False
+    return response, len(response.get_data())
+
+
+def asset_urls(client, html):
+    """Local asset URLs referenced by a page, including fonts referenced from its CSS"""
+    local = []
+    remote = []
+    for url in ASSET_PATTERN.findall(html):
+        (remote if urlsplit(url).netloc else local).append(url)
+    for url in list(local):
+        if '.css' in url:
+            css = client.get(url).get_data(as_text=True)
+            base = url.split('?')[0].rsplit('/', 1)[0]
+            local.extend(f'{base}/{font}' for font in FONT_PATTERN.findall(css))
+    return local, remote
+
+
+def main():
+    init_db()
+    client = app.test_client()
+    rows = []
+    remote_assets = set()
+    for page in PAGES:
+        response, html_raw = fetch(client, page, 'identity')
+        if response.status_code != 200:
+            continue
+        _, html_compressed = fetch(client, page, 'br, gzip')
+        local, remote = asset_urls(client, response.get_data(as_text=True))
+        remote_assets.update(remote)
+        assets_raw = sum(fetch(client, url, 'identity')[1] for url in local)
+        assets_compressed = sum(fetch(client, url, 'br, gzip')[1] for url in local)
+        rows.append((page, html_raw, html_compressed, assets_raw, assets_compressed,
+                     html_compressed + assets_compressed, html_compressed))
+
+    print_table(('page', 'html', 'html (compressed)', 'assets', 'assets (compressed)',
+                 'first visit', 'repeat visit'), rows)
+    if remote_assets:
+        print('\nNot counted (loaded from CDN):')
+        for url in sorted(remote_assets):
+            print(f'  {url}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Render time of the native PDF writer vs WeasyPrint, and how close they look.
+
+Renders every seeded template (with a vector signature unless --no-signature)
+with both engines and reports the time per template and the speedup. With
+--visual-diff DIR, both PDFs are rasterised (pypdfium2 if installed,
+otherwise pdftoppm), compared page by page, and the share of pixels that
+differ noticeably is reported; side-by-side images of each page and its
+difference are written to DIR. WeasyPrint columns are left empty when it
+cannot render here.
+
+    python -m benchmarks.pdf_engines [--repeat 5] [--no-signature] [--visual-diff diffs/]
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+from app import app, init_db, generate_pdf_html
+from benchmarks.common import seeded_templates, sample_contract_text, timed, print_table
+from benchmarks.signature_formats import synthetic_strokes, CANVAS_WIDTH, CANVAS_HEIGHT
+from pdf_writer import PlainTextPdfWriter, SIGNED_ON_FORMAT
+from signatures import signature_from_strokes
+
+RASTER_DPI = 72
+# Grey levels (0-255) two pixels may differ by before they count as different
+PIXEL_TOLERANCE = 64
+
+
+def weasyprint_renderer():
+    try:
+        from weasyprint import HTML
+    except (ImportError, OSError):
+        return None
+    return lambda title, content, signature: HTML(string=generate_pdf_html(title, content, signature),
+                                                  encoding='utf-8').write_pdf()
+
+
+def rasterise(pdf_bytes, directory, name):
+    """Greyscale PIL images of every page"""
+    from PIL import Image
+
+    try:
+        import pypdfium2
+    except ImportError:
+        pypdfium2 = None
+    if pypdfium2 is not None:
+        document = pypdfium2.PdfDocument(pdf_bytes)
+        try:
+            return [page.render(scale=RASTER_DPI / 72).to_pil().convert('L') for page in document]
+        finally:
+            document.close()
+    if not shutil.which('pdftoppm'):
+        raise RuntimeError('--visual-diff needs pypdfium2 or pdftoppm')
+    pdf_path = os.path.join(directory, f'{name}.pdf')
+    with open(pdf_path, 'wb') as f:
+        f.write(pdf_bytes)
+    subprocess.run(['pdftoppm', '-gray', '-r', str(RASTER_DPI), pdf_path, os.path.join(directory, name)],
+                   check=True)
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, f'{name}-*.pgm'))):
+        with Image.open(path) as image:
+            pages.append(image.convert('L'))
+    return pages
+
+
+def compare(native_pages, weasyprint_pages, output_dir, name):
+    """Percentage of differing pixels over all pages; writes native | weasyprint | difference images"""
+    from PIL import Image, ImageChops
+
+    differing = 0
+    total = 0
+    for number in range(max(len(native_pages), len(weasyprint_pages))):
+        native = native_pages[number] if number < len(native_pages) else None
+        weasy = weasyprint_pages[number] if number < len(weasyprint_pages) else None
+        size = (native or weasy).size
+        native = native or Image.new('L', size, 255)
+        weasy = (weasy or Image.new('L', size, 255)).resize(size)
+        difference = ImageChops.difference(native, weasy)
+        differing += sum(difference.point(lambda value: 255 if value > PIXEL_TOLERANCE else 0).histogram()[255:])
+        total += size[0] * size[1]
+        sheet = Image.new('L', (size[0] * 3, size[1]), 255)
+        sheet.paste(native, (0, 0))
+        sheet.paste(weasy, (size[0], 0))
+        sheet.paste(ImageChops.invert(difference), (size[0] * 2, 0))
+        sheet.save(os.path.join(output_dir, f'{name}-page{number + 1}.png'))
+    return differing / total * 100 if total else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='renders per template and engine')
+    parser.add_argument('--no-signature', action='store_true', help='render without a signature section')
+    parser.add_argument('--visual-diff', metavar='DIR', help='compare rasterised pages and write diff images here')
+    args = parser.parse_args()
+
+    init_db()
+    signature = ('' if args.no_signature
+                 else signature_from_strokes(json.dumps(synthetic_strokes()), CANVAS_WIDTH, CANVAS_HEIGHT))
+    # Both engines print the same signing time
+    signed_on = datetime.now().strftime(SIGNED_ON_FORMAT)
+    writer, load_seconds = timed(PlainTextPdfWriter)
+    weasyprint = weasyprint_renderer()
+    if args.visual_diff:
+        os.makedirs(args.visual_diff, exist_ok=True)
+
+    rows = []
+    native_times = []
+    weasyprint_times = []
+    with app.app_context(), tempfile.TemporaryDirectory() as tmp_dir:
+        for template in seeded_templates():
+            content = sample_contract_text(template)
+            if not writer.can_render(template.title, content, signature):
+                rows.append((template.id, template.title[:40], 'not eligible', '', '', '', '', ''))
+                continue
+            runs = [timed(writer.render, template.title, content, signature, signed_on) for _ in range(args.repeat)]
+            native_pdf = runs[-1][0]
+            native_ms = min(elapsed for _, elapsed in runs) * 1000
+            native_times.append(native_ms)
+            row = [template.id, template.title[:40], f'{native_ms:.1f}', f'{len(native_pdf) / 1024:.1f}']
+            if weasyprint is None:
+                rows.append(tuple(row + ['', '', '', '']))
+                continue
+            runs = [timed(weasyprint, template.title, content, signature) for _ in range(args.repeat)]
+            weasyprint_pdf = runs[-1][0]
+            weasyprint_ms = min(elapsed for _, elapsed in runs) * 1000
+            weasyprint_times.append(weasyprint_ms)
+            row += [f'{weasyprint_ms:.1f}', f'{len(weasyprint_pdf) / 1024:.1f}', f'{weasyprint_ms / native_ms:.0f}x']
+            if args.visual_diff:
+                name = f'template-{template.id}'
+                native_pages = rasterise(native_pdf, tmp_dir, f'{name}-native')
+                weasyprint_pages = rasterise(weasyprint_pdf, tmp_dir, f'{name}-weasyprint')
+                percent = compare(native_pages, weasyprint_pages, args.visual_diff, name)
+                pages = (f'{len(native_pages)}' if len(native_pages) == len(weasyprint_pages)
+                         else f'{len(native_pages)} vs {len(weasyprint_pages)}')
+                row.append(f'{percent:.2f}% ({pages} pages)')
+            else:
+                row.append('')
+            rows.append(tuple(row))
+
+    print(f'Native writer: fonts loaded in {load_seconds * 1000:.0f} ms; '
+          f'best of {args.repeat} renders per template\n')
+    print_table(('id', 'template', 'native ms', 'native KiB', 'weasyprint ms', 'weasyprint KiB', 'speedup',
+                 'pixels differing'), rows)
+    if native_times:
+        print(f'\nnative: mean {statistics.mean(native_times):.1f} ms over {len(native_times)} templates')
+    if weasyprint_times:
+        print(f'weasyprint: mean {statistics.mean(weasyprint_times):.1f} ms; '
+              f'speedup {statistics.mean(weasyprint_times) / statistics.mean(native_times):.0f}x')
+    elif weasyprint is None:
+        print('WeasyPrint is not available here; only the native writer was measured')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Throughput of PDF signing with and without cached key material.
+
+Signs the same documents three ways: reloading the PKCS#12 file for every
+document, reusing the loaded key, and reusing the key together with the
+precomputed signature size (what PdfSigningService does). Documents are the
+seeded templates rendered by WeasyPrint, or a blank page when WeasyPrint
+cannot render here. A throwaway self-signed key is used unless --p12 is given.
+
+    python -m benchmarks.pdf_signing [--documents 50] [--p12 signing.p12 --passphrase ...]
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+from app import app, init_db, generate_pdf_html
+from benchmarks.common import seeded_templates, sample_contract_text, print_table
+from pdf_signing import PdfSigningService, IncrementalPdfFileWriter, blank_pdf, create_self_signed_p12, signers
+
+
+def sample_documents(count):
+    """Rendered seeded templates, or blank pages if WeasyPrint is unavailable"""
+    try:
+        from weasyprint import HTML
+
+        with app.app_context():
+            templates = seeded_templates()
+            documents = [HTML(string=generate_pdf_html(t.title, sample_contract_text(t), ''),
+                              encoding='utf-8').write_pdf()
+                         for t in templates[:min(count, len(templates))]]
+        return [documents[i % len(documents)] for i in range(count)], 'seeded templates'
+    except (ImportError, OSError):
+        return [blank_pdf()] * count, 'blank page (WeasyPrint unavailable)'
+
+
+def sign_reloading(p12_path, passphrase, documents):
+    for document in documents:
+        signer = signers.SimpleSigner.load_pkcs12(p12_path, passphrase=passphrase.encode('utf-8'))
+        metadata = signers.PdfSignatureMetadata(field_name='ContractSignature', md_algorithm='sha256')
+        signers.PdfSigner(metadata, signer=signer).sign_pdf(IncrementalPdfFileWriter(io.BytesIO(document)))
+
+
+def sign_cached_key(service, documents):
+    for document in documents:
+        service.pdf_signer.sign_pdf(IncrementalPdfFileWriter(io.BytesIO(document), strict=False))
+
+
+def sign_cached_service(service, documents):
+    for document in documents:
+        service.sign_bytes(document)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=50)
+    parser.add_argument('--p12', help='PKCS#12 file to sign with (default: a new self-signed key)')
+    parser.add_argument('--passphrase', default='benchmark')
+    args = parser.parse_args()
+
+    init_db()
+    documents, source = sample_documents(args.documents)
+    with tempfile.TemporaryDirectory() as directory:
+        p12_path = args.p12
+        if p12_path is None:
+            p12_path = os.path.join(directory, 'benchmark.p12')
+            create_self_signed_p12(p12_path, args.passphrase)
+
+        start = time.perf_counter()
+        service = PdfSigningService(p12_path, args.passphrase)
+        load_seconds = time.perf_counter() - start
+
+        rows = []
+        for name, run in (('reload PKCS#12 per document', lambda: sign_reloading(p12_path, args.passphrase,
+                                                                                  documents)),
+                          ('cached key', lambda: sign_cached_key(service, documents)),
+                          ('cached key + reserved size', lambda: sign_cached_service(service, documents))):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            rows.append((name, f'{elapsed / len(documents) * 1000:.1f}', f'{len(documents) / elapsed:.1f}'))
+
+        paths = []
+        for i, document in enumerate(documents):
+            path = os.path.join(directory, f'{i}.pdf')
+            with open(path, 'wb') as f:
+                f.write(document)
+            paths.append(path)
+        start = time.perf_counter()
+        failures = [error for error in service.sign_batch(paths).values() if error is not None]
+        elapsed = time.perf_counter() - start
+        rows.append(('sign_batch (files in place)', f'{elapsed / len(paths) * 1000:.1f}',
+                     f'{len(paths) / elapsed:.1f}'))
+
+    print(f'{len(documents)} documents ({source}); key load + size measurement {load_seconds * 1000:.0f} ms\n')
+    print_table(('mode', 'ms/document', 'documents/s'), rows)
+    if failures:
+        print(f'\n{len(failures)} batch signatures failed: {failures[0]}')
+
+
+if __name__ == '__main__':
+    main()
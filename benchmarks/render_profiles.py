@@ -0,0 +1,48 @@
+"""Output size and render time of every PDF render profile over the seeded templates.
+
+    python -m benchmarks.render_profiles [--signature signature.png] [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+
+from app import app, init_db, RENDER_PROFILES, render_contract_pdf
+from benchmarks.common import seeded_templates, sample_contract_text, signature_data_url, timed, print_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--signature', help='PNG file to embed as the signature image')
+    parser.add_argument('--repeat', type=int, default=3, help='renders per template and profile')
+    args = parser.parse_args()
+
+    init_db()
+    signature = signature_data_url(args.signature)
+    rows = []
+    with app.app_context(), tempfile.TemporaryDirectory() as tmp_dir:
+        templates = seeded_templates()
+        for profile in RENDER_PROFILES:
+            sizes = []
+            times = []
+            for template in templates:
+                content = sample_contract_text(template)
+                pdf_path = os.path.join(tmp_dir, f'{template.id}.pdf')
+                for _ in range(args.repeat):
+                    _, elapsed = timed(render_contract_pdf, pdf_path, template.title, content, signature, profile)
+                    times.append(elapsed)
+                sizes.append(os.path.getsize(pdf_path))
+            rows.append((
+                profile,
+                len(templates),
+                f'{sum(sizes) / 1024:.1f}',
+                f'{statistics.mean(sizes) / 1024:.1f}',
+                f'{statistics.mean(times) * 1000:.1f}',
+                f'{statistics.quantiles(times, n=20)[-1] * 1000:.1f}' if len(times) > 1 else '-',
+            ))
+
+    print_table(('profile', 'templates', 'total KiB', 'mean KiB', 'mean ms', 'p95 ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
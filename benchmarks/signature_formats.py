@@ -0,0 +1,102 @@
+"""Stored size and PDF render time: vector (SVG path) vs raster (PNG) signatures.
+
+Both formats are produced from the same synthetic handwriting strokes. The
+PNG mirrors what signature_pad's toDataURL() gave us: an RGBA canvas at
+2x device pixel ratio with a white background.
+
+    python -m benchmarks.signature_formats [--repeat 5]
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import statistics
+import struct
+import tempfile
+import zlib
+
+from app import app, init_db, render_contract_pdf
+from benchmarks.common import seeded_templates, sample_contract_text, timed, print_table
+from signatures import signature_from_strokes
+
+CANVAS_WIDTH = 600
+CANVAS_HEIGHT = 200
+PIXEL_RATIO = 2
+
+
+def synthetic_strokes():
+    """A cursive-looking name: a few loopy strokes sampled the way signature_pad samples input"""
+    strokes = []
+    for word in range(3):
+        x0 = 60 + word * 170
+        points = []
+        for step in range(220):
+            t = step / 220
+            x = x0 + 140 * t + 12 * math.sin(t * 38)
+            y = 100 + 35 * math.sin(t * 19 + word) * math.cos(t * 5)
+            points.append([round(x, 1), round(y, 1)])
+        strokes.append(points)
+    strokes.append([[560.0, 60.0]])
+    return strokes
+
+
+def rasterize_png(strokes, line_width=2.5):
+    """Draw strokes onto a white RGBA canvas and encode it as PNG"""
+    width, height = CANVAS_WIDTH * PIXEL_RATIO, CANVAS_HEIGHT * PIXEL_RATIO
+    pixels = bytearray(b'\xff' * (width * height * 4))
+    radius = line_width * PIXEL_RATIO / 2
+
+    def stamp(cx, cy):
+        for y in range(max(0, int(cy - radius)), min(height, int(cy + radius) + 1)):
+            for x in range(max(0, int(cx - radius)), min(width, int(cx + radius) + 1)):
+                if (x - cx) ** 2 + (y - cy) ** 2 <= radius ** 2:
+                    offset = (y * width + x) * 4
+                    pixels[offset:offset + 3] = b'\x00\x00\x00'
+
+    for stroke in strokes:
+        scaled = [(x * PIXEL_RATIO, y * PIXEL_RATIO) for x, y in stroke]
+        stamp(*scaled[0])
+        for (ax, ay), (bx, by) in zip(scaled, scaled[1:]):
+            steps = max(1, int(math.hypot(bx - ax, by - ay)))
+            for i in range(1, steps + 1):
+                stamp(ax + (bx - ax) * i / steps, ay + (by - ay) * i / steps)
+
+    raw = b''.join(b'\x00' + bytes(pixels[row * width * 4:(row + 1) * width * 4]) for row in range(height))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    png = (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+           + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+    return 'data:image/png;base64,' + base64.b64encode(png).decode('ascii')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='renders per format')
+    args = parser.parse_args()
+
+    strokes = synthetic_strokes()
+    signatures = {
+        'png (toDataURL)': rasterize_png(strokes),
+        'svg path': signature_from_strokes(json.dumps(strokes), CANVAS_WIDTH, CANVAS_HEIGHT),
+    }
+
+    init_db()
+    rows = []
+    with app.app_context(), tempfile.TemporaryDirectory() as tmp_dir:
+        template = seeded_templates()[0]
+        content = sample_contract_text(template)
+        for name, signature in signatures.items():
+            pdf_path = os.path.join(tmp_dir, 'signature.pdf')
+            times = [timed(render_contract_pdf, pdf_path, template.title, content, signature)[1]
+                     for _ in range(args.repeat)]
+            rows.append((name, len(signature), os.path.getsize(pdf_path),
+                         f'{statistics.mean(times) * 1000:.1f}', f'{min(times) * 1000:.1f}'))
+
+    print_table(('format', 'stored bytes', 'pdf bytes', 'mean render ms', 'best render ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Memory-leak soak test: thousands of saved contracts in one process.
+
+Drives save_contract_pdf (the path a web request takes, render included)
+round-robin over every seeded template, with a vector signature, and deletes
+each contract again so the database and generated_contracts/ end as they
+started. PDFs are written to a temporary directory. Every --sample-every
+renders it records RSS, open file descriptors, threads and, with
+--tracemalloc, Python heap usage; --csv streams the samples to a file, so a
+long run in the background can be watched while it goes.
+
+Growth is measured from the end of --warmup renders, once fonts and caches
+are loaded. The run fails (exit status 1) when RSS grows by more than
+--threshold-mb or open descriptors by more than --fd-threshold; with
+--tracemalloc the source lines whose allocations grew most are listed. It
+also reports when RenderRecycler would have retired the process.
+
+    python -m benchmarks.soak [--renders 10000] [--tracemalloc] [--csv soak.csv]
+    PDF_ENGINE=weasyprint python -m benchmarks.soak   # soak WeasyPrint/pango instead
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import app as app_module
+from app import (app, db, init_db, save_contract_pdf, record_usage, record_variable_values, contract_variables,
+                 fill_template, render_recycler)
+from benchmarks.common import seeded_templates, sample_variables, print_table
+from benchmarks.signature_formats import synthetic_strokes, CANVAS_WIDTH, CANVAS_HEIGHT
+from render_recycler import rss_bytes, open_fd_count
+from signatures import signature_from_strokes
+from thumbnails import remove_thumbnail, wait_for_thumbnails
+
+SAMPLE_FIELDS = ('renders', 'seconds', 'renders_per_second', 'rss_mb', 'open_fds', 'threads', 'traced_mb')
+
+
+def discard(contract, pdf_dir):
+    """Delete a contract the way /delete-contract does"""
+    pdf_path = os.path.join(pdf_dir, contract.pdf_filename)
+    record_usage(contract, sign=-1)
+    record_variable_values(contract_variables(contract), sign=-1)
+    db.session.delete(contract)
+    db.session.commit()
+    if os.path.exists(pdf_path):
+        os.remove(pdf_path)
+    remove_thumbnail(pdf_path)
+
+
+def sample(renders, started, previous):
+    seconds = time.perf_counter() - started
+    rate = (renders - previous['renders']) / max(seconds - previous['seconds'], 1e-9) if previous else 0.0
+    return {'renders': renders, 'seconds': round(seconds, 1), 'renders_per_second': round(rate, 1),
+            'rss_mb': round(rss_bytes() / 1048576, 1), 'open_fds': open_fd_count(),
+            'threads': threading.active_count(),
+            'traced_mb': round(tracemalloc.get_traced_memory()[0] / 1048576, 1) if tracemalloc.is_tracing() else ''}
+
+
+def growth_per_thousand(samples):
+    """Least-squares RSS slope in MB per 1000 renders"""
+    if len(samples) < 2:
+        return 0.0
+    xs = [s['renders'] for s in samples]
+    ys = [s['rss_mb'] for s in samples]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if not variance:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--renders', type=int, default=10000)
+    parser.add_argument('--warmup', type=int, default=200, help='renders before the baseline is taken')
+    parser.add_argument('--sample-every', type=int, default=250)
+    parser.add_argument('--threshold-mb', type=float, default=32, help='allowed RSS growth after warm-up')
+    parser.add_argument('--fd-threshold', type=int, default=4, help='allowed growth in open descriptors')
+    parser.add_argument('--tracemalloc', action='store_true', help='trace Python allocations (slower)')
+    parser.add_argument('--top', type=int, default=10, help='allocation sites to list with --tracemalloc')
+    parser.add_argument('--csv', help='write samples to this file as they are taken')
+    args = parser.parse_args()
+
+    if app_module.RENDER_MODE == 'queue':
+        sys.exit('RENDER_MODE=queue saves contracts without rendering them; unset it for the soak test')
+    init_db()
+    signature = signature_from_strokes(json.dumps(synthetic_strokes()), CANVAS_WIDTH, CANVAS_HEIGHT)
+    csv_file = open(args.csv, 'w', newline='') if args.csv else None
+    writer = csv.DictWriter(csv_file, SAMPLE_FIELDS) if csv_file else None
+    if writer:
+        writer.writeheader()
+
+    samples = []
+    baseline = baseline_snapshot = None
+    recycled_at = None
+    with app.app_context(), tempfile.TemporaryDirectory() as pdf_dir:
+        app_module.CONTRACTS_DIR = pdf_dir
+        jobs = []
+        for template in seeded_templates():
+            content = template.resolved_content
+            variables = sample_variables(content)
+            jobs.append((template.id, template.title, fill_template(content, variables), variables))
+        db.session.expunge_all()
+        if args.tracemalloc:
+            tracemalloc.start(16)
+
+        started = time.perf_counter()
+        try:
+            for renders in range(1, args.renders + 1):
+                template_id, title, content, variables = jobs[renders % len(jobs)]
+                contract = save_contract_pdf(template_id, title, content, signature, variables)
+                discard(contract, pdf_dir)
+                db.session.expunge_all()
+                if recycled_at is None and render_recycler.due:
+                    recycled_at = (renders, render_recycler.reason)
+                if renders % args.sample_every and renders != args.warmup and renders != args.renders:
+                    continue
+                if renders == args.warmup:
+                    wait_for_thumbnails()
+                row = sample(renders, started, samples[-1] if samples else None)
+                samples.append(row)
+                if renders == args.warmup:
+                    baseline = row
+                    if args.tracemalloc:
+                        baseline_snapshot = tracemalloc.take_snapshot()
+                if writer:
+                    writer.writerow(row)
+                    csv_file.flush()
+                print(f'{renders:>7} renders  {row["rss_mb"]:>7.1f} MB RSS  {row["open_fds"]} fds  '
+                      f'{row["renders_per_second"]:>6.1f}/s', file=sys.stderr)
+        except KeyboardInterrupt:
+            print('interrupted; reporting what was measured', file=sys.stderr)
+        wait_for_thumbnails()
+        final_snapshot = tracemalloc.take_snapshot() if baseline_snapshot is not None else None
+        if csv_file:
+            csv_file.close()
+
+    print_table(SAMPLE_FIELDS, [tuple(row[field] for field in SAMPLE_FIELDS) for row in samples])
+    if baseline is None or samples[-1] is baseline:
+        print(f'\nFewer than --warmup ({args.warmup}) renders plus one sample; no verdict')
+        return
+    after_warmup = [row for row in samples if row['renders'] >= baseline['renders']]
+    final = samples[-1]
+    rss_growth = final['rss_mb'] - baseline['rss_mb']
+    fd_growth = (final['open_fds'] - baseline['open_fds']
+                 if final['open_fds'] is not None and baseline['open_fds'] is not None else 0)
+    print(f'\nAfter warm-up: RSS {baseline["rss_mb"]:.1f} -> {final["rss_mb"]:.1f} MB ({rss_growth:+.1f} MB, '
+          f'trend {growth_per_thousand(after_warmup):+.2f} MB per 1000 renders), '
+          f'open descriptors {baseline["open_fds"]} -> {final["open_fds"]}')
+    if recycled_at:
+        print(f'RenderRecycler would have retired this process after render {recycled_at[0]} ({recycled_at[1]})')
+    if final_snapshot is not None:
+        print(f'\nTop {args.top} allocation sites by growth since warm-up:')
+        for stat in final_snapshot.compare_to(baseline_snapshot, 'lineno')[:args.top]:
+            print(f'  {stat}')
+
+    problems = []
+    if rss_growth > args.threshold_mb:
+        problems.append(f'RSS grew {rss_growth:.1f} MB (threshold {args.threshold_mb:g} MB)')
+    if fd_growth > args.fd_threshold:
+        problems.append(f'{fd_growth} more open descriptors (threshold {args.fd_threshold})')
+    if problems:
+        print('\nLEAK SUSPECTED: ' + '; '.join(problems))
+        sys.exit(1)
+    print('\nNo growth above the thresholds')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Per-keystroke latency of variable value suggestions with a large index.
+
+Fills a temporary SQLite database with --values distinct values (default a
+million) spread over the seeded templates' free-text variables, skewed the
+way real use is: a few variables (party names, addresses) hold most values,
+and use counts follow a long tail. Then it times the query behind
+/variable-suggestions.json for prefixes of 1 to 4 characters, on the
+largest variable and on randomly chosen ones.
+
+    python -m benchmarks.variable_suggestions [--values 1000000] [--lookups 500]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from app import app, init_db, extract_variables, suggests_values, suggestion_key, suggestion_query, VariableValue
+from benchmarks.common import seeded_templates, print_table
+
+WORDS = ['Acme', 'Northwind', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Stark', 'Wayne', 'Tyrell', 'Oakridge',
+         'Maple', 'Harbor', 'Summit', 'Pioneer', 'Lagos', 'Abuja', 'London', 'Berlin', 'Austin', 'Denver']
+SUFFIXES = ['Ltd', 'LLC', 'Inc', 'Holdings', 'Partners', 'Street', 'Avenue', 'Road', 'Group', 'Services']
+
+
+def random_value(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(1, 3))]
+    return f'{" ".join(words)} {rng.choice(SUFFIXES)} {rng.randint(1, 99999)}'
+
+
+def fill(path, variables, count, seed=1):
+    """Insert count distinct values; returns (engine, {variable: number of values})"""
+    rng = random.Random(seed)
+    # Variable i gets a share proportional to 1 / (i + 1)
+    weights = [1 / (rank + 1) for rank in range(len(variables))]
+    engine = create_engine(f'sqlite:///{path}')
+    VariableValue.__table__.create(engine)
+    connection = engine.raw_connection()
+    sizes = dict.fromkeys(variables, 0)
+    seen = set()
+    rows = []
+    while len(seen) < count:
+        variable = rng.choices(variables, weights)[0]
+        value = random_value(rng)
+        key = suggestion_key(value)
+        if (variable, key) in seen:
+            continue
+        seen.add((variable, key))
+        sizes[variable] += 1
+        rows.append((variable, key, value, max(1, int(rng.paretovariate(1.2)))))
+        if len(rows) >= 50000:
+            connection.executemany('INSERT INTO variable_value (variable, value_key, value, uses) VALUES (?, ?, ?, ?)',
+                                   rows)
+            rows = []
+    if rows:
+        connection.executemany('INSERT INTO variable_value (variable, value_key, value, uses) VALUES (?, ?, ?, ?)',
+                               rows)
+    connection.commit()
+    connection.execute('ANALYZE')
+    connection.close()
+    return engine, sizes
+
+
+def time_lookups(engine, variables, prefix_length, lookups, rng):
+    latencies = []
+    with engine.connect() as connection:
+        for _ in range(lookups):
+            variable = rng.choice(variables)
+            # What someone typing one of the stored values would send
+            prefix = rng.choice(WORDS)[:prefix_length].lower()
+            query = suggestion_query(variable, prefix)
+            start = time.perf_counter()
+            connection.execute(query).all()
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--values', type=int, default=1000000, help='distinct values in the index')
+    parser.add_argument('--lookups', type=int, default=500, help='queries per prefix length and variable choice')
+    args = parser.parse_args()
+
+    init_db()
+    with app.app_context():
+        variables = sorted({variable for template in seeded_templates()
+                            for variable in extract_variables(template.resolved_content) if suggests_values(variable)})
+    rng = random.Random(2)
+    rng.shuffle(variables)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'suggestions.db')
+        start = time.perf_counter()
+        engine, sizes = fill(path, variables, args.values)
+        print(f'{args.values} values over {len(variables)} variables indexed in {time.perf_counter() - start:.0f} s, '
+              f'{os.path.getsize(path) / 1048576:.0f} MiB; largest variable {variables[0]} with {sizes[variables[0]]} '
+              f'values\n')
+        rows = []
+        with app.app_context():
+            for prefix_length in range(1, 5):
+                for label, choices in (('largest', variables[:1]), ('random', variables)):
+                    latencies = time_lookups(engine, choices, prefix_length, args.lookups, rng)
+                    rows.append((prefix_length, label, f'{statistics.median(latencies):.2f}',
+                                 f'{latencies[int(len(latencies) * 0.95)]:.2f}', f'{latencies[-1]:.2f}'))
+        engine.dispose()
+    print_table(('prefix chars', 'variable', 'p50 ms', 'p95 ms', 'max ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Clause includes: reusable clauses pulled into templates with [[clause:slug]].
+
+A clause may itself include other clauses. ClauseComposer resolves a text's
+includes and reports every clause it depends on, directly or through other
+clauses, so the app can store that set and recompose only the templates that
+use an edited clause. Each clause is composed once per composer, however many
+templates include it.
+"""
+import re
+
+INCLUDE_PATTERN = re.compile(r'\[\[clause:([a-z0-9][a-z0-9_-]*)\]\]')
+SLUG_PATTERN = re.compile(r'[a-z0-9][a-z0-9_-]{0,99}')
+
+
+class ClauseError(ValueError):
+    """An include names a missing clause, or clauses include each other in a cycle"""
+
+
+def include_placeholder(slug):
+    return f'[[clause:{slug}]]'
+
+
+def included_slugs(text):
+    """Slugs of the clauses text includes directly"""
+    return set(INCLUDE_PATTERN.findall(text))
+
+
+class ClauseComposer:
+    """Resolves includes against load(slug) -> clause content or None, memoising composed clauses"""
+
+    def __init__(self, load):
+        self.load = load
+        self.composed = {}
+
+    def compose(self, text):
+        """(text with every include resolved, set of slugs of all clauses it depends on)"""
+        return self._resolve(text, ())
+
+    def clause(self, slug, stack=()):
+        """(composed clause text, slugs it depends on including its own)"""
+        if slug in stack:
+            raise ClauseError(f'Clause "{slug}" includes itself: {" -> ".join(stack + (slug,))}')
+        if slug not in self.composed:
+            content = self.load(slug)
+            if content is None:
+                raise ClauseError(f'Unknown clause "{slug}"')
+            text, used = self._resolve(content, stack + (slug,))
+            self.composed[slug] = (text, used | {slug})
+        return self.composed[slug]
+
+    def _resolve(self, text, stack):
+        used = set()
+
+        def replace(match):
+            clause_text, clause_used = self.clause(match.group(1), stack)
+            used.update(clause_used)
+            return clause_text
+        return INCLUDE_PATTERN.sub(replace, text), used
@@ -0,0 +1,108 @@
+"""Dictionary (zstd) compression of stored contract text and variables.
+
+Every compressed contract records the id of the dictionary it was compressed
+with, so training a new dictionary only affects contracts saved or migrated
+afterwards; old dictionaries are kept for as long as contracts use them.
+Text is decompressed only when a contract is opened, never for list views,
+which read the stored summary instead.
+
+    python contract_compression.py train [--trained] [--contract-samples 2000]
+    python contract_compression.py migrate --to zstd [--batch-size 500]
+    python contract_compression.py migrate --to full
+    python contract_compression.py report
+"""
+import argparse
+
+from sqlalchemy import func
+
+from app import (app, db, init_db, Contract, CompressionDictionary, TemplateRevision, contract_codec,
+                 create_compression_dictionary, current_compression_dictionary_id, CONTRACT_SUMMARY_LENGTH)
+from contract_storage import iter_contract_batches, DEFAULT_BATCH_SIZE
+
+
+def train(trained=False, contract_samples=2000):
+    """Store a new dictionary built from the template revisions, plus recent contracts when trained"""
+    samples = [content for (content,) in
+               db.session.query(TemplateRevision.content).order_by(TemplateRevision.id)]
+    if trained and contract_samples:
+        recent = Contract.query.order_by(Contract.id.desc()).limit(contract_samples).all()
+        samples.extend(contract.filled_content for contract in reversed(recent))
+    return create_compression_dictionary(samples, trained=trained)
+
+
+def migrate(to, batch_size=DEFAULT_BATCH_SIZE, dictionary_id=None, log=print):
+    """Compress (or decompress) every contract, committing once per batch; also fills in summaries"""
+    if to == 'zstd':
+        dictionary_id = dictionary_id or current_compression_dictionary_id()
+        if dictionary_id is None:
+            raise RuntimeError('No compression dictionary; install zstandard and run "train" first')
+    converted = 0
+    for batch in iter_contract_batches(batch_size):
+        last_id = batch[-1].id
+        for contract in batch:
+            if contract.summary is None:
+                contract.summary = contract.filled_content[:CONTRACT_SUMMARY_LENGTH]
+            if to == 'zstd' and contract.dictionary_id != dictionary_id:
+                contract.compress(dictionary_id)
+                converted += 1
+            elif to == 'full' and contract.dictionary_id is not None:
+                contract.decompress()
+                converted += 1
+        db.session.commit()
+        db.session.expunge_all()
+        log(f'... up to contract id {last_id}: {converted} converted')
+    return converted
+
+
+def report():
+    """Print contracts and stored bytes per dictionary"""
+    rows = (db.session.query(Contract.dictionary_id, func.count(Contract.id),
+                             func.coalesce(func.sum(func.length(Contract.compressed_content)), 0),
+                             func.coalesce(func.sum(func.length(Contract.compressed_variables)), 0),
+                             func.coalesce(func.sum(func.length(Contract.stored_content)), 0),
+                             func.coalesce(func.sum(func.length(Contract.stored_variables_json)), 0))
+            .group_by(Contract.dictionary_id).order_by(Contract.dictionary_id).all())
+    sizes = dict(db.session.query(CompressionDictionary.id, func.length(CompressionDictionary.data)))
+    for dictionary_id, count, content_bytes, variable_bytes, plain_content, plain_variables in rows:
+        if dictionary_id is None:
+            print(f'uncompressed: {count} contracts, {plain_content} bytes of text, '
+                  f'{plain_variables} bytes of variables')
+        else:
+            print(f'dictionary {dictionary_id} ({sizes.get(dictionary_id, 0)} bytes): {count} contracts, '
+                  f'{content_bytes} bytes of compressed text, {variable_bytes} bytes of compressed variables')
+    print(f'newest dictionary: {current_compression_dictionary_id()}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dictionary compression of contract text')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    train_parser = subparsers.add_parser('train', help='store a new dictionary used for new contracts')
+    train_parser.add_argument('--trained', action='store_true',
+                              help="run zstd's trainer instead of using the template text as the dictionary")
+    train_parser.add_argument('--contract-samples', type=int, default=2000,
+                              help='recent contracts added to the training samples with --trained')
+    migrate_parser = subparsers.add_parser('migrate', help='compress or decompress existing contracts')
+    migrate_parser.add_argument('--to', choices=['zstd', 'full'], default='zstd')
+    migrate_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    migrate_parser.add_argument('--dictionary', type=int, help='dictionary id (default: newest)')
+    subparsers.add_parser('report', help='show contracts and bytes per dictionary')
+    args = parser.parse_args()
+
+    # Adds the dictionary table and the compressed columns
+    init_db()
+    with app.app_context():
+        if args.command in ('train', 'migrate') and not contract_codec.available:
+            parser.error('the zstandard package is not installed')
+        if args.command == 'train':
+            dictionary = train(args.trained, args.contract_samples)
+            print(f'Dictionary {dictionary.id} stored ({len(dictionary.data)} bytes, '
+                  f'{dictionary.sample_count} samples)')
+        elif args.command == 'migrate':
+            converted = migrate(args.to, args.batch_size, args.dictionary)
+            print(f'Migration finished: {converted} converted')
+        else:
+            report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""Bulk deletion of contracts: retention purges, date-range deletes and the file unlinker.
+
+/delete-contract/<uuid> deletes one contract per request, with a commit
+and a file removal each; emptying years of contracts that way takes as
+many requests. Here contracts are deleted a batch at a time, oldest first,
+in (created_at, id) order along ix_contract_created_at_id: each batch is
+one transaction of set-based statements (delete_contracts() in app.py)
+that also takes the contracts out of the usage rollup, the suggestion
+index and the pack counters, and queues their PDFs in pending_unlink.
+The files are removed by the unlink command, at --ops-per-second, so a
+purge never floods the volume with unlinks.
+
+Every batch commits on its own, so an interrupted run loses nothing and
+running it again continues with what is left. Progress (rows deleted,
+position, rows per second) is kept in a ProcessCursor per command and
+shown by `status` and /admin/purge-status.
+
+    python contract_purge.py retention [--days CONTRACT_RETENTION_DAYS] [--interval 86400]
+    python contract_purge.py delete --before 2019-01-01 [--after 2018-01-01] [--template-id 3]
+    python contract_purge.py unlink [--ops-per-second 50] [--once]
+    python contract_purge.py status
+
+retention and delete take --batch-size and --rows-per-second.
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app import (app, db, init_db, Contract, PendingUnlink, ProcessCursor, CONTRACTS_DIR, CONTRACT_DELETE_BATCH_SIZE,
+                 CONTRACT_RETENTION_DAYS, PURGE_PROCESSES, ConcurrentDelete, delete_contracts, purge_batch_query)
+from sweeper import Throttle
+from thumbnails import remove_thumbnail
+
+DEFAULT_UNLINK_OPS_PER_SECOND = 50
+DEFAULT_POLL_SECONDS = 60
+UNLINK_BATCH_SIZE = 500
+LOG_EVERY_SECONDS = 10
+
+
+def start_cursor(name):
+    """Reset the process's cursor for a new run"""
+    cursor = db.session.get(ProcessCursor, name)
+    if cursor is None:
+        cursor = ProcessCursor(name=name)
+        db.session.add(cursor)
+    now = datetime.utcnow()
+    cursor.position_at = None
+    cursor.position_id = 0
+    cursor.processed = 0
+    cursor.started_at = now
+    cursor.updated_at = now
+    db.session.commit()
+
+
+def advance_cursor(name, count, position=(None, 0)):
+    """Count a batch on the cursor, in the batch's own transaction"""
+    db.session.execute(update(ProcessCursor).where(ProcessCursor.name == name)
+                       .values(processed=ProcessCursor.processed + count, position_at=position[0],
+                               position_id=position[1], updated_at=datetime.utcnow()))
+
+
+class Progress:
+    """Logs a running total and rate at most every LOG_EVERY_SECONDS"""
+
+    def __init__(self, label, log):
+        self.label = label
+        self.log = log
+        self.total = 0
+        self.started = self.logged = time.monotonic()
+
+    def add(self, count, detail=''):
+        self.total += count
+        now = time.monotonic()
+        if now - self.logged >= LOG_EVERY_SECONDS:
+            self.logged = now
+            self.log(f'... {self.total} {self.label} ({self.rate():.0f}/s){detail}')
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.total / elapsed if elapsed > 0 else 0.0
+
+
+def purge(name, before, after=None, template_id=None, batch_size=CONTRACT_DELETE_BATCH_SIZE, rows_per_second=0,
+          log=print):
+    """Delete the contracts created in [after, before), oldest first; returns how many were deleted"""
+    start_cursor(name)
+    throttle = Throttle(rows_per_second / batch_size if rows_per_second else 0)
+    progress = Progress('contracts deleted', log)
+    position = None
+    while True:
+        throttle.wait()
+        batch = db.session.execute(purge_batch_query(before, position, after, template_id, batch_size)).scalars().all()
+        if not batch:
+            break
+        try:
+            deleted = delete_contracts(batch)
+        except ConcurrentDelete as exc:
+            # Someone deleted one of them meanwhile; read the batch again
+            db.session.rollback()
+            db.session.expunge_all()
+            log(f'{exc}, retrying the batch')
+            continue
+        position = (batch[-1].created_at, batch[-1].id)
+        advance_cursor(name, deleted, position)
+        db.session.commit()
+        db.session.expunge_all()
+        progress.add(deleted, f', up to {position[0]}')
+    log(f'{progress.total} contracts deleted in {time.monotonic() - progress.started:.0f} s '
+        f'({progress.rate():.0f}/s)')
+    return progress.total
+
+
+def unlink_file(pdf_filename):
+    pdf_path = os.path.join(CONTRACTS_DIR, pdf_filename)
+    try:
+        os.remove(pdf_path)
+    except FileNotFoundError:
+        # Archived into a pack, never rendered, or removed by an earlier run that crashed before its commit
+        pass
+    remove_thumbnail(pdf_path)
+
+
+def unlink(ops_per_second=DEFAULT_UNLINK_OPS_PER_SECOND, poll_seconds=DEFAULT_POLL_SECONDS, once=False, log=print):
+    """Remove queued files at ops_per_second until interrupted (or until the queue is empty with once=True)"""
+    start_cursor('unlink')
+    throttle = Throttle(ops_per_second)
+    progress = Progress('files removed', log)
+    while True:
+        pending = PendingUnlink.query.order_by(PendingUnlink.id).limit(UNLINK_BATCH_SIZE).all()
+        if not pending:
+            if once:
+                break
+            db.session.remove()
+            time.sleep(poll_seconds)
+            continue
+        # A file is only queued once its row is gone, but never remove one a contract still points at
+        in_use = {name for (name,) in db.session.query(Contract.pdf_filename)
+                  .filter(Contract.pdf_filename.in_([entry.pdf_filename for entry in pending]))}
+        for entry in pending:
+            if entry.pdf_filename not in in_use:
+                throttle.wait()
+                unlink_file(entry.pdf_filename)
+        # Removed before this commit: a crash in between only means removing them again
+        PendingUnlink.query.filter(PendingUnlink.id <= pending[-1].id).delete(synchronize_session=False)
+        advance_cursor('unlink', len(pending), (pending[-1].queued_at, pending[-1].id))
+        db.session.commit()
+        db.session.expunge_all()
+        progress.add(len(pending))
+    log(f'Queue empty: {progress.total} files removed')
+    return progress.total
+
+
+def show_status():
+    cursors = {cursor.name: cursor for cursor in ProcessCursor.query.filter(ProcessCursor.name.in_(PURGE_PROCESSES))}
+    for name in PURGE_PROCESSES:
+        cursor = cursors.get(name)
+        if cursor is None or cursor.started_at is None:
+            print(f'{name}: never run')
+            continue
+        rate = f'{cursor.rate:.0f}/s' if cursor.rate is not None else '-'
+        print(f'{name}: {cursor.processed} since {cursor.started_at} ({rate}), '
+              f'at {cursor.position_at or "start"}, last moved {cursor.updated_at}')
+    pending = db.session.query(db.func.count(PendingUnlink.id)).scalar()
+    oldest = db.session.query(db.func.min(PendingUnlink.queued_at)).scalar()
+    print(f'files waiting to be removed: {pending}' + (f', oldest queued at {oldest}' if oldest else ''))
+    print(f'oldest contract: {db.session.query(db.func.min(Contract.created_at)).scalar() or "-"}')
+    print(f'retention: {f"{CONTRACT_RETENTION_DAYS} days" if CONTRACT_RETENTION_DAYS else "off"}')
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete contracts in bulk and remove their files')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    retention_parser = subparsers.add_parser('retention', help='delete contracts older than the retention period')
+    retention_parser.add_argument('--days', type=int, default=CONTRACT_RETENTION_DAYS,
+                                  help='retention period (default CONTRACT_RETENTION_DAYS)')
+    retention_parser.add_argument('--interval', type=int, default=0,
+                                  help='repeat every N seconds instead of running once')
+    delete_parser = subparsers.add_parser('delete', help='delete the contracts created in a date range')
+    delete_parser.add_argument('--before', type=parse_date, required=True, help='YYYY-MM-DD, exclusive')
+    delete_parser.add_argument('--after', type=parse_date, help='YYYY-MM-DD, inclusive')
+    delete_parser.add_argument('--template-id', type=int, help='only contracts of this template')
+    for purge_parser in (retention_parser, delete_parser):
+        purge_parser.add_argument('--batch-size', type=int, default=CONTRACT_DELETE_BATCH_SIZE,
+                                  help='contracts deleted per transaction')
+        purge_parser.add_argument('--rows-per-second', type=float, default=0,
+                                  help='limit the deletion rate (default unlimited)')
+    unlink_parser = subparsers.add_parser('unlink', help='remove the files of deleted contracts')
+    unlink_parser.add_argument('--ops-per-second', type=float, default=DEFAULT_UNLINK_OPS_PER_SECOND,
+                               help='file removals per second')
+    unlink_parser.add_argument('--poll', type=float, default=DEFAULT_POLL_SECONDS,
+                               help='seconds to wait when the queue is empty')
+    unlink_parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+    subparsers.add_parser('status', help='print progress, rates and the unlink backlog')
+    args = parser.parse_args()
+
+    if args.command == 'retention' and args.days <= 0:
+        parser.error('no retention period: pass --days or set CONTRACT_RETENTION_DAYS')
+
+    # Adds the pending_unlink table and the created_at index
+    init_db()
+    with app.app_context():
+        try:
+            if args.command == 'retention':
+                while True:
+                    before = datetime.utcnow() - timedelta(days=args.days)
+                    print(f'Deleting contracts created before {before:%Y-%m-%d %H:%M}')
+                    purge('retention', before, batch_size=args.batch_size, rows_per_second=args.rows_per_second)
+                    db.session.remove()
+                    if not args.interval:
+                        break
+                    time.sleep(args.interval)
+            elif args.command == 'delete':
+                purge('bulk-delete', args.before, args.after, args.template_id, args.batch_size,
+                      args.rows_per_second)
+            elif args.command == 'unlink':
+                unlink(args.ops_per_second, args.poll, args.once)
+            else:
+                show_status()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Convert contracts between full and differential ('delta') text storage.
+
+A delta contract keeps only its template revision and variables; the text is
+rebuilt through fill_template() when read. Contracts whose stored text cannot
+be reproduced exactly (hand-edited previews, pre-revision wording) stay full.
+
+    python contract_storage.py report
+    python contract_storage.py migrate --to delta [--batch-size 500]
+    python contract_storage.py migrate --to full
+"""
+import argparse
+import json
+
+from sqlalchemy import func
+from sqlalchemy.orm import undefer
+
+from app import app, db, init_db, Contract, TemplateRevision, Template, fill_template
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def iter_contract_batches(batch_size):
+    """Yield lists of contracts ordered by id, paging by key so each batch is one indexed range scan"""
+    last_id = 0
+    while True:
+        batch = (Contract.query.options(undefer('*')).filter(Contract.id > last_id)
+                 .order_by(Contract.id).limit(batch_size).all())
+        if not batch:
+            return
+        last_id = batch[-1].id
+        yield batch
+
+
+def find_delta_revision(contract, revisions_by_template):
+    """Return the revision that reproduces the contract's text exactly, or None"""
+    variables = json.loads(contract.variables_json) if contract.variables_json else {}
+    candidates = []
+    if contract.template_revision is not None:
+        candidates.append(contract.template_revision)
+    if contract.template_id not in revisions_by_template:
+        template = db.session.get(Template, contract.template_id)
+        revisions_by_template[contract.template_id] = template.current_revision() if template else None
+    if revisions_by_template[contract.template_id] is not None:
+        candidates.append(revisions_by_template[contract.template_id])
+    for revision in candidates:
+        if fill_template(revision.content, variables) == contract.filled_content:
+            return revision
+    return None
+
+
+def migrate(to, batch_size=DEFAULT_BATCH_SIZE, log=print):
+    """Rewrite every contract into the requested storage mode, committing once per batch"""
+    converted = 0
+    kept = 0
+    for batch in iter_contract_batches(batch_size):
+        last_id = batch[-1].id
+        revisions_by_template = {}
+        for contract in batch:
+            if to == 'delta' and contract.content_storage != 'delta':
+                revision = find_delta_revision(contract, revisions_by_template)
+                if revision is None:
+                    kept += 1
+                    continue
+                contract.template_revision_id = revision.id
+                contract.stored_content = ''
+                contract.compressed_content = None
+                contract.content_storage = 'delta'
+                converted += 1
+            elif to == 'full' and contract.content_storage == 'delta':
+                contract.filled_content = contract.filled_content
+                if contract.dictionary_id is not None:
+                    contract.compress(contract.dictionary_id)
+                converted += 1
+        db.session.commit()
+        db.session.expunge_all()
+        log(f'... up to contract id {last_id}: {converted} converted, {kept} kept as full text')
+    return converted, kept
+
+
+def report(batch_size=DEFAULT_BATCH_SIZE):
+    """Print stored bytes per storage mode and the size the text would take stored in full"""
+    rows = (db.session.query(func.coalesce(Contract.content_storage, 'full'),
+                             func.count(Contract.id),
+                             func.coalesce(func.sum(func.length(Contract.stored_content)
+                                                    + func.coalesce(func.length(Contract.compressed_content), 0)), 0),
+                             func.coalesce(func.sum(func.coalesce(func.length(Contract.stored_variables_json),
+                                                                  func.length(Contract.compressed_variables))), 0))
+            .group_by(func.coalesce(Contract.content_storage, 'full')).all())
+    revision_bytes = db.session.query(func.coalesce(func.sum(func.length(TemplateRevision.content)), 0)).scalar()
+
+    full_equivalent = 0
+    for batch in iter_contract_batches(batch_size):
+        full_equivalent += sum(len(contract.filled_content) for contract in batch)
+        db.session.expunge_all()
+
+    stored = revision_bytes
+    for mode, count, text_bytes, variable_bytes in rows:
+        print(f'{mode:>5}: {count} contracts, {text_bytes} bytes of text, {variable_bytes} bytes of variables')
+        stored += text_bytes
+    print(f'template revisions: {revision_bytes} bytes')
+    print(f'contract text stored: {stored} bytes (including revisions)')
+    print(f'contract text if stored in full: {full_equivalent} bytes')
+    if full_equivalent:
+        print(f'savings: {full_equivalent - stored} bytes ({(1 - stored / full_equivalent) * 100:.1f}%)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Differential contract text storage')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help='convert existing contracts')
+    migrate_parser.add_argument('--to', choices=['delta', 'full'], default='delta')
+    migrate_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    report_parser = subparsers.add_parser('report', help='show storage used and savings')
+    report_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    # Adds the revision table/columns and a first revision for every template
+    init_db()
+    with app.app_context():
+        if args.command == 'migrate':
+            converted, kept = migrate(args.to, args.batch_size)
+            print(f'Migration finished: {converted} converted, {kept} kept as full text')
+        else:
+            report(args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
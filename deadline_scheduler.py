@@ -0,0 +1,246 @@
+"""Deadline scheduler: sends notices for contract deadlines and renewals as they come due.
+
+save_contract_pdf() extracts the date variables that are deadlines (due,
+end, termination, closing, ... dates) into ContractDeadline rows with the
+moment their notice is due (DEADLINE_NOTICE_DAYS before the date, or
+RENEWAL_NOTICE_DAYS for the end of a term). This process walks those rows
+in (notify_at, id) order behind a persisted cursor: every poll is one range
+scan of the index from the cursor up to now, never a scan of the contracts,
+however many there are. Due notices are POSTed in batches to
+DEADLINE_WEBHOOK_URL as JSON (signed with DEADLINE_WEBHOOK_SECRET in an
+X-Deadline-Signature header) or, without a webhook, logged.
+
+Delivery is at least once: the cursor moves past a batch only after it was
+delivered, so a crash or a failing webhook resends rather than loses it,
+with exponential backoff between attempts. The cursor is advanced with a
+compare-and-set UPDATE, so a second scheduler started by mistake stops
+instead of sending everything twice.
+
+    python deadline_scheduler.py run [--interval 60] [--batch-size 100] [--once]
+    python deadline_scheduler.py backfill [--batch-size 1000]
+    python deadline_scheduler.py upcoming [--days 30]
+    python deadline_scheduler.py status
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import time
+import urllib.request
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import update
+
+from app import (app, db, init_db, Contract, ContractDeadline, ProcessCursor, DEADLINE_WEBHOOK_URL,
+                 DEADLINE_WEBHOOK_SECRET, PUBLIC_BASE_URL, contract_deadlines, contract_variables,
+                 due_deadlines_query, upcoming_deadlines)
+
+CURSOR_NAME = 'deadlines'
+DEFAULT_INTERVAL_SECONDS = 60
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BACKFILL_BATCH_SIZE = 1000
+WEBHOOK_TIMEOUT_SECONDS = 10
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 600
+# Saves clamp notify_at to their own clock, so a row can commit a little after a later one
+# the cursor has passed; the scheduler stays this far behind real time to never skip it
+COMMIT_GRACE_SECONDS = 30
+
+
+class CursorLost(Exception):
+    """Another scheduler moved the cursor"""
+
+
+def backoff_seconds(attempts):
+    """Exponential backoff with jitter, as the render worker retries"""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def load_cursor():
+    cursor = db.session.get(ProcessCursor, CURSOR_NAME)
+    if cursor is None:
+        cursor = ProcessCursor(name=CURSOR_NAME, position_id=0, processed=0, started_at=datetime.utcnow(),
+                               updated_at=datetime.utcnow())
+        db.session.add(cursor)
+        db.session.commit()
+    return cursor
+
+
+def advance_cursor(cursor, read_from, last, count):
+    """Move the cursor past the delivered batch, if it is still at read_from, the (position_at, position_id)
+    the batch was read from; the cursor object itself may have been reloaded since"""
+    position_at, position_id = read_from
+    position = (ProcessCursor.position_at.is_(None) if position_at is None
+                else ProcessCursor.position_at == position_at)
+    result = db.session.execute(update(ProcessCursor)
+                                .where(ProcessCursor.name == CURSOR_NAME, position,
+                                       ProcessCursor.position_id == position_id)
+                                .values(position_at=last.notify_at, position_id=last.id,
+                                        processed=ProcessCursor.processed + count, updated_at=datetime.utcnow()))
+    db.session.commit()
+    if result.rowcount != 1:
+        raise CursorLost(f'cursor {CURSOR_NAME!r} was moved by another scheduler')
+    db.session.refresh(cursor)
+
+
+def notification(row):
+    """The JSON object sent for one due deadline"""
+    return {'id': row.id, 'contract_uuid': row.uuid, 'contract_title': row.title, 'variable': row.variable,
+            'kind': row.kind, 'due_on': row.due_on.isoformat(), 'url': f'{PUBLIC_BASE_URL}/contract/{row.uuid}'}
+
+
+def post_webhook(url, events, secret=None):
+    """POST a batch of notifications; raises on a failed delivery"""
+    body = json.dumps({'events': events, 'sent_at': datetime.utcnow().isoformat()}).encode()
+    headers = {'Content-Type': 'application/json', 'User-Agent': 'contract-deadline-scheduler'}
+    if secret:
+        headers['X-Deadline-Signature'] = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    request = urllib.request.Request(url, data=body, headers=headers, method='POST')
+    with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT_SECONDS) as response:
+        response.read()
+
+
+def deliver(events, log=print):
+    if DEADLINE_WEBHOOK_URL:
+        post_webhook(DEADLINE_WEBHOOK_URL, events, DEADLINE_WEBHOOK_SECRET)
+        return
+    for event in events:
+        log(f'{event["kind"]} due {event["due_on"]}: {event["variable"]} of "{event["contract_title"]}" '
+            f'{event["url"]}')
+
+
+def process_due(cursor, batch_size, now=None, log=print):
+    """Deliver every notice due by now, batch by batch; returns the number sent"""
+    now = now or datetime.utcnow() - timedelta(seconds=COMMIT_GRACE_SECONDS)
+    sent = 0
+    while True:
+        read_from = (cursor.position_at, cursor.position_id)
+        rows = db.session.execute(due_deadlines_query(*read_from, now, batch_size)).all()
+        # Also expires cursor: reading it again would see a position another scheduler moved it to
+        db.session.rollback()
+        if not rows:
+            return sent
+        deliver([notification(row) for row in rows], log)
+        advance_cursor(cursor, read_from, rows[-1], len(rows))
+        sent += len(rows)
+        if len(rows) < batch_size:
+            return sent
+
+
+def run(interval=DEFAULT_INTERVAL_SECONDS, batch_size=DEFAULT_BATCH_SIZE, once=False, log=print):
+    """Send due notices until interrupted (or until none are due with once=True); returns the number sent"""
+    cursor = load_cursor()
+    total = 0
+    failures = 0
+    while True:
+        try:
+            sent = process_due(cursor, batch_size, log=log)
+        except CursorLost:
+            raise
+        except Exception as exc:
+            db.session.rollback()
+            failures += 1
+            delay = backoff_seconds(failures)
+            log(f'delivery failed (attempt {failures}), retrying in {delay:.0f} s: {exc}')
+            time.sleep(delay)
+            continue
+        failures = 0
+        total += sent
+        if sent:
+            log(f'{sent} deadline notices sent')
+        if once:
+            return total
+        time.sleep(interval)
+
+
+def backfill(batch_size=DEFAULT_BACKFILL_BATCH_SIZE, log=print):
+    """Extract deadlines from contracts saved before the scheduler existed; returns (contracts read, deadlines added)"""
+    now = datetime.utcnow()
+    read = added = 0
+    last_id = 0
+    query = Contract.query.options(db.undefer(Contract.stored_variables_json),
+                                   db.undefer(Contract.compressed_variables))
+    while True:
+        batch = query.filter(Contract.id > last_id).order_by(Contract.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        done = {contract_id for (contract_id,) in db.session.query(ContractDeadline.contract_id)
+                .filter(ContractDeadline.contract_id.in_([contract.id for contract in batch])).distinct()}
+        for contract in batch:
+            if contract.id in done:
+                continue
+            for deadline in contract_deadlines(contract_variables(contract), now):
+                deadline.contract_id = contract.id
+                db.session.add(deadline)
+                added += 1
+        db.session.commit()
+        read += len(batch)
+        db.session.expunge_all()
+        log(f'... up to contract id {last_id}: {read} contracts, {added} deadlines added')
+    return read, added
+
+
+def show_upcoming(days):
+    for day, deadlines in upcoming_deadlines(date.today(), days):
+        print(day.isoformat())
+        for deadline, title, contract_uuid in deadlines:
+            print(f'  {deadline.kind:8} {deadline.variable:30} {title} ({contract_uuid})')
+
+
+def show_status():
+    cursor = load_cursor()
+    now = datetime.utcnow()
+    backlog = (db.session.query(db.func.count(ContractDeadline.id))
+               .filter(ContractDeadline.notify_at <= now)
+               .filter(ContractDeadline.notify_at > cursor.position_at if cursor.position_at is not None
+                       else db.true())
+               .scalar())
+    upcoming = (db.session.query(db.func.min(ContractDeadline.notify_at))
+                .filter(ContractDeadline.notify_at > now).scalar())
+    print(f'cursor: {cursor.position_at or "start"} (id {cursor.position_id}), {cursor.processed} notices sent, '
+          f'last moved {cursor.updated_at}')
+    print(f'due and not yet sent: about {backlog}; next notice due at {upcoming or "-"}')
+    print(f'delivery: {DEADLINE_WEBHOOK_URL or "log only"}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Contract deadline and renewal notices')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='send notices as they come due')
+    run_parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL_SECONDS,
+                            help='seconds between polls')
+    run_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='notices per webhook request')
+    run_parser.add_argument('--once', action='store_true', help='exit when no notice is due')
+    backfill_parser = subparsers.add_parser('backfill', help='extract deadlines from existing contracts')
+    backfill_parser.add_argument('--batch-size', type=int, default=DEFAULT_BACKFILL_BATCH_SIZE)
+    upcoming_parser = subparsers.add_parser('upcoming', help='print the deadlines of the coming days')
+    upcoming_parser.add_argument('--days', type=int, default=30)
+    subparsers.add_parser('status', help='print the cursor and backlog')
+    args = parser.parse_args()
+
+    # Adds the contract_deadline and process_cursor tables
+    init_db()
+    with app.app_context():
+        if args.command == 'run':
+            try:
+                total = run(args.interval, args.batch_size, args.once)
+                print(f'No notices due: {total} sent')
+            except CursorLost as exc:
+                print(f'Stopping: {exc}')
+            except KeyboardInterrupt:
+                pass
+        elif args.command == 'backfill':
+            read, added = backfill(args.batch_size)
+            print(f'Backfill finished: {read} contracts, {added} deadlines added')
+        elif args.command == 'upcoming':
+            show_upcoming(args.days)
+        else:
+            show_status()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""zstd compression of contract text against shared, versioned dictionaries.
+
+Contracts are mostly template boilerplate, so compressing each one against a
+dictionary built from the template corpus shrinks them far more than
+compressing them one by one. Dictionaries are immutable and identified by
+id; every compressed value records the id it needs. zstandard is a declared
+dependency, since compressed rows cannot be read without it; an environment
+that lacks it still starts, compresses nothing, and fails on those rows.
+"""
+import threading
+
+try:
+    import zstandard
+except ImportError:  # declared in pyproject.toml; tolerated so uncompressed databases still work
+    zstandard = None
+
+DEFAULT_DICTIONARY_SIZE = 112640
+DEFAULT_LEVEL = 9
+
+
+def build_dictionary(samples, size=DEFAULT_DICTIONARY_SIZE, trained=False):
+    """Dictionary bytes from text samples.
+
+    By default the samples (template texts) are used as a raw-content
+    dictionary, most recent last since zstd finds matches near the end of the
+    dictionary more cheaply. trained=True runs zstd's dictionary trainer,
+    which needs a large number of samples.
+    """
+    encoded = [sample.encode('utf-8') for sample in samples if sample]
+    if trained:
+        return zstandard.train_dictionary(size, encoded).as_bytes()
+    return b'\n'.join(encoded)[-size:]
+
+
+class DictionaryCodec:
+    def __init__(self, load_dictionary, level=DEFAULT_LEVEL):
+        # load_dictionary(dictionary_id) -> dictionary bytes
+        self.load_dictionary = load_dictionary
+        self.level = level
+        self.dictionaries = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @property
+    def available(self):
+        return zstandard is not None
+
+    def _dictionary(self, dictionary_id):
+        with self.lock:
+            dictionary = self.dictionaries.get(dictionary_id)
+        if dictionary is None:
+            dictionary = zstandard.ZstdCompressionDict(self.load_dictionary(dictionary_id))
+            dictionary.precompute_compress(level=self.level)
+            with self.lock:
+                self.dictionaries[dictionary_id] = dictionary
+        return dictionary
+
+    def _per_thread(self, kind, dictionary_id, factory):
+        # zstd contexts are not thread-safe, but are cheap to reuse within a thread
+        cache = self.local.__dict__.setdefault(kind, {})
+        if dictionary_id not in cache:
+            cache[dictionary_id] = factory(self._dictionary(dictionary_id))
+        return cache[dictionary_id]
+
+    def compress(self, text, dictionary_id):
+        if zstandard is None:
+            raise RuntimeError('zstandard is not installed')
+        compressor = self._per_thread('compressors', dictionary_id,
+                                      lambda d: zstandard.ZstdCompressor(level=self.level, dict_data=d))
+        return compressor.compress(text.encode('utf-8'))
+
+    def decompress(self, data, dictionary_id):
+        if zstandard is None:
+            raise RuntimeError('zstandard is not installed; cannot read compressed contracts')
+        decompressor = self._per_thread('decompressors', dictionary_id,
+                                        lambda d: zstandard.ZstdDecompressor(dict_data=d))
+        return decompressor.decompress(data).decode('utf-8')
@@ -0,0 +1,425 @@
+"""Editable DOCX and ODT exports of contracts, written directly with zipfile.
+
+No layout engine runs: the contract text becomes one paragraph per line,
+written into the package's main XML part as it is generated, and the look of
+the PDF (title rule, colours, signature section) comes from paragraph styles
+that Word or LibreOffice lay out when the file is opened.
+
+Packages are produced as a stream of byte chunks. zipfile writes into a
+spool that hands out everything before the part being written, so a
+response starts before the document is complete and at most one compressed
+part is held in memory. Vector signatures are embedded as SVG; Word only
+shows SVG next to a raster picture, so DOCX files also get a PNG rendering
+of it (the one costly step, cached per signature). Legacy PNG signatures are
+embedded as they are.
+"""
+import base64
+import math
+import re
+import struct
+import zipfile
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from urllib.parse import unquote
+from xml.sax.saxutils import escape
+
+from pdf_writer import parse_signature
+from signatures import SVG_DATA_URL_PREFIX, is_valid_signature
+
+EXPORT_FORMATS = {
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'odt': 'application/vnd.oasis.opendocument.text',
+}
+# Matches the signature image of generate_pdf_html, in CSS px
+SIGNATURE_MAX_WIDTH = 300
+# PNG renderings of vector signatures: pixels per CSS px of the displayed size, for print and HiDPI
+RASTER_SCALE = 2
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+IMAGE_TYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+PARAGRAPHS_PER_WRITE = 64
+
+INVALID_XML_CHARACTERS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+ODF_SPACES = re.compile(r'  +|^ ')
+
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Default Extension="png" ContentType="image/png"/>'
+    '<Default Extension="svg" ContentType="image/svg+xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>'
+    '</Types>')
+DOCX_PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="word/document.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '<Relationship Id="rId2" Target="docProps/core.xml" '
+    'Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties"/>'
+    '</Relationships>')
+DOCX_RELATIONSHIP = ('<Relationship Id="{id}" Target="{target}" '
+                     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/{type}"/>')
+# Sizes in half-points, spacing in twentieths of a point, borders in eighths of a point
+DOCX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:docDefaults><w:rPrDefault><w:rPr><w:rFonts w:ascii="Arial" w:hAnsi="Arial" w:eastAsia="Arial" w:cs="Arial"/>'
+    '<w:color w:val="333333"/><w:sz w:val="24"/><w:szCs w:val="24"/></w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="0" w:line="384" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+    '</w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/>'
+    '<w:next w:val="Normal"/><w:qFormat/><w:pPr><w:pBdr><w:bottom w:val="single" w:sz="18" w:space="8" '
+    'w:color="3498DB"/></w:pBdr><w:spacing w:before="320" w:after="320" w:line="276" w:lineRule="auto"/>'
+    '<w:outlineLvl w:val="0"/></w:pPr><w:rPr><w:b/><w:bCs/><w:color w:val="2C3E50"/><w:sz w:val="48"/>'
+    '<w:szCs w:val="48"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="SignatureHeading"><w:name w:val="Signature Heading"/>'
+    '<w:basedOn w:val="Normal"/><w:pPr><w:keepNext/><w:pBdr><w:top w:val="single" w:sz="12" w:space="15" '
+    'w:color="333333"/></w:pBdr><w:spacing w:before="900" w:after="150"/></w:pPr><w:rPr><w:b/><w:bCs/></w:rPr>'
+    '</w:style>'
+    '<w:style w:type="paragraph" w:styleId="SignedOn"><w:name w:val="Signed On"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:spacing w:before="300"/></w:pPr><w:rPr><w:sz w:val="20"/><w:szCs w:val="20"/></w:rPr></w:style>'
+    '</w:styles>')
+DOCX_DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+    'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"><w:body>')
+# A4 with 30 mm margins, in twentieths of a point
+DOCX_DOCUMENT_END = ('<w:sectPr><w:pgSz w:w="11906" w:h="16838"/><w:pgMar w:top="1701" w:right="1701" '
+                     'w:bottom="1701" w:left="1701" w:header="708" w:footer="708" w:gutter="0"/></w:sectPr>'
+                     '</w:body></w:document>')
+DOCX_SVG_EXTENSION = ('<a:extLst><a:ext uri="{{96DAC541-7B7A-43D3-8B79-37D633B846F1}}">'
+                      '<asvg:svgBlip xmlns:asvg="http://schemas.microsoft.com/office/drawing/2016/SVG/main" '
+                      'r:embed="{id}"/></a:ext></a:extLst>')
+DOCX_PICTURE = (
+    '<w:p><w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0"><wp:extent cx="{cx}" cy="{cy}"/>'
+    '<wp:docPr id="1" name="Signature" descr="Signature"/><a:graphic>'
+    '<a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture"><pic:pic>'
+    '<pic:nvPicPr><pic:cNvPr id="1" name="signature.png"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="rIdSignature">{extension}</a:blip><a:stretch><a:fillRect/></a:stretch>'
+    '</pic:blipFill><pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+    '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom><a:ln w="9525"><a:solidFill><a:srgbClr val="CCCCCC"/>'
+    '</a:solidFill></a:ln></pic:spPr></pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>')
+DOCX_CORE_PROPERTIES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><dc:title>{title}</dc:title>'
+    '<dcterms:created xsi:type="dcterms:W3CDTF">{created}</dcterms:created></cp:coreProperties>')
+
+ODT_NAMESPACES = (
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0" '
+    'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0" '
+    'xmlns:svg="urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink" '
+    'xmlns:meta="urn:oasis:names:tc:opendocument:xmlns:meta:1.0" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" office:version="1.2"')
+ODT_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    f'<office:document-styles {ODT_NAMESPACES}>'
+    '<office:font-face-decls><style:font-face style:name="Arial" svg:font-family="Arial"/></office:font-face-decls>'
+    '<office:styles>'
+    '<style:default-style style:family="paragraph"><style:paragraph-properties fo:line-height="160%"/>'
+    '<style:text-properties style:font-name="Arial" fo:font-size="12pt" fo:color="#333333"/></style:default-style>'
+    '<style:style style:name="Standard" style:family="paragraph"/>'
+    '<style:style style:name="Title" style:family="paragraph" style:parent-style-name="Standard" '
+    'style:next-style-name="Standard" style:default-outline-level="1"><style:paragraph-properties '
+    'fo:line-height="115%" fo:margin-top="16pt" fo:margin-bottom="16pt" fo:padding-bottom="7.5pt" '
+    'fo:border-bottom="2.25pt solid #3498db"/><style:text-properties fo:font-size="24pt" fo:font-weight="bold" '
+    'fo:color="#2c3e50"/></style:style>'
+    '<style:style style:name="Signature_20_Heading" style:display-name="Signature Heading" style:family="paragraph" '
+    'style:parent-style-name="Standard"><style:paragraph-properties fo:margin-top="45pt" fo:margin-bottom="7.5pt" '
+    'fo:padding-top="15pt" fo:border-top="1.5pt solid #333333" fo:keep-with-next="always"/>'
+    '<style:text-properties fo:font-weight="bold"/></style:style>'
+    '<style:style style:name="Signed_20_On" style:display-name="Signed On" style:family="paragraph" '
+    'style:parent-style-name="Standard"><style:paragraph-properties fo:margin-top="15pt"/>'
+    '<style:text-properties fo:font-size="10pt"/></style:style>'
+    '<style:style style:name="Signature_20_Image" style:display-name="Signature Image" style:family="graphic">'
+    '<style:graphic-properties fo:border="0.75pt solid #cccccc" fo:padding="7.5pt"/></style:style>'
+    '</office:styles>'
+    '<office:automatic-styles><style:page-layout style:name="A4"><style:page-layout-properties '
+    'fo:page-width="210mm" fo:page-height="297mm" fo:margin-top="30mm" fo:margin-bottom="30mm" '
+    'fo:margin-left="30mm" fo:margin-right="30mm"/></style:page-layout></office:automatic-styles>'
+    '<office:master-styles><style:master-page style:name="Standard" style:page-layout-name="A4"/>'
+    '</office:master-styles></office:document-styles>')
+ODT_META = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    f'<office:document-meta {ODT_NAMESPACES}><office:meta><meta:generator>Legal Documents Generator</meta:generator>'
+    '<dc:title>{title}</dc:title><meta:creation-date>{created}</meta:creation-date></office:meta>'
+    '</office:document-meta>')
+ODT_MANIFEST_START = (
+    '<?xml version="1.0" encoding="UTF-8"?><manifest:manifest '
+    'xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+    '<manifest:file-entry manifest:full-path="/" manifest:version="1.2" '
+    'manifest:media-type="application/vnd.oasis.opendocument.text"/>')
+ODT_MANIFEST_ENTRY = '<manifest:file-entry manifest:full-path="{path}" manifest:media-type="{media_type}"/>'
+ODT_FRAME = ('<text:p text:style-name="Standard"><draw:frame draw:style-name="Signature_20_Image" '
+             'draw:name="Signature" text:anchor-type="as-char" svg:width="{width}pt" svg:height="{height}pt">'
+             '<draw:image xlink:href="{href}" xlink:type="simple" xlink:show="embed" xlink:actuate="onLoad" '
+             'draw:mime-type="{media_type}"/></draw:frame></text:p>')
+
+
+class _Spool:
+    """Seekable sink for zipfile that releases the bytes zipfile will not go back to.
+
+    zipfile rewrites a part's local header once the part is written, so only
+    the bytes from the start of the part being written are kept.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+        self.position = 0
+
+    def write(self, data):
+        start = self.position - self.offset
+        self.buffer[start:start + len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position, whence=0):
+        if whence == 1:
+            position += self.position
+        elif whence == 2:
+            position += self.offset + len(self.buffer)
+        if position < self.offset:
+            raise OSError('position already sent')
+        self.position = position
+        return position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """Bytes written so far that have not been taken yet; call between parts only"""
+        end = self.position - self.offset
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        self.offset = self.position
+        return data
+
+
+def _xml(text):
+    return escape(INVALID_XML_CHARACTERS.sub('', text))
+
+
+def _lines(content):
+    return content.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+
+
+def _timestamp(created):
+    return (created or datetime.utcnow()).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+@lru_cache(maxsize=256)
+def signature_png(signature):
+    """Greyscale PNG of a vector signature, black strokes on white"""
+    width, height, stroke_width, strokes = parse_signature(signature)
+    scale = RASTER_SCALE * min(1, SIGNATURE_MAX_WIDTH / max(width, 1))
+    columns, rows = max(1, round(width * scale)), max(1, round(height * scale))
+    pixels = bytearray(b'\xff') * (columns * rows)
+    black = bytes(columns)
+    radius = stroke_width * scale / 2
+    # Half-widths of the pen's disc, row by row
+    spans = [(dy, int(math.sqrt(radius * radius - dy * dy)))
+             for dy in range(-math.ceil(radius), math.ceil(radius) + 1) if dy * dy <= radius * radius]
+    step = max(radius, 0.5)
+    for stroke in strokes:
+        points = [(x * scale, y * scale) for x, y in stroke]
+        for (x0, y0), (x1, y1) in zip(points, points[1:] or points):
+            count = max(1, math.ceil(math.hypot(x1 - x0, y1 - y0) / step))
+            for i in range(count + 1):
+                cx = round(x0 + (x1 - x0) * i / count)
+                cy = round(y0 + (y1 - y0) * i / count)
+                for dy, half in spans:
+                    y = cy + dy
+                    if 0 <= y < rows:
+                        left = cx - half if cx > half else 0
+                        right = cx + half + 1 if cx + half < columns else columns
+                        if left < right:
+                            pixels[y * columns + left:y * columns + right] = black[:right - left]
+    raw = b''.join(b'\x00' + pixels[y * columns:(y + 1) * columns] for y in range(rows))
+    return (PNG_SIGNATURE + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', columns, rows, 8, 0, 0, 0, 0))
+            + _png_chunk(b'IDAT', zlib.compress(raw, 6)) + _png_chunk(b'IEND', b''))
+
+
+def signature_image(signature):
+    """(extension, image bytes, width px, height px) of an SVG or PNG signature data URL, or None"""
+    if not is_valid_signature(signature):
+        return None
+    if signature.startswith(SVG_DATA_URL_PREFIX):
+        width, height, _, _ = parse_signature(signature)
+        return 'svg', unquote(signature[len(SVG_DATA_URL_PREFIX):]).encode('utf-8'), width, height
+    header, _, payload = signature.partition(',')
+    if header != 'data:image/png;base64':
+        return None
+    try:
+        png = base64.b64decode(payload, validate=True)
+    except ValueError:
+        return None
+    if png[:8] != PNG_SIGNATURE or png[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', png[16:24])
+    return 'png', png, width, height
+
+
+def _display_size(image):
+    """Width and height in CSS px, at most SIGNATURE_MAX_WIDTH wide"""
+    _, _, width, height = image
+    display_width = min(width, SIGNATURE_MAX_WIDTH)
+    return display_width, height * display_width / width if width else 0
+
+
+def _write_part(package, name, chunks):
+    """Write a part from an iterable of str, a batch of paragraphs at a time"""
+    with package.open(name, 'w') as part:
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= PARAGRAPHS_PER_WRITE:
+                part.write(''.join(batch).encode('utf-8'))
+                batch = []
+        part.write(''.join(batch).encode('utf-8'))
+
+
+def _docx_paragraph(line):
+    if not line:
+        return '<w:p/>'
+    runs = '<w:tab/>'.join(f'<w:t xml:space="preserve">{_xml(part)}</w:t>' if part else ''
+                           for part in line.split('\t'))
+    return f'<w:p><w:r>{runs}</w:r></w:p>'
+
+
+def _docx_document(title, content, image, signed_on):
+    yield DOCX_DOCUMENT_START
+    yield f'<w:p><w:pPr><w:pStyle w:val="Title"/></w:pPr><w:r><w:t xml:space="preserve">{_xml(title)}</w:t></w:r></w:p>'
+    for line in _lines(content):
+        yield _docx_paragraph(line)
+    if image is not None:
+        yield ('<w:p><w:pPr><w:pStyle w:val="SignatureHeading"/></w:pPr>'
+               '<w:r><w:t>Electronic Signature:</w:t></w:r></w:p>')
+        width, height = _display_size(image)
+        extension = DOCX_SVG_EXTENSION.format(id='rIdSignatureSvg') if image[0] == 'svg' else ''
+        # 9525 EMU per CSS px
+        yield DOCX_PICTURE.format(cx=round(width * 9525), cy=round(height * 9525), extension=extension)
+        if signed_on:
+            yield (f'<w:p><w:pPr><w:pStyle w:val="SignedOn"/></w:pPr>'
+                   f'<w:r><w:t xml:space="preserve">Signed on: {_xml(signed_on)}</w:t></w:r></w:p>')
+    yield DOCX_DOCUMENT_END
+
+
+def docx_chunks(title, content, signature='', signed_on='', created=None):
+    """A DOCX package, yielded in chunks"""
+    image = signature_image(signature)
+    spool = _Spool()
+    with zipfile.ZipFile(spool, 'w', zipfile.ZIP_DEFLATED) as package:
+        relationships = [DOCX_RELATIONSHIP.format(id='rIdStyles', target='styles.xml', type='styles')]
+        package.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        package.writestr('_rels/.rels', DOCX_PACKAGE_RELS)
+        package.writestr('docProps/core.xml', DOCX_CORE_PROPERTIES.format(title=_xml(title),
+                                                                          created=_timestamp(created)))
+        package.writestr('word/styles.xml', DOCX_STYLES)
+        if image is not None:
+            extension, data, _, _ = image
+            # Word shows SVG only as an extension of a raster picture
+            png = signature_png(signature) if extension == 'svg' else data
+            package.writestr('word/media/signature.png', png, compress_type=zipfile.ZIP_STORED)
+            relationships.append(DOCX_RELATIONSHIP.format(id='rIdSignature', target='media/signature.png',
+                                                          type='image'))
+            if extension == 'svg':
+                package.writestr('word/media/signature.svg', data)
+                relationships.append(DOCX_RELATIONSHIP.format(id='rIdSignatureSvg', target='media/signature.svg',
+                                                              type='image'))
+        package.writestr('word/_rels/document.xml.rels',
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         + ''.join(relationships) + '</Relationships>')
+        yield spool.take()
+        _write_part(package, 'word/document.xml', _docx_document(title, content, image, signed_on))
+    yield spool.take()
+
+
+def _odt_text(text):
+    """Paragraph content; ODF collapses runs of spaces unless they are written as <text:s/>"""
+    def spaces(match):
+        count = len(match.group())
+        if match.start() == 0:
+            return f'<text:s text:c="{count}"/>'
+        return f' <text:s text:c="{count - 1}"/>'
+    return '<text:tab/>'.join(ODF_SPACES.sub(spaces, _xml(part)) for part in text.split('\t'))
+
+
+def _odt_content(title, content, image, signed_on):
+    yield f'<?xml version="1.0" encoding="UTF-8"?><office:document-content {ODT_NAMESPACES}><office:body><office:text>'
+    yield f'<text:h text:style-name="Title" text:outline-level="1">{_odt_text(title)}</text:h>'
+    for line in _lines(content):
+        yield f'<text:p text:style-name="Standard">{_odt_text(line)}</text:p>'
+    if image is not None:
+        yield '<text:p text:style-name="Signature_20_Heading">Electronic Signature:</text:p>'
+        width, height = _display_size(image)
+        yield ODT_FRAME.format(width=f'{width * 0.75:.2f}', height=f'{height * 0.75:.2f}',
+                               href=f'Pictures/signature.{image[0]}', media_type=IMAGE_TYPES[image[0]])
+        if signed_on:
+            yield f'<text:p text:style-name="Signed_20_On">Signed on: {_odt_text(signed_on)}</text:p>'
+    yield '</office:text></office:body></office:document-content>'
+
+
+def odt_chunks(title, content, signature='', signed_on='', created=None):
+    """An ODT package, yielded in chunks"""
+    image = signature_image(signature)
+    spool = _Spool()
+    with zipfile.ZipFile(spool, 'w', zipfile.ZIP_DEFLATED) as package:
+        # Must come first and uncompressed, so the type can be sniffed from a fixed offset
+        package.writestr('mimetype', EXPORT_FORMATS['odt'], compress_type=zipfile.ZIP_STORED)
+        entries = [('content.xml', 'text/xml'), ('styles.xml', 'text/xml'), ('meta.xml', 'text/xml')]
+        package.writestr('styles.xml', ODT_STYLES)
+        package.writestr('meta.xml', ODT_META.format(title=_xml(title), created=_timestamp(created)[:-1]))
+        if image is not None:
+            # ODF readers take SVG as it is, so vector signatures need no raster copy
+            extension, data, _, _ = image
+            package.writestr(f'Pictures/signature.{extension}', data,
+                             compress_type=zipfile.ZIP_STORED if extension == 'png' else zipfile.ZIP_DEFLATED)
+            entries.append((f'Pictures/signature.{extension}', IMAGE_TYPES[extension]))
+        package.writestr('META-INF/manifest.xml', ODT_MANIFEST_START
+                         + ''.join(ODT_MANIFEST_ENTRY.format(path=path, media_type=media_type)
+                                   for path, media_type in entries)
+                         + '</manifest:manifest>')
+        yield spool.take()
+        _write_part(package, 'content.xml', _odt_content(title, content, image, signed_on))
+    yield spool.take()
+
+
+def export_chunks(fmt, title, content, signature='', signed_on='', created=None):
+    """A contract as a DOCX or ODT package, yielded in chunks"""
+    writer = docx_chunks if fmt == 'docx' else odt_chunks
+    return writer(title, content, signature, signed_on, created)
+
+
+def bulk_export_chunks(fmt, documents):
+    """A ZIP of one fmt file per (filename, title, content, signature, signed_on, created), yielded in chunks.
+    Each document is built in memory, then stored without recompression."""
+    spool = _Spool()
+    with zipfile.ZipFile(spool, 'w', zipfile.ZIP_STORED) as archive:
+        for filename, title, content, signature, signed_on, created in documents:
+            archive.writestr(filename, b''.join(export_chunks(fmt, title, content, signature, signed_on, created)))
+            yield spool.take()
+    yield spool.take()
@@ -0,0 +1,222 @@
+"""Contract emails written and sent as streams over a pool of persistent SMTP connections.
+
+contract_message_chunks() yields a multipart/mixed message with the PDF
+attached in base64, reading the PDF a block at a time, so a large contract
+is never held in memory whole. send_message() sends those chunks with the
+SMTP DATA command, which smtplib.SMTP.sendmail() would only accept as one
+string. SmtpPool keeps up to size logged-in connections open between
+messages and hands them to threads, so a busy sender pays for the TCP,
+TLS and AUTH handshakes once per connection rather than once per message;
+connections are retired after max_messages and checked with NOOP after
+sitting idle.
+
+This module only knows SMTP and MIME; mail_worker.py decides what to send.
+"""
+import base64
+import re
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from email.header import Header
+from email.utils import encode_rfc2231, formataddr, formatdate, make_msgid
+
+# 57 input bytes encode to one 76-character base64 line (RFC 2045)
+BASE64_LINE_BYTES = 57
+# Lines of base64 per chunk read from the PDF (about 57 KiB in, 77 KiB out)
+BASE64_LINES_PER_CHUNK = 1000
+IDLE_CHECK_SECONDS = 30
+MAX_IDLE_SECONDS = 120
+# Line breaks and other control characters in a header value would end the header
+HEADER_UNSAFE = re.compile(r'[\x00-\x1f\x7f\u2028\u2029]+')
+
+
+def header_value(value):
+    """A header value on one line, RFC 2047 encoded when it is not plain ASCII"""
+    value = HEADER_UNSAFE.sub(' ', value).strip()
+    try:
+        value.encode('ascii')
+        return value
+    except UnicodeEncodeError:
+        return Header(value, 'utf-8').encode()
+
+
+def filename_parameter(filename):
+    try:
+        filename.encode('ascii')
+        return f'filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"filename*={encode_rfc2231(filename, 'utf-8')}"
+
+
+def base64_lines(data):
+    """data as CRLF-terminated 76-character base64 lines"""
+    encoded = base64.b64encode(data)
+    return b''.join(encoded[start:start + 76] + b'\r\n' for start in range(0, len(encoded), 76))
+
+
+def contract_message_chunks(sender, recipient, subject, text, filename, pdf_file):
+    """Yield a contract email as bytes with CRLF line endings, reading pdf_file in blocks"""
+    boundary = f'=={make_msgid()[1:-1].replace("@", ".")}=='
+    sender_domain = sender.rpartition('@')[2] or None
+    headers = [
+        f'From: {formataddr((None, sender))}',
+        f'To: {formataddr((None, recipient))}',
+        f'Subject: {header_value(subject)}',
+        f'Date: {formatdate(usegmt=True)}',
+        f'Message-ID: {make_msgid(domain=sender_domain)}',
+        'MIME-Version: 1.0',
+        f'Content-Type: multipart/mixed; boundary="{boundary}"',
+        '',
+        f'--{boundary}',
+        'Content-Type: text/plain; charset="utf-8"',
+        'Content-Transfer-Encoding: base64',
+        '',
+    ]
+    yield ('\r\n'.join(headers) + '\r\n').encode('ascii') + base64_lines(text.encode('utf-8'))
+    yield (f'--{boundary}\r\n'
+           f'Content-Type: application/pdf\r\n'
+           f'Content-Transfer-Encoding: base64\r\n'
+           f'Content-Disposition: attachment; {filename_parameter(filename)}\r\n\r\n').encode('ascii')
+    while True:
+        block = pdf_file.read(BASE64_LINE_BYTES * BASE64_LINES_PER_CHUNK)
+        if not block:
+            break
+        yield base64_lines(block)
+    yield f'--{boundary}--\r\n'.encode('ascii')
+
+
+def send_message(smtp, sender, recipient, chunks):
+    """Send one message whose body comes from chunks; returns the server's reply to the data.
+
+    chunks must be CRLF-terminated lines, none starting with '.', which is
+    true of contract_message_chunks(): its lines are headers and base64.
+    """
+    smtp.ehlo_or_helo_if_needed()
+    code, reply = smtp.mail(sender)
+    if code != 250:
+        smtp.rset()
+        raise smtplib.SMTPSenderRefused(code, reply, sender)
+    code, reply = smtp.rcpt(recipient)
+    if code not in (250, 251):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused({recipient: (code, reply)})
+    smtp.putcmd('data')
+    code, reply = smtp.getreply()
+    if code != 354:
+        smtp.rset()
+        raise smtplib.SMTPDataError(code, reply)
+    for chunk in chunks:
+        smtp.send(chunk)
+    smtp.send(b'.\r\n')
+    code, reply = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, reply)
+    return reply.decode('utf-8', 'replace')
+
+
+def is_permanent_failure(exc):
+    """5xx replies will not succeed on a retry; everything else (4xx, network errors) may"""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    return isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code >= 500
+
+
+class SmtpPool:
+    """Thread-safe pool of up to size persistent SMTP connections"""
+
+    def __init__(self, host, port, size=4, username=None, password=None, starttls=False, timeout=30,
+                 max_messages=100):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        # (connection, messages sent on it, last used) of connections not in use
+        self.idle = []
+        self.stats = {'connections': 0, 'messages': 0}
+
+    def connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password or '')
+        with self.lock:
+            self.stats['connections'] += 1
+        return smtp
+
+    def take(self):
+        """An idle connection that still answers, or a new one; returns (connection, messages sent on it)"""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                smtp, sent, last_used = self.idle.pop()
+            idle_for = time.monotonic() - last_used
+            if idle_for > MAX_IDLE_SECONDS:
+                self.discard(smtp)
+                continue
+            if idle_for > IDLE_CHECK_SECONDS:
+                try:
+                    if smtp.noop()[0] != 250:
+                        raise smtplib.SMTPException('NOOP refused')
+                except (smtplib.SMTPException, OSError):
+                    self.discard(smtp, quit=False)
+                    continue
+            return smtp, sent
+        return self.connect(), 0
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for one message; it goes back to the pool unless it broke"""
+        with self.slots:
+            smtp, sent = self.take()
+            try:
+                yield smtp
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # A refused message leaves the connection usable once the transaction is reset
+                self.release(smtp, sent + 1, reset=True)
+                raise
+            except BaseException:
+                # Disconnects and socket errors (SMTPException is an OSError too) leave it in an unknown state
+                self.discard(smtp, quit=False)
+                raise
+            with self.lock:
+                self.stats['messages'] += 1
+            self.release(smtp, sent + 1)
+
+    def release(self, smtp, sent, reset=False):
+        if sent >= self.max_messages:
+            self.discard(smtp)
+            return
+        try:
+            if reset:
+                smtp.rset()
+        except (smtplib.SMTPException, OSError):
+            self.discard(smtp, quit=False)
+            return
+        with self.lock:
+            self.idle.append((smtp, sent, time.monotonic()))
+
+    def discard(self, smtp, quit=True):
+        try:
+            if quit:
+                smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        smtp.close()
+
+    def close_idle(self, older_than=0):
+        """QUIT idle connections unused for older_than seconds (all of them by default)"""
+        now = time.monotonic()
+        with self.lock:
+            stale = [entry for entry in self.idle if now - entry[2] >= older_than]
+            self.idle = [entry for entry in self.idle if now - entry[2] < older_than]
+        for smtp, _, _ in stale:
+            self.discard(smtp)
+        return len(stale)
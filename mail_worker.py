@@ -0,0 +1,277 @@
+"""Mail worker: emails queued contract PDFs over a pool of persistent SMTP connections.
+
+/contract/<uuid>/send (or the recipients field when saving a contract)
+stores one ContractDelivery per recipient; this process claims them under
+a lease, sends each as its own message with the PDF attached and records
+the outcome on the delivery and in the contract's delivery_status.
+Messages go out on up to --connections threads, each borrowing a
+connection from SmtpPool, so one connection carries many messages in a
+row and is only replaced after --messages-per-connection messages or
+when the server drops it. The PDF is streamed from generated_contracts/
+(or its pack, once archived) into the message; a queued render is waited
+for.
+
+Temporary failures (4xx replies, network errors, expired leases) are
+retried with exponential backoff; 5xx replies and the last of
+MAIL_MAX_ATTEMPTS attempts mark the delivery failed. At most
+MAIL_DOMAIN_CONCURRENCY messages to one recipient domain are in flight
+at a time, across all workers. Claims are compare-and-set UPDATEs, so any
+number of workers can run.
+
+    python mail_worker.py [--connections 4] [--messages-per-connection 100] [--poll 5] [--once]
+
+For local testing, run Python's debugging SMTP server (Python 3.11 and
+earlier) and point SMTP_HOST/SMTP_PORT at it:
+
+    python -m smtpd -n -c DebuggingServer localhost:1025
+"""
+import argparse
+import os
+import random
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app import (app, db, init_db, Contract, ContractDelivery, CONTRACTS_DIR, SMTP_HOST, SMTP_PORT, SMTP_USERNAME,
+                 SMTP_PASSWORD, SMTP_STARTTLS, MAIL_FROM, MAIL_DOMAIN_CONCURRENCY, PUBLIC_BASE_URL, open_archived_pdf,
+                 update_delivery_status)
+from mail_delivery import SmtpPool, contract_message_chunks, send_message, is_permanent_failure
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_POLL_SECONDS = 5.0
+DEFAULT_CONNECTIONS = 4
+DEFAULT_MESSAGES_PER_CONNECTION = 100
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 6 * 3600
+# How long a delivery waits before looking again for a PDF still being rendered
+RENDER_WAIT_SECONDS = 30
+CLAIM_CANDIDATES = 50
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def backoff_seconds(attempts):
+    """Exponential backoff with jitter so failing deliveries do not retry in lockstep"""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def release_values(attempts, max_attempts, now, error, permanent=False):
+    """Columns that give up a claimed delivery: retry after a backoff, or mark it failed"""
+    if permanent or attempts >= max_attempts:
+        return dict(status='failed', last_error=error, lease_owner=None, lease_expires_at=None)
+    return dict(status='queued', run_after=now + timedelta(seconds=backoff_seconds(attempts)), last_error=error,
+                lease_owner=None, lease_expires_at=None)
+
+
+def release(delivery, now, error, permanent=False):
+    """Give up a claimed delivery: retry after a backoff, or mark it failed"""
+    for column, value in release_values(delivery.attempts, delivery.max_attempts, now, error, permanent).items():
+        setattr(delivery, column, value)
+
+
+def requeue_expired_leases():
+    """Queue again (or fail) deliveries whose worker died while sending them"""
+    now = datetime.utcnow()
+    expired = (db.session.query(ContractDelivery.id, ContractDelivery.contract_id, ContractDelivery.lease_owner,
+                                ContractDelivery.attempts, ContractDelivery.max_attempts)
+               .filter(ContractDelivery.status == 'sending', ContractDelivery.lease_expires_at < now).all())
+    requeued = 0
+    contract_ids = set()
+    for delivery_id, contract_id, lease_owner, attempts, max_attempts in expired:
+        # Only while the lease is still the expired one: its worker may have finished the delivery since
+        result = db.session.execute(update(ContractDelivery)
+                                    .where(ContractDelivery.id == delivery_id, ContractDelivery.status == 'sending',
+                                           ContractDelivery.lease_owner == lease_owner,
+                                           ContractDelivery.lease_expires_at < now)
+                                    .values(**release_values(attempts, max_attempts, now,
+                                                             f'lease held by {lease_owner} expired')))
+        if result.rowcount == 1:
+            requeued += 1
+            contract_ids.add(contract_id)
+    for contract_id in contract_ids:
+        update_delivery_status(contract_id)
+    db.session.commit()
+    return requeued
+
+
+def claim_deliveries(owner, lease_seconds, limit):
+    """Claim up to limit runnable deliveries, keeping each domain under MAIL_DOMAIN_CONCURRENCY; returns their ids"""
+    if limit <= 0:
+        return []
+    now = datetime.utcnow()
+    in_flight = dict(db.session.query(ContractDelivery.domain, db.func.count())
+                     .filter(ContractDelivery.status == 'sending').group_by(ContractDelivery.domain).all())
+    candidates = (db.session.query(ContractDelivery.id, ContractDelivery.domain)
+                  .filter(ContractDelivery.status == 'queued', ContractDelivery.run_after <= now)
+                  .order_by(ContractDelivery.run_after, ContractDelivery.id).limit(max(limit, CLAIM_CANDIDATES)).all())
+    claim = dict(status='sending', lease_owner=owner, lease_expires_at=now + timedelta(seconds=lease_seconds),
+                 attempts=ContractDelivery.attempts + 1)
+    claimed = []
+    for delivery_id, domain in candidates:
+        if len(claimed) >= limit:
+            break
+        if in_flight.get(domain, 0) >= MAIL_DOMAIN_CONCURRENCY:
+            continue
+        # Taken only if still queued when the UPDATE runs
+        result = db.session.execute(update(ContractDelivery)
+                                    .where(ContractDelivery.id == delivery_id, ContractDelivery.status == 'queued')
+                                    .values(**claim))
+        if result.rowcount == 1:
+            claimed.append(delivery_id)
+            in_flight[domain] = in_flight.get(domain, 0) + 1
+    db.session.commit()
+    return claimed
+
+
+def message_text(title, contract_uuid):
+    text = f'Please find attached the contract "{title}".\n'
+    if PUBLIC_BASE_URL:
+        text += f'\nView it online: {PUBLIC_BASE_URL}/contract/{contract_uuid}\n'
+    return text
+
+
+def open_pdf(contract):
+    """The contract's PDF opened for reading, from generated_contracts/ or its pack; None if there is none yet"""
+    try:
+        return open(os.path.join(CONTRACTS_DIR, contract.pdf_filename), 'rb')
+    except FileNotFoundError:
+        # Never rendered yet, or moved into a pack by pdf_archive.py
+        return open_archived_pdf(contract.pdf_filename)
+
+
+def send(pool, recipient, subject, text, filename, pdf_file):
+    """Send one message on a pooled connection (runs on a sender thread); returns (outcome, detail)"""
+    try:
+        with pdf_file, pool.connection() as smtp:
+            reply = send_message(smtp, MAIL_FROM, recipient,
+                                 contract_message_chunks(MAIL_FROM, recipient, subject, text, filename, pdf_file))
+    except Exception as exc:
+        return ('failed' if is_permanent_failure(exc) else 'retry'), f'{type(exc).__name__}: {exc}'
+    return 'sent', reply
+
+
+def finish(delivery_id, owner, outcome, detail):
+    """Record a send's outcome if this worker still holds the lease; returns the outcome or 'lost'"""
+    now = datetime.utcnow()
+    delivery = db.session.get(ContractDelivery, delivery_id)
+    if outcome == 'lost' or delivery is None or delivery.lease_owner != owner or delivery.status != 'sending':
+        db.session.rollback()
+        return 'lost'
+    if outcome == 'sent':
+        delivery.status = 'sent'
+        delivery.sent_at = now
+        delivery.smtp_reply = detail[:200]
+        delivery.last_error = None
+        delivery.lease_owner = None
+        delivery.lease_expires_at = None
+        Contract.query.filter_by(id=delivery.contract_id).update({Contract.delivered_at: now},
+                                                                 synchronize_session=False)
+    elif outcome == 'waiting':
+        # Not an attempt: the PDF is still being rendered
+        delivery.attempts -= 1
+        delivery.status = 'queued'
+        delivery.run_after = now + timedelta(seconds=RENDER_WAIT_SECONDS)
+        delivery.lease_owner = None
+        delivery.lease_expires_at = None
+    else:
+        release(delivery, now, detail, permanent=outcome == 'failed')
+        outcome = delivery.status if delivery.status == 'failed' else 'retry'
+    db.session.flush()
+    update_delivery_status(delivery.contract_id)
+    db.session.commit()
+    return outcome
+
+
+def prepare(delivery_id):
+    """Everything a sender thread needs for a claimed delivery, or (outcome, detail) when it cannot be sent now"""
+    delivery = db.session.get(ContractDelivery, delivery_id)
+    contract = db.session.get(Contract, delivery.contract_id) if delivery is not None else None
+    if contract is None:
+        # The contract was deleted (its deliveries with it) after the claim
+        return None, ('lost', None)
+    pdf_file = open_pdf(contract)
+    if pdf_file is None:
+        job = contract.render_job
+        if job is not None and job.pending:
+            return None, ('waiting', None)
+        return None, ('retry', f'PDF {contract.pdf_filename} not found')
+    return (delivery.recipient, contract.title, message_text(contract.title, contract.uuid),
+            contract.pdf_filename, pdf_file), None
+
+
+def run(connections=DEFAULT_CONNECTIONS, messages_per_connection=DEFAULT_MESSAGES_PER_CONNECTION,
+        lease_seconds=DEFAULT_LEASE_SECONDS, poll_seconds=DEFAULT_POLL_SECONDS, once=False, log=print):
+    """Send deliveries until interrupted (or until none is runnable with once=True)"""
+    owner = worker_id()
+    pool = SmtpPool(SMTP_HOST, SMTP_PORT, size=connections, username=SMTP_USERNAME, password=SMTP_PASSWORD,
+                    starttls=SMTP_STARTTLS, max_messages=messages_per_connection)
+    counts = {'sent': 0, 'retry': 0, 'failed': 0, 'waiting': 0, 'lost': 0}
+    next_reap = 0.0
+    in_flight = {}
+    try:
+        with ThreadPoolExecutor(max_workers=connections, thread_name_prefix='smtp') as executor:
+            while True:
+                if time.monotonic() >= next_reap:
+                    requeued = requeue_expired_leases()
+                    if requeued:
+                        log(f'{requeued} deliveries with expired leases requeued')
+                    next_reap = time.monotonic() + lease_seconds / 2
+
+                for delivery_id in claim_deliveries(owner, lease_seconds, connections - len(in_flight)):
+                    message, outcome = prepare(delivery_id)
+                    if outcome is not None:
+                        counts[finish(delivery_id, owner, *outcome)] += 1
+                        continue
+                    in_flight[executor.submit(send, pool, *message)] = delivery_id
+                db.session.expunge_all()
+
+                if not in_flight:
+                    if once:
+                        return counts
+                    pool.close_idle(older_than=poll_seconds * 2)
+                    time.sleep(poll_seconds)
+                    continue
+                done, _ = wait(in_flight, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+                for future in done:
+                    delivery_id = in_flight.pop(future)
+                    outcome, detail = future.result()
+                    result = finish(delivery_id, owner, outcome, detail)
+                    counts[result] += 1
+                    log(f'delivery {delivery_id}: {result}' + (f' ({detail})' if result != 'sent' else ''))
+                db.session.expunge_all()
+    finally:
+        pool.close_idle()
+        log(f'{pool.stats["messages"]} messages over {pool.stats["connections"]} SMTP connections')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Email queued contract PDFs')
+    parser.add_argument('--connections', type=int, default=DEFAULT_CONNECTIONS,
+                        help='SMTP connections kept open, and messages sent in parallel')
+    parser.add_argument('--messages-per-connection', type=int, default=DEFAULT_MESSAGES_PER_CONNECTION,
+                        help='messages sent on a connection before it is replaced')
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS,
+                        help='seconds a claimed delivery stays leased')
+    parser.add_argument('--poll', type=float, default=DEFAULT_POLL_SECONDS,
+                        help='seconds to wait when nothing is runnable')
+    parser.add_argument('--once', action='store_true', help='exit when no delivery is runnable')
+    args = parser.parse_args()
+
+    # Adds the contract_delivery table and the contract delivery columns
+    init_db()
+    with app.app_context():
+        try:
+            counts = run(args.connections, args.messages_per_connection, args.lease, args.poll, args.once)
+            print(f'Queue empty: {counts}')
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
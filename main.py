@@ -1,6 +1,7 @@
-from app import app, init_db
+from app import app, init_db, precompile_templates
 
 init_db()
+precompile_templates()
 
 if __name__ == '__main__':
     app.run(debug=True)
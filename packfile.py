@@ -0,0 +1,140 @@
+"""Append-only pack files holding many PDFs, with a sidecar offset index.
+
+A pack is the members' bytes concatenated (pack-20260101T000000-ab12cd.pack);
+its index (same name, .idx) has one "name<TAB>offset<TAB>length" line per member, so a
+pack can be inspected or reconciled without the database. Packs are written
+to a temporary name, fsynced and renamed, and never modified afterwards;
+compaction writes a new pack instead.
+
+Members are served through PackSlice, a bounded file-like view of the pack.
+WSGI servers whose file_wrapper uses sendfile() (gunicorn) send it with
+zero-copy os.sendfile(), bounded by Content-Length; other servers read it
+through an mmap of the pack.
+"""
+import mmap
+import os
+import time
+import uuid
+
+INDEX_SUFFIX = '.idx'
+PACK_SUFFIX = '.pack'
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def new_pack_name():
+    """Unique, time-ordered pack file name"""
+    return f'pack-{time.strftime("%Y%m%dT%H%M%S", time.gmtime())}-{uuid.uuid4().hex[:6]}{PACK_SUFFIX}'
+
+
+def index_path(pack_path):
+    return pack_path[:-len(PACK_SUFFIX)] + INDEX_SUFFIX
+
+
+class PackWriter:
+    """Write one pack; add() members, then finish() to make it visible under its final name"""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.file = open(self.tmp_path, 'wb')
+        self.members = []
+        self.size = 0
+
+    def add(self, name, source, length):
+        """Copy length bytes from the open file source; returns the member's offset"""
+        offset = self.size
+        remaining = length
+        while remaining:
+            chunk = source.read(min(COPY_BUFFER_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f'{name}: expected {length} bytes, source ended early')
+            self.file.write(chunk)
+            remaining -= len(chunk)
+        self.members.append((name, offset, length))
+        self.size += length
+        return offset
+
+    def add_file(self, name, path):
+        with open(path, 'rb') as source:
+            return self.add(name, source, os.fstat(source.fileno()).st_size)
+
+    def finish(self):
+        """Flush the pack and its index to disk and rename them into place"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        tmp_index = index_path(self.path) + '.tmp'
+        with open(tmp_index, 'w', encoding='utf-8') as index:
+            for name, offset, length in self.members:
+                index.write(f'{name}\t{offset}\t{length}\n')
+            index.flush()
+            os.fsync(index.fileno())
+        os.replace(tmp_index, index_path(self.path))
+        os.replace(self.tmp_path, self.path)
+        return self.members
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def read_index(pack_path):
+    """List of (name, offset, length) from a pack's index file"""
+    members = []
+    with open(index_path(pack_path), encoding='utf-8') as index:
+        for line in index:
+            name, offset, length = line.rstrip('\n').split('\t')
+            members.append((name, int(offset), int(length)))
+    return members
+
+
+def remove_pack(pack_path):
+    for path in (pack_path, index_path(pack_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class PackSlice:
+    """Read-only file-like view of one pack member.
+
+    fileno() is the pack itself, positioned at the member's offset, which is
+    what a sendfile()-based file_wrapper needs; read() never goes past the
+    member's end.
+    """
+
+    def __init__(self, pack_path, offset, length):
+        self.file = open(pack_path, 'rb')
+        self.file.seek(offset)
+        self.offset = offset
+        self.length = length
+        self.position = 0
+        self.map = None
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        if size <= 0:
+            return b''
+        if self.map is None:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        start = self.offset + self.position
+        self.position += size
+        return self.map[start:start + size]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,256 @@
+"""Archive tier: roll old contract PDFs into large pack files.
+
+PDFs older than --min-age-days are appended to pack files in
+generated_contracts/packs/ (see packfile.py) and their own files removed, so
+the directory holds a few large files instead of millions of small ones.
+ArchivedPdf rows map each pdf_filename to its pack, offset and length;
+download_contract serves archived PDFs straight from the pack, and nothing
+else needs to know whether a PDF is archived.
+
+Thumbnails are kept in generated_contracts/thumbnails/ and stay there;
+one still written next to its PDF is moved there when the PDF is removed.
+
+Deleting a contract only shrinks its pack's live counters. Compaction
+rewrites packs whose live bytes fell below --compact-below of their size
+into new packs and removes packs that are empty.
+
+A pack and its rows are committed before any original file is removed, and
+a .pending marker next to the pack lasts until all of them are, so the next
+run can finish (or discard) whatever an interrupted run left behind.
+
+    python pdf_archive.py run [--min-age-days 90] [--pack-size-mb 1024] [--compact-below 0.5]
+    python pdf_archive.py run --interval 86400     # keep running, once a day
+    python pdf_archive.py report
+"""
+import argparse
+import fcntl
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, literal, select
+
+from app import app, db, init_db, Contract, ArchivedPdf, PdfPack, CONTRACTS_DIR, PACKS_DIR
+from packfile import PackWriter, PackSlice, PACK_SUFFIX, INDEX_SUFFIX, new_pack_name, read_index, remove_pack
+from thumbnails import move_legacy_thumbnail
+
+DEFAULT_MIN_AGE_DAYS = 90
+DEFAULT_PACK_SIZE_MB = 1024
+DEFAULT_COMPACT_BELOW = 0.5
+DB_BATCH_SIZE = 1000
+
+
+def acquire_archive_lock():
+    """Only one archiver may write packs at a time; returns the held lock file"""
+    os.makedirs(PACKS_DIR, exist_ok=True)
+    lock = open(os.path.join(PACKS_DIR, '.archive.lock'), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        raise RuntimeError('another pdf_archive.py run is in progress')
+    return lock
+
+
+def pending_marker(pack_path):
+    """Exists while a committed pack's originals may not all be removed yet"""
+    return pack_path + '.pending'
+
+
+def remove_originals(pack_path):
+    for name, _, _ in read_index(pack_path):
+        pdf_path = os.path.join(CONTRACTS_DIR, name)
+        move_legacy_thumbnail(pdf_path)
+        try:
+            os.remove(pdf_path)
+        except FileNotFoundError:
+            pass
+    os.remove(pending_marker(pack_path))
+
+
+def recover(log=print):
+    """Finish or undo the work of an interrupted run"""
+    known = {filename for (filename,) in db.session.query(PdfPack.filename)}
+    for entry in os.scandir(PACKS_DIR):
+        name = entry.name
+        if name.endswith('.pending'):
+            pack_name = name[:-len('.pending')]
+            if pack_name in known:
+                remove_originals(os.path.join(PACKS_DIR, pack_name))
+                log(f'removed archived originals of {pack_name}')
+            else:
+                os.remove(entry.path)
+        elif name.endswith('.tmp'):
+            os.remove(entry.path)
+        elif name.endswith(PACK_SUFFIX) and name not in known:
+            # Written but never committed
+            remove_pack(entry.path)
+            log(f'removed unreferenced {name}')
+        elif name.endswith(INDEX_SUFFIX) and name[:-len(INDEX_SUFFIX)] + PACK_SUFFIX not in known:
+            os.remove(entry.path)
+
+
+def iter_archivable(cutoff, batch_size=DB_BATCH_SIZE):
+    """Yield pdf_filenames of contracts created before cutoff that are not archived yet, by id"""
+    last_id = 0
+    while True:
+        batch = (db.session.query(Contract.id, Contract.pdf_filename)
+                 .outerjoin(ArchivedPdf, ArchivedPdf.pdf_filename == Contract.pdf_filename)
+                 .filter(Contract.id > last_id, Contract.created_at < cutoff, ArchivedPdf.id.is_(None))
+                 .order_by(Contract.id).limit(batch_size).all())
+        if not batch:
+            return
+        last_id = batch[-1].id
+        for _, pdf_filename in batch:
+            yield pdf_filename
+
+
+def commit_pack(writer):
+    """Record a finished pack and its members, then remove the members' original files"""
+    members = writer.finish()
+    pack = PdfPack(filename=os.path.basename(writer.path), size=writer.size, live_count=0, live_bytes=0)
+    db.session.add(pack)
+    db.session.flush()
+    for name, offset, length in members:
+        # Inserted only if the contract still exists, checked by the INSERT itself (and the row share-locked
+        # on Postgres), so a contract deleted while the pack was written is dead on arrival, never a stray row
+        still_there = (select(Contract.pdf_filename, literal(pack.id), literal(offset), literal(length))
+                       .where(Contract.pdf_filename == name).limit(1).with_for_update(read=True))
+        result = db.session.execute(insert(ArchivedPdf).from_select(['pdf_filename', 'pack_id', 'offset', 'length'],
+                                                                     still_there))
+        if result.rowcount:
+            pack.live_count += 1
+            pack.live_bytes += length
+    archived = pack.live_count
+    open(pending_marker(writer.path), 'w').close()
+    db.session.commit()
+    remove_originals(writer.path)
+    return archived
+
+
+def archive(min_age_days=DEFAULT_MIN_AGE_DAYS, pack_size=DEFAULT_PACK_SIZE_MB * 1048576, log=print):
+    """Move PDFs older than min_age_days into packs of about pack_size bytes; returns PDFs archived"""
+    cutoff = datetime.utcnow() - timedelta(days=min_age_days)
+    archived = 0
+    writer = None
+    try:
+        for pdf_filename in iter_archivable(cutoff):
+            path = os.path.join(CONTRACTS_DIR, pdf_filename)
+            if not os.path.exists(path):
+                # Missing (sweeper.py's business) or still being rendered
+                continue
+            if writer is None:
+                writer = PackWriter(os.path.join(PACKS_DIR, new_pack_name()))
+            writer.add_file(pdf_filename, path)
+            if writer.size >= pack_size:
+                archived += commit_pack(writer)
+                log(f'... {archived} PDFs archived')
+                writer = None
+        if writer is not None:
+            archived += commit_pack(writer)
+            writer = None
+    finally:
+        if writer is not None:
+            writer.abort()
+    return archived
+
+
+def compact_pack(pack, log=print):
+    """Copy a pack's live members into a new pack and drop the old one"""
+    old_path = os.path.join(PACKS_DIR, pack.filename)
+    members = ArchivedPdf.query.filter_by(pack_id=pack.id).order_by(ArchivedPdf.offset).all()
+    new_pack = None
+    if members:
+        writer = PackWriter(os.path.join(PACKS_DIR, new_pack_name()))
+        try:
+            new_offsets = {}
+            for member in members:
+                with PackSlice(old_path, member.offset, member.length) as source:
+                    new_offsets[member.id] = writer.add(member.pdf_filename, source, member.length)
+            writer.finish()
+        except BaseException:
+            writer.abort()
+            raise
+        new_pack = PdfPack(filename=os.path.basename(writer.path), size=writer.size, live_count=0, live_bytes=0)
+        db.session.add(new_pack)
+        db.session.flush()
+        for member in members:
+            # Only rows that still exist: contracts may have been deleted while copying
+            moved = (ArchivedPdf.query.filter_by(id=member.id, pack_id=pack.id)
+                     .update({ArchivedPdf.pack_id: new_pack.id, ArchivedPdf.offset: new_offsets[member.id]},
+                             synchronize_session=False))
+            if moved:
+                new_pack.live_count += 1
+                new_pack.live_bytes += member.length
+    db.session.delete(pack)
+    db.session.commit()
+    # Downloads that already opened the old pack keep reading it until they close it
+    remove_pack(old_path)
+    if new_pack is not None:
+        log(f'compacted {os.path.basename(old_path)} ({pack.size} bytes) into {new_pack.filename} '
+            f'({new_pack.size} bytes)')
+    else:
+        log(f'removed empty {os.path.basename(old_path)}')
+
+
+def compact(compact_below=DEFAULT_COMPACT_BELOW, log=print):
+    """Compact every pack whose live bytes are below compact_below of its size; returns packs compacted"""
+    packs = (PdfPack.query.filter(PdfPack.live_bytes < PdfPack.size * compact_below)
+             .order_by(PdfPack.id).all())
+    for pack in packs:
+        compact_pack(pack, log)
+    return len(packs)
+
+
+def run(min_age_days=DEFAULT_MIN_AGE_DAYS, pack_size=DEFAULT_PACK_SIZE_MB * 1048576,
+        compact_below=DEFAULT_COMPACT_BELOW, log=print):
+    lock = acquire_archive_lock()
+    try:
+        recover(log)
+        return {'archived': archive(min_age_days, pack_size, log), 'compacted': compact(compact_below, log)}
+    finally:
+        lock.close()
+
+
+def report():
+    packs, size, live_count, live_bytes = db.session.query(
+        func.count(PdfPack.id), func.coalesce(func.sum(PdfPack.size), 0),
+        func.coalesce(func.sum(PdfPack.live_count), 0), func.coalesce(func.sum(PdfPack.live_bytes), 0)).one()
+    loose = sum(1 for entry in os.scandir(CONTRACTS_DIR) if entry.name.endswith('.pdf'))
+    print(f'{loose} PDFs stored as their own files')
+    print(f'{live_count} PDFs archived in {packs} packs: {size} bytes, {live_bytes} live '
+          f'({live_bytes / size * 100 if size else 100:.1f}%)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive old contract PDFs into pack files')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='archive old PDFs and compact packs')
+    run_parser.add_argument('--min-age-days', type=float, default=DEFAULT_MIN_AGE_DAYS,
+                            help='archive PDFs of contracts older than this')
+    run_parser.add_argument('--pack-size-mb', type=int, default=DEFAULT_PACK_SIZE_MB,
+                            help='start a new pack once the current one reaches this size')
+    run_parser.add_argument('--compact-below', type=float, default=DEFAULT_COMPACT_BELOW,
+                            help='compact packs whose live bytes fall below this fraction of their size')
+    run_parser.add_argument('--interval', type=int, default=0,
+                            help='repeat every N seconds instead of running once')
+    subparsers.add_parser('report', help='show loose and archived PDF counts')
+    args = parser.parse_args()
+
+    # Adds the pack tables
+    init_db()
+    with app.app_context():
+        if args.command == 'report':
+            report()
+            return
+        while True:
+            summary = run(args.min_age_days, args.pack_size_mb * 1048576, args.compact_below)
+            print(f'Archive run finished: {summary}')
+            db.session.remove()
+            if not args.interval:
+                break
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""PKCS#7 (CMS) digital signatures for generated contract PDFs.
+
+When PDF_SIGNING_P12 points at a PKCS#12 file, every rendered PDF is signed
+before it is written. The key, certificate chain, signature metadata and the
+size reserved for the signature are prepared once per process by
+PdfSigningService, so each document costs one digest and one private-key
+operation. Signatures carry no timestamp-authority token. pyHanko and
+cryptography are needed only when signing is enabled: they are the
+`signing` extra in pyproject.toml (uv sync --extra signing).
+
+Existing contracts are signed in batches with:
+
+    python pdf_signing.py sign-existing [--batch-size 100]
+
+and a self-signed test certificate can be created with:
+
+    python pdf_signing.py self-signed signing.p12 --passphrase secret
+"""
+import argparse
+import datetime
+import io
+import os
+import re
+import threading
+
+try:
+    from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+    from pyhanko.sign import signers
+except ImportError:  # the signing extra
+    signers = None
+
+SIGNATURE_FIELD = 'ContractSignature'
+CONTENTS_PATTERN = re.compile(rb'/Contents <([0-9a-fA-F]*)>')
+
+
+def blank_pdf():
+    """Smallest valid one-page PDF, used to size the signature container"""
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>',
+               b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+               b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>']
+    out = io.BytesIO()
+    out.write(b'%PDF-1.7\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b'%010d 00000 n \n' % offset)
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+class PdfSigningService:
+    """Signs PDFs with key material loaded once; safe to share between threads"""
+
+    def __init__(self, p12_path, passphrase=None, reason=None, location=None):
+        if signers is None:
+            raise RuntimeError('pyHanko is not installed; it is required for PDF_SIGNING_P12 '
+                               '(install the signing extra: uv sync --extra signing)')
+        self.signer = signers.SimpleSigner.load_pkcs12(
+            p12_path, passphrase=passphrase.encode('utf-8') if passphrase else None)
+        if self.signer is None:
+            raise ValueError(f'Could not load a signing key from {p12_path}')
+        self.metadata = signers.PdfSignatureMetadata(field_name=SIGNATURE_FIELD, md_algorithm='sha256',
+                                                     reason=reason, location=location)
+        self.pdf_signer = signers.PdfSigner(self.metadata, signer=self.signer)
+        # pyHanko sizes the signature with a dry-run signature unless told how much to reserve;
+        # the size only depends on the key and chain, so measure it once
+        self.bytes_reserved = None
+        self.bytes_reserved = self._measure_reserved_size()
+
+    def _measure_reserved_size(self):
+        signed = self.sign_bytes(blank_pdf())
+        # Reserved space is counted in hex digits of the /Contents string
+        return len(CONTENTS_PATTERN.search(signed).group(1))
+
+    def sign_bytes(self, pdf_bytes):
+        """Return pdf_bytes with an incremental-update signature appended"""
+        writer = IncrementalPdfFileWriter(io.BytesIO(pdf_bytes), strict=False)
+        output = self.pdf_signer.sign_pdf(writer, bytes_reserved=self.bytes_reserved)
+        return output.getvalue()
+
+    def sign_to_file(self, pdf_bytes, path):
+        """Sign and write to path through a temporary file, so path never holds an unsigned PDF"""
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(self.sign_bytes(pdf_bytes))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def sign_file(self, path):
+        with open(path, 'rb') as f:
+            pdf_bytes = f.read()
+        self.sign_to_file(pdf_bytes, path)
+
+    def sign_batch(self, paths):
+        """Sign files in place; returns {path: None or the exception that prevented signing}"""
+        results = {}
+        for path in paths:
+            try:
+                self.sign_file(path)
+                results[path] = None
+            except Exception as exc:
+                results[path] = exc
+        return results
+
+
+def create_self_signed_p12(path, passphrase=None, common_name='Contract Signing (test)', days=365):
+    """Write a PKCS#12 file with a new RSA key and self-signed certificate, for development"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+                   .public_key(key.public_key()).serial_number(x509.random_serial_number())
+                   .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=days))
+                   .add_extension(x509.KeyUsage(digital_signature=True, content_commitment=True,
+                                                key_encipherment=False, data_encipherment=False,
+                                                key_agreement=False, key_cert_sign=False, crl_sign=False,
+                                                encipher_only=False, decipher_only=False), critical=True)
+                   .sign(key, hashes.SHA256()))
+    encryption = (serialization.BestAvailableEncryption(passphrase.encode('utf-8')) if passphrase
+                  else serialization.NoEncryption())
+    with open(path, 'wb') as f:
+        f.write(pkcs12.serialize_key_and_certificates(common_name.encode('utf-8'), key, certificate, None,
+                                                      encryption))
+
+
+def sign_existing(batch_size=100, log=print):
+    """Sign the PDFs of contracts saved before signing was enabled, one id-ordered batch at a time"""
+    from app import db, Contract, CONTRACTS_DIR, pdf_signing_service, add_usage
+
+    service = pdf_signing_service()
+    if service is None:
+        raise RuntimeError('PDF_SIGNING_P12 is not set')
+    signed = 0
+    failed = 0
+    last_id = 0
+    while True:
+        batch = (Contract.query.filter(Contract.id > last_id, Contract.pdf_signed_at.is_(None))
+                 .order_by(Contract.id).limit(batch_size).all())
+        if not batch:
+            break
+        last_id = batch[-1].id
+        paths = {os.path.join(CONTRACTS_DIR, contract.pdf_filename): contract for contract in batch}
+        # Archived PDFs (pdf_archive.py) and queued renders have no file of their own
+        results = service.sign_batch([path for path in paths if os.path.exists(path)])
+        now = datetime.datetime.utcnow()
+        for path, error in results.items():
+            if error is None:
+                contract = paths[path]
+                size = os.path.getsize(path)
+                if contract.pdf_size is not None:
+                    add_usage(contract.created_at.date(), contract.template_id, None,
+                              {'pdf_bytes': size - contract.pdf_size})
+                contract.pdf_signed_at = now
+                contract.pdf_size = size
+                signed += 1
+            else:
+                failed += 1
+                log(f'could not sign {path}: {error}')
+        db.session.commit()
+        db.session.expunge_all()
+        log(f'... up to contract id {last_id}: {signed} signed, {failed} failed')
+    return signed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Digital signatures for contract PDFs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    existing_parser = subparsers.add_parser('sign-existing', help='sign PDFs saved before signing was enabled')
+    existing_parser.add_argument('--batch-size', type=int, default=100)
+    self_signed_parser = subparsers.add_parser('self-signed', help='create a self-signed PKCS#12 for testing')
+    self_signed_parser.add_argument('path')
+    self_signed_parser.add_argument('--passphrase')
+    self_signed_parser.add_argument('--common-name', default='Contract Signing (test)')
+    args = parser.parse_args()
+
+    if args.command == 'self-signed':
+        create_self_signed_p12(args.path, args.passphrase, args.common_name)
+        print(f'Wrote {args.path}')
+        return
+
+    from app import app, init_db
+    # Adds the pdf_signed_at column
+    init_db()
+    with app.app_context():
+        signed, failed = sign_existing(args.batch_size)
+    print(f'Signing finished: {signed} signed, {failed} failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,565 @@
+"""Direct PDF writer for plain-text contracts, without an HTML layout engine.
+
+Every contract PDF is the same layout: a bold title over a blue rule, the
+contract text as pre-wrapped lines, and an optional signature section. This
+module lays that out itself, with the DejaVu Sans fonts vendored in
+fonts/dejavu/ (the font the HTML version asks for), and writes the PDF
+directly: A4 pages, the CSS sizes and margins of generate_pdf_html converted
+at 96px per inch, text as subsetted TrueType (CIDFontType2) with a ToUnicode
+map so it stays searchable, and the vector signature drawn as a path.
+
+PlainTextPdfWriter.can_render() says whether a contract fits that model: every
+character has a glyph in the fonts and needs no shaping (no combining marks,
+no right-to-left scripts, no format controls), and the signature is absent or
+a vector one from signatures.py. Anything else goes to WeasyPrint. Kerning
+and ligatures are not applied, so lines can differ from WeasyPrint's by a
+fraction of a character width; line breaks fall after spaces and after
+hyphens inside words.
+"""
+import hashlib
+import os
+import re
+import struct
+import unicodedata
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from urllib.parse import unquote
+
+from signatures import SVG_DATA_URL_PREFIX, SVG_PATTERN, is_valid_signature
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts', 'dejavu')
+REGULAR_FONT = 'DejaVuSans.ttf'
+BOLD_FONT = 'DejaVuSans-Bold.ttf'
+SIGNED_ON_FORMAT = '%B %d, %Y at %I:%M %p'
+
+# Layout, in CSS px (1px = 0.75pt), mirroring generate_pdf_html and WeasyPrint's defaults
+PAGE_WIDTH = 210 / 25.4 * 96
+PAGE_HEIGHT = 297 / 25.4 * 96
+PAGE_MARGIN = 75
+BODY_MARGIN = 40
+LINE_HEIGHT = 1.6
+BODY_SIZE = 16
+TITLE_SIZE = 32
+SMALL_SIZE = BODY_SIZE / 1.2
+TITLE_MARGIN = 0.67 * TITLE_SIZE
+TITLE_PADDING = 10
+TITLE_RULE = 3
+CONTENT_MARGIN = 40
+SIGNATURE_MARGIN = 60
+SIGNATURE_RULE = 2
+SIGNATURE_PADDING = 20
+PARAGRAPH_MARGIN = BODY_SIZE
+SIGNATURE_MAX_WIDTH = 300
+IMAGE_BORDER = 1
+IMAGE_PADDING = 10
+IMAGE_MARGIN = 10
+SIGNED_ON_MARGIN = 20
+TAB_SIZE = 8
+
+TEXT_COLOR = (0x33 / 255,) * 3
+TITLE_COLOR = (0x2c / 255, 0x3e / 255, 0x50 / 255)
+TITLE_RULE_COLOR = (0x34 / 255, 0x98 / 255, 0xdb / 255)
+IMAGE_BORDER_COLOR = (0xcc / 255,) * 3
+
+# Words, with a break allowed after a hyphen between letters, and runs of blanks
+TOKEN_PATTERN = re.compile(r'[ \t]+|[^ \t]+?-(?=[^\W\d_])|[^ \t]+')
+SVG_ATTRIBUTES = re.compile(r'width="(\d+)" height="(\d+)".*?d="([^"]*)".*?stroke-width="([0-9.]+)"')
+SVG_SUBPATH = re.compile(r'M(-?\d+),(-?\d+)l([-\d,]*)')
+# Character classes that need shaping or bidi reordering, which this writer does not do
+UNSUPPORTED_CATEGORIES = {'Mn', 'Mc', 'Me', 'Cc', 'Cf', 'Cs', 'Co', 'Zl', 'Zp'}
+UNSUPPORTED_BIDI = {'R', 'AL', 'AN', 'RLE', 'RLO', 'RLI', 'LRE', 'LRO', 'LRI', 'PDF', 'PDI', 'FSI'}
+# Tables a CIDFontType2 font program needs; cmap, name, post and OpenType layout are dropped
+SUBSET_TABLES = ('cvt ', 'fpgm', 'glyf', 'head', 'hhea', 'hmtx', 'loca', 'maxp', 'prep')
+
+
+def _checksum(data):
+    data += b'\0' * (-len(data) % 4)
+    return sum(struct.unpack(f'>{len(data) // 4}I', data)) & 0xFFFFFFFF
+
+
+def _parse_cmap(cmap):
+    """{code point: glyph id} from the font's Unicode cmap (format 12 preferred, else format 4)"""
+    subtables = {}
+    for i in range(struct.unpack_from('>H', cmap, 2)[0]):
+        platform, encoding, offset = struct.unpack_from('>HHI', cmap, 4 + 8 * i)
+        subtables[(platform, encoding)] = offset
+    mapping = {}
+    for key in ((3, 10), (0, 4), (3, 1), (0, 3)):
+        if key not in subtables:
+            continue
+        offset = subtables[key]
+        subtable_format = struct.unpack_from('>H', cmap, offset)[0]
+        if subtable_format == 12:
+            for i in range(struct.unpack_from('>I', cmap, offset + 12)[0]):
+                start, end, glyph = struct.unpack_from('>III', cmap, offset + 16 + 12 * i)
+                for code in range(start, end + 1):
+                    mapping[code] = glyph + code - start
+            return mapping
+        if subtable_format == 4:
+            segments = struct.unpack_from('>H', cmap, offset + 6)[0] // 2
+            ends = struct.unpack_from(f'>{segments}H', cmap, offset + 14)
+            starts = struct.unpack_from(f'>{segments}H', cmap, offset + 16 + 2 * segments)
+            deltas = struct.unpack_from(f'>{segments}h', cmap, offset + 16 + 4 * segments)
+            range_offsets_at = offset + 16 + 6 * segments
+            range_offsets = struct.unpack_from(f'>{segments}H', cmap, range_offsets_at)
+            for i in range(segments):
+                for code in range(starts[i], min(ends[i], 0xFFFE) + 1):
+                    if range_offsets[i] == 0:
+                        glyph = (code + deltas[i]) & 0xFFFF
+                    else:
+                        glyph = struct.unpack_from('>H', cmap, range_offsets_at + 2 * i + range_offsets[i]
+                                                   + 2 * (code - starts[i]))[0]
+                        glyph = (glyph + deltas[i]) & 0xFFFF if glyph else 0
+                    if glyph:
+                        mapping[code] = glyph
+            return mapping
+    raise ValueError('font has no Unicode cmap')
+
+
+def _components(glyph):
+    """Glyph ids a composite glyph is built from"""
+    if len(glyph) < 10 or struct.unpack_from('>h', glyph, 0)[0] >= 0:
+        return []
+    components = []
+    position = 10
+    while True:
+        flags, component = struct.unpack_from('>HH', glyph, position)
+        components.append(component)
+        position += 4 + (4 if flags & 0x1 else 2)
+        if flags & 0x8:
+            position += 2
+        elif flags & 0x40:
+            position += 4
+        elif flags & 0x80:
+            position += 8
+        if not flags & 0x20:
+            return components
+
+
+class TrueTypeFont:
+    """Metrics and glyphs of one TrueType font, read once, and subsets of it per document"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.tables = {}
+        for i in range(struct.unpack_from('>H', data, 4)[0]):
+            tag, _, offset, length = struct.unpack_from('>4sIII', data, 12 + 16 * i)
+            self.tables[tag.decode('latin-1')] = data[offset:offset + length]
+
+        head, hhea = self.tables['head'], self.tables['hhea']
+        units_per_em = struct.unpack_from('>H', head, 18)[0]
+        scale = 1000 / units_per_em
+        self.bbox = [round(value * scale) for value in struct.unpack_from('>4h', head, 36)]
+        ascender, descender = struct.unpack_from('>hh', hhea, 4)
+        self.ascent, self.descent = ascender * scale, -descender * scale
+        os2 = self.tables.get('OS/2', b'')
+        self.cap_height = (struct.unpack_from('>h', os2, 88)[0] * scale
+                           if len(os2) >= 90 and struct.unpack_from('>H', os2, 0)[0] >= 2 else self.ascent)
+        self.num_glyphs = struct.unpack_from('>H', self.tables['maxp'], 4)[0]
+
+        metrics = struct.unpack_from('>H', hhea, 34)[0]
+        advances = struct.unpack_from(f'>{metrics * 2}H', self.tables['hmtx'])[0::2]
+        # Widths in thousandths of an em, as PDF wants them; layout uses the same numbers
+        self.widths = [round(advance * scale) for advance in advances]
+        self.widths += [self.widths[-1]] * (self.num_glyphs - metrics)
+
+        if struct.unpack_from('>h', head, 50)[0] == 0:
+            offsets = [offset * 2 for offset in struct.unpack_from(f'>{self.num_glyphs + 1}H', self.tables['loca'])]
+        else:
+            offsets = struct.unpack_from(f'>{self.num_glyphs + 1}I', self.tables['loca'])
+        glyf = self.tables['glyf']
+        self.glyphs = [glyf[offsets[i]:offsets[i + 1]] for i in range(self.num_glyphs)]
+
+        self.glyph_ids = {chr(code): glyph for code, glyph in _parse_cmap(self.tables['cmap']).items()
+                          if glyph < self.num_glyphs}
+        self.char_widths = {char: self.widths[glyph] for char, glyph in self.glyph_ids.items()}
+        self.char_codes = {char: '%04X' % glyph for char, glyph in self.glyph_ids.items()}
+        self.plain_chars = frozenset(
+            char for char in self.glyph_ids
+            if unicodedata.category(char) not in UNSUPPORTED_CATEGORIES
+            and unicodedata.bidirectional(char) not in UNSUPPORTED_BIDI)
+
+    def text_width(self, text, size):
+        widths = self.char_widths
+        return sum(widths[char] for char in text) * size / 1000
+
+    def encode(self, text):
+        codes = self.char_codes
+        return ''.join(codes[char] for char in text)
+
+    def subset(self, glyph_ids):
+        """Font program containing only glyph_ids (and what they are built from); ids are unchanged"""
+        keep = {0} | set(glyph_ids)
+        pending = list(keep)
+        while pending:
+            for component in _components(self.glyphs[pending.pop()]):
+                if component not in keep:
+                    keep.add(component)
+                    pending.append(component)
+
+        glyf = bytearray()
+        offsets = []
+        for glyph in range(self.num_glyphs):
+            offsets.append(len(glyf))
+            if glyph in keep:
+                glyf += self.glyphs[glyph]
+                glyf += b'\0' * (-len(glyf) % 4)
+        offsets.append(len(glyf))
+        head = bytearray(self.tables['head'])
+        head[8:12] = b'\0\0\0\0'
+        struct.pack_into('>h', head, 50, 1)
+        tables = dict(self.tables, glyf=bytes(glyf), head=bytes(head),
+                      loca=struct.pack(f'>{len(offsets)}I', *offsets))
+        tables = {tag: tables[tag] for tag in SUBSET_TABLES if tag in tables}
+
+        count = len(tables)
+        power = 1 << (count.bit_length() - 1)
+        header = struct.pack('>IHHHH', 0x00010000, count, power * 16, power.bit_length() - 1,
+                             count * 16 - power * 16)
+        directory = []
+        body = []
+        offset = 12 + 16 * count
+        for tag, data in tables.items():
+            if tag == 'head':
+                head_offset = offset
+            directory.append(struct.pack('>4sIII', tag.encode('latin-1'), _checksum(data), offset, len(data)))
+            padded = data + b'\0' * (-len(data) % 4)
+            body.append(padded)
+            offset += len(padded)
+        font = bytearray(header + b''.join(directory) + b''.join(body))
+        struct.pack_into('>I', font, head_offset + 8, (0xB1B0AFBA - _checksum(bytes(font))) & 0xFFFFFFFF)
+        return bytes(font)
+
+
+@lru_cache(maxsize=128)
+def _font_program(font, glyph_ids, compress):
+    """Subset font stream data; contracts from one template mostly share their glyph set"""
+    data = font.subset(glyph_ids)
+    return len(data), zlib.compress(data) if compress else data
+
+
+def _number(value):
+    text = f'{value:.3f}'.rstrip('0').rstrip('.')
+    return text if text != '-0' else '0'
+
+
+def _color(rgb):
+    return ' '.join(_number(component) for component in rgb)
+
+
+def _text_string(text):
+    """PDF text string (UTF-16BE with BOM) for outline titles and metadata"""
+    return '<FEFF' + text.encode('utf-16-be').hex().upper() + '>'
+
+
+def parse_signature(signature):
+    """(width, height, stroke width, [[(x, y), ...] per stroke]) of a vector signature data URL"""
+    svg = unquote(signature[len(SVG_DATA_URL_PREFIX):])
+    if SVG_PATTERN.fullmatch(svg) is None:
+        raise ValueError('not a signature produced by signatures.py')
+    width, height, path, stroke_width = SVG_ATTRIBUTES.search(svg).groups()
+    strokes = []
+    for x, y, moves in SVG_SUBPATH.findall(path):
+        x, y = int(x), int(y)
+        points = [(x, y)]
+        values = [int(value) for value in moves.split(',') if value]
+        for dx, dy in zip(values[0::2], values[1::2]):
+            x, y = x + dx, y + dy
+            points.append((x, y))
+        strokes.append(points)
+    return int(width), int(height), float(stroke_width), strokes
+
+
+class _Layout:
+    """Places line boxes down A4 pages; margins collapse and are dropped at page breaks, as in CSS"""
+
+    def __init__(self):
+        self.left = PAGE_MARGIN + BODY_MARGIN
+        self.width = PAGE_WIDTH - 2 * (PAGE_MARGIN + BODY_MARGIN)
+        self.bottom = PAGE_HEIGHT - PAGE_MARGIN
+        self.pages = []
+        self.margin = 0.0
+        self.y = None
+        self.new_page()
+        # The body margin collapses with the title's own top margin
+        self.margin = BODY_MARGIN
+
+    def new_page(self):
+        self.pages.append([])
+        self.y = PAGE_MARGIN
+        self.margin = 0.0
+
+    def add_margin(self, margin):
+        self.margin = max(self.margin, margin)
+
+    def place(self, height):
+        """Top of a new box of the given height, starting a page if it does not fit"""
+        if self.y + self.margin + height > self.bottom and self.pages[-1]:
+            self.new_page()
+        top = self.y + self.margin
+        self.y = top + height
+        self.margin = 0.0
+        return top
+
+    def text_line(self, font, size, color, runs):
+        line_height = size * LINE_HEIGHT
+        top = self.place(line_height)
+        baseline = top + (line_height - (font.ascent + font.descent) * size / 1000) / 2 + font.ascent * size / 1000
+        self.pages[-1].append(('text', font, size, color, baseline, runs))
+        return top
+
+    def rule(self, height, color, offset=0):
+        top = self.place(height)
+        self.pages[-1].append(('rect', color, self.left, top + offset, self.width, height - offset))
+
+
+def wrap(font, size, text, width):
+    """Break one line of pre-wrap text into lines of [(x, text)] runs that fit width.
+
+    Breaks fall after blanks and after hyphens inside words; blanks at the end
+    of a line hang past the edge as in CSS, and a word wider than a whole line
+    is split between characters rather than overflowing the page.
+    """
+    space = font.char_widths.get(' ', 0) * size / 1000
+    tab = space * TAB_SIZE
+    lines = []
+    runs = []
+    run, run_x, x = [], 0.0, 0.0
+
+    def finish_run():
+        if run:
+            runs.append((run_x, ''.join(run)))
+            run.clear()
+
+    for token in TOKEN_PATTERN.findall(text):
+        if token[0] in ' \t':
+            for char in token:
+                if char == '\t':
+                    finish_run()
+                    x = (x // tab + 1) * tab if tab else x
+                    run_x = x
+                else:
+                    run.append(char)
+                    x += space
+            continue
+        token_width = font.text_width(token, size)
+        if x > 0 and x + token_width > width:
+            finish_run()
+            lines.append(runs)
+            runs, run_x, x = [], 0.0, 0.0
+        if token_width > width:
+            for char in token:
+                char_width = font.text_width(char, size)
+                if x > 0 and x + char_width > width:
+                    finish_run()
+                    lines.append(runs)
+                    runs, run_x, x = [], 0.0, 0.0
+                run.append(char)
+                x += char_width
+            continue
+        run.append(token)
+        x += token_width
+    finish_run()
+    lines.append(runs)
+    return lines
+
+
+class PlainTextPdfWriter:
+    """Renders contracts straight to PDF bytes; fonts are loaded once, renders share nothing mutable"""
+
+    def __init__(self, font_dir=FONT_DIR):
+        self.regular = TrueTypeFont(os.path.join(font_dir, REGULAR_FONT))
+        self.bold = TrueTypeFont(os.path.join(font_dir, BOLD_FONT))
+
+    def can_render(self, title, content, signature):
+        """True when the contract needs nothing beyond plain text and a vector (or no) signature"""
+        if signature and not (signature.startswith(SVG_DATA_URL_PREFIX) and is_valid_signature(signature)):
+            return False
+        text_chars = set(content) - {'\n', '\r', '\t'}
+        return text_chars <= self.regular.plain_chars and set(' '.join(title.split())) <= self.bold.plain_chars
+
+    def layout(self, title, content, signature='', signed_on=None):
+        layout = _Layout()
+
+        # Title: white-space is collapsed, wrapped at spaces
+        title_text = ' '.join(title.split())
+        title_top = layout.y + layout.margin
+        if title_text:
+            for runs in wrap(self.bold, TITLE_SIZE, title_text, layout.width):
+                layout.text_line(self.bold, TITLE_SIZE, TITLE_COLOR, runs)
+        layout.rule(TITLE_PADDING + TITLE_RULE, TITLE_RULE_COLOR, offset=TITLE_PADDING)
+        layout.add_margin(TITLE_MARGIN)
+
+        # Contract text: pre-wrap; a final line break does not start another line
+        paragraphs = content.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        if len(paragraphs) > 1 and paragraphs[-1] == '':
+            paragraphs.pop()
+        for paragraph in paragraphs:
+            for runs in wrap(self.regular, BODY_SIZE, paragraph, layout.width):
+                layout.text_line(self.regular, BODY_SIZE, TEXT_COLOR, runs)
+        layout.add_margin(CONTENT_MARGIN)
+
+        if signature:
+            self._layout_signature(layout, signature, signed_on)
+        return layout.pages, title_text, title_top
+
+    def _layout_signature(self, layout, signature, signed_on):
+        width, height, stroke_width, strokes = parse_signature(signature)
+        scale = min(1.0, SIGNATURE_MAX_WIDTH / width) if width else 1.0
+
+        layout.add_margin(SIGNATURE_MARGIN)
+        top = layout.place(SIGNATURE_RULE + SIGNATURE_PADDING)
+        layout.pages[-1].append(('rect', TEXT_COLOR, layout.left, top, layout.width, SIGNATURE_RULE))
+        layout.add_margin(PARAGRAPH_MARGIN)
+        layout.text_line(self.bold, BODY_SIZE, TEXT_COLOR, [(0.0, 'Electronic Signature:')])
+        layout.add_margin(PARAGRAPH_MARGIN)
+
+        # The image sits on the baseline of an anonymous line box, below its own top margin
+        font = self.regular
+        half_leading = (BODY_SIZE * LINE_HEIGHT - (font.ascent + font.descent) * BODY_SIZE / 1000) / 2
+        strut_above = font.ascent * BODY_SIZE / 1000 + half_leading
+        strut_below = font.descent * BODY_SIZE / 1000 + half_leading
+        box = 2 * (IMAGE_BORDER + IMAGE_PADDING)
+        image_height = height * scale + box + IMAGE_MARGIN
+        above = max(image_height, strut_above)
+        top = layout.place(above + strut_below) + above - image_height + IMAGE_MARGIN
+        layout.pages[-1].append(('image-box', layout.left, top, width * scale + box, height * scale + box))
+        layout.pages[-1].append(('signature', layout.left + IMAGE_BORDER + IMAGE_PADDING,
+                                 top + IMAGE_BORDER + IMAGE_PADDING, scale, stroke_width, strokes))
+
+        layout.add_margin(SIGNED_ON_MARGIN)
+        signed_on = signed_on or datetime.now().strftime(SIGNED_ON_FORMAT)
+        layout.text_line(self.regular, SMALL_SIZE, TEXT_COLOR, [(0.0, f'Signed on: {signed_on}')])
+
+    def render(self, title, content, signature='', signed_on=None, compress=True):
+        """PDF bytes for the contract; call can_render() first"""
+        pages, title_text, title_top = self.layout(title, content, signature, signed_on)
+        fonts = {self.regular: 'F1', self.bold: 'F2'}
+        used = {font: set() for font in fonts}
+        left = PAGE_MARGIN + BODY_MARGIN
+
+        streams = []
+        for operations in pages:
+            out = [f'0.75 0 0 -0.75 0 {_number(PAGE_HEIGHT * 0.75)} cm']
+            for operation in operations:
+                kind = operation[0]
+                if kind == 'text':
+                    _, font, size, color, baseline, runs = operation
+                    out.append(f'BT /{fonts[font]} {_number(size)} Tf {_color(color)} rg')
+                    for x, text in runs:
+                        used[font].update(text)
+                        out.append(f'1 0 0 -1 {_number(left + x)} {_number(baseline)} Tm <{font.encode(text)}> Tj')
+                    out.append('ET')
+                elif kind == 'rect':
+                    _, color, x, y, width, height = operation
+                    out.append(f'{_color(color)} rg {_number(x)} {_number(y)} {_number(width)} '
+                               f'{_number(height)} re f')
+                elif kind == 'image-box':
+                    _, x, y, width, height = operation
+                    inset = IMAGE_BORDER / 2
+                    out.append(f'{_color(IMAGE_BORDER_COLOR)} RG {_number(IMAGE_BORDER)} w {_number(x + inset)} '
+                               f'{_number(y + inset)} {_number(width - IMAGE_BORDER)} '
+                               f'{_number(height - IMAGE_BORDER)} re S')
+                elif kind == 'signature':
+                    _, x, y, scale, stroke_width, strokes = operation
+                    out.append(f'q {_number(scale)} 0 0 {_number(scale)} {_number(x)} {_number(y)} cm '
+                               f'0 0 0 RG {_number(stroke_width)} w 1 J 1 j')
+                    for points in strokes:
+                        out.append(f'{points[0][0]} {points[0][1]} m '
+                                   + ' '.join(f'{px} {py} l' for px, py in points[1:] or points))
+                    out.append('S Q')
+            streams.append('\n'.join(out).encode('latin-1'))
+
+        return self._write(streams, {font: name for font, name in fonts.items() if used[font]}, used,
+                           title_text, title_top, compress)
+
+    def _write(self, streams, fonts, used, title_text, title_top, compress):
+        objects = []
+
+        def add(body):
+            objects.append(body)
+            return len(objects)
+
+        def stream(dictionary, data, raw_length=None):
+            if compress and raw_length is None:
+                data = zlib.compress(data)
+            filter_entry = ' /Filter /FlateDecode' if compress else ''
+            extra = f' /Length1 {raw_length}' if raw_length is not None else ''
+            return (f'<< {dictionary} /Length {len(data)}{extra}{filter_entry} >>\nstream\n'.encode('latin-1')
+                    + data + b'\nendstream')
+
+        catalog = add(None)
+        pages_id = add(None)
+
+        font_refs = []
+        for font, name in fonts.items():
+            chars = sorted(used[font])
+            glyphs = {}
+            for char in chars:
+                glyphs.setdefault(font.glyph_ids[char], char)
+            glyph_ids = frozenset(glyphs)
+            raw_length, program = _font_program(font, glyph_ids, compress)
+            tag = ''.join(chr(65 + byte % 26) for byte in hashlib.md5(repr(sorted(glyph_ids)).encode()).digest()[:6])
+            base_font = f'{tag}+{font.name}'
+            font_file = add(stream('', program, raw_length))
+            descriptor = add(
+                f'<< /Type /FontDescriptor /FontName /{base_font} /Flags 32 /FontBBox [{" ".join(map(str, font.bbox))}] '
+                f'/ItalicAngle 0 /Ascent {_number(font.ascent)} /Descent {_number(-font.descent)} '
+                f'/CapHeight {_number(font.cap_height)} /StemV {140 if font is self.bold else 80} '
+                f'/FontFile2 {font_file} 0 R >>'.encode('latin-1'))
+            widths = ' '.join(f'{glyph} [{font.widths[glyph]}]' for glyph in sorted(glyphs))
+            cid_font = add(
+                f'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{base_font} '
+                f'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> '
+                f'/FontDescriptor {descriptor} 0 R /W [{widths}] /CIDToGIDMap /Identity >>'.encode('latin-1'))
+            mappings = [f'<{glyph:04X}> <{glyphs[glyph].encode("utf-16-be").hex().upper()}>' for glyph in sorted(glyphs)]
+            blocks = ''.join(f'{len(mappings[i:i + 100])} beginbfchar\n' + '\n'.join(mappings[i:i + 100])
+                             + '\nendbfchar\n' for i in range(0, len(mappings), 100))
+            to_unicode = add(stream('', (
+                '/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n'
+                '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n'
+                '/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n'
+                '1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n' + blocks +
+                'endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend\n').encode('latin-1')))
+            type0 = add(f'<< /Type /Font /Subtype /Type0 /BaseFont /{base_font} /Encoding /Identity-H '
+                        f'/DescendantFonts [{cid_font} 0 R] /ToUnicode {to_unicode} 0 R >>'.encode('latin-1'))
+            font_refs.append(f'/{name} {type0} 0 R')
+        resources = add(f'<< /Font << {" ".join(font_refs)} >> >>'.encode('latin-1'))
+
+        media_box = f'[0 0 {_number(PAGE_WIDTH * 0.75)} {_number(PAGE_HEIGHT * 0.75)}]'
+        page_ids = []
+        for data in streams:
+            contents = add(stream('', data))
+            page_ids.append(add(f'<< /Type /Page /Parent {pages_id} 0 R /MediaBox {media_box} '
+                                f'/Resources {resources} 0 R /Contents {contents} 0 R >>'.encode('latin-1')))
+        objects[pages_id - 1] = (f'<< /Type /Pages /Kids [{" ".join(f"{i} 0 R" for i in page_ids)}] '
+                                 f'/Count {len(page_ids)} >>').encode('latin-1')
+
+        # One bookmark for the title, like WeasyPrint makes for the h1
+        outlines = ''
+        if title_text:
+            outlines_id = add(None)
+            item = add(f'<< /Title {_text_string(title_text)} /Parent {outlines_id} 0 R '
+                       f'/Dest [{page_ids[0]} 0 R /XYZ 0 {_number((PAGE_HEIGHT - title_top) * 0.75)} 0] >>'
+                       .encode('latin-1'))
+            objects[outlines_id - 1] = f'<< /Type /Outlines /First {item} 0 R /Last {item} 0 R /Count 1 >>'.encode()
+            outlines = f' /Outlines {outlines_id} 0 R'
+        objects[catalog - 1] = f'<< /Type /Catalog /Pages {pages_id} 0 R{outlines} >>'.encode('latin-1')
+        info = add(f'<< /Producer (pdf_writer.py) /Title {_text_string(title_text)} '
+                   f'/CreationDate (D:{datetime.utcnow().strftime("%Y%m%d%H%M%S")}Z) >>'.encode('latin-1'))
+
+        out = bytearray(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(len(out))
+            out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        xref = len(out)
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+        document_id = hashlib.md5(bytes(out)).hexdigest()
+        out += (f'trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R /Info {info} 0 R '
+                f'/ID [<{document_id}> <{document_id}>] >>\nstartxref\n{xref}\n%%EOF\n').encode('latin-1')
+        return bytes(out)
@@ -0,0 +1,181 @@
+"""Request profiling that writes folded stacks for flame graphs.
+
+Both profilers record "frame;frame;...;frame weight" lines, the folded format
+that flamegraph.pl, inferno and speedscope read:
+
+- StackSampler takes a snapshot of the profiled thread's stack every few
+  milliseconds from one daemon thread per process, which sleeps while
+  nothing is being profiled. Weights are sample counts. It costs the
+  profiled request very little, so it is also used for the continuous
+  1-in-N sampling of ordinary requests.
+- Tracer hooks every Python and C call of the request thread with
+  sys.setprofile. Weights are microseconds of self time. It is exact, but the
+  request runs several times slower, so it is only used on demand.
+
+Frames are labelled "function (file:line)". Files are given relative to the
+project or to site-packages, so time spent in save_contract_pdf, Jinja
+templates (templates/*.html) and SQLAlchemy (sqlalchemy/...) can be told
+apart. Each profile is a .folded file with a .json file next to it
+describing the request.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+PROFILE_NAME_PATTERN = re.compile(r'\d{8}T\d{6}-[0-9a-f]{8}')
+
+_labels = {}
+
+
+def code_label(code):
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        marker = max(filename.rfind('site-packages' + os.sep), filename.rfind('dist-packages' + os.sep))
+        if marker >= 0:
+            filename = filename[marker + len('site-packages' + os.sep):]
+        elif filename.startswith(PROJECT_DIR):
+            filename = filename[len(PROJECT_DIR):]
+        label = f'{code.co_qualname} ({filename}:{code.co_firstlineno})'.replace(';', ',')
+        _labels[code] = label
+    return label
+
+
+def fold(frame):
+    """Folded stack of frame, outermost first"""
+    labels = []
+    while frame is not None:
+        labels.append(code_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """Samples the stacks of registered threads from a single background thread"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = {}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id=None):
+        with self._lock:
+            self._active[thread_id or threading.get_ident()] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, thread_id=None):
+        """Counter of folded stack -> samples for the thread"""
+        with self._lock:
+            return self._active.pop(thread_id or threading.get_ident(), Counter())
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            with self._lock:
+                idle = not self._active
+                if not idle:
+                    frames = sys._current_frames()
+                    for thread_id, counts in self._active.items():
+                        frame = frames.get(thread_id)
+                        if frame is not None:
+                            counts[fold(frame)] += 1
+                    # Do not keep the threads' frames alive until the next sample
+                    del frames, frame
+            if idle:
+                self._wake.wait()
+            else:
+                time.sleep(self.interval)
+
+
+class Tracer:
+    """Deterministic profile of the current thread from start() to stop()"""
+
+    def __init__(self):
+        self.stack = []
+        self.seconds = Counter()
+
+    def start(self):
+        sys.setprofile(self._event)
+
+    def stop(self):
+        """Counter of folded stack -> microseconds of self time"""
+        sys.setprofile(None)
+        now = time.perf_counter()
+        while self.stack:
+            self._pop(now)
+        return Counter({stack: round(seconds * 1e6) for stack, seconds in self.seconds.items()
+                        if seconds >= 5e-7})
+
+    def _event(self, frame, event, arg):
+        now = time.perf_counter()
+        if event == 'call' or event == 'c_call':
+            label = (code_label(frame.f_code) if event == 'call'
+                     else f'{getattr(arg, "__qualname__", arg)} (builtin)'.replace(';', ','))
+            stack = f'{self.stack[-1][0]};{label}' if self.stack else label
+            self.stack.append([stack, now, 0.0])
+        elif self.stack:
+            # Returns of frames that were already running at start() find the stack empty
+            self._pop(now)
+
+    def _pop(self, now):
+        stack, started, children = self.stack.pop()
+        elapsed = now - started
+        self.seconds[stack] += elapsed - children
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+
+def write_profile(directory, counts, details):
+    """Store a profile as <name>.folded plus <name>.json; returns the name"""
+    os.makedirs(directory, exist_ok=True)
+    name = f'{time.strftime("%Y%m%dT%H%M%S", time.gmtime())}-{uuid.uuid4().hex[:8]}'
+    with open(os.path.join(directory, name + '.folded'), 'w', encoding='utf-8') as f:
+        for stack, weight in counts.most_common():
+            f.write(f'{stack} {weight}\n')
+    details = dict(details, name=name, stacks=len(counts), total_weight=sum(counts.values()))
+    # The .json appears last, so listings never show a profile whose stacks are still being written
+    tmp_path = os.path.join(directory, name + '.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(details, f)
+    os.replace(tmp_path, os.path.join(directory, name + '.json'))
+    return name
+
+
+def list_profiles(directory, limit=200):
+    """Details of the newest profiles, newest first"""
+    try:
+        names = sorted((entry.name[:-len('.json')] for entry in os.scandir(directory)
+                        if entry.name.endswith('.json')), reverse=True)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(directory, name + '.json'), encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (FileNotFoundError, ValueError):
+            continue
+    return profiles
+
+
+def prune_profiles(directory, keep):
+    """Delete all but the newest keep profiles"""
+    names = sorted((entry.name[:-len('.json')] for entry in os.scandir(directory) if entry.name.endswith('.json')),
+                   reverse=True)
+    for name in names[keep:]:
+        for suffix in ('.json', '.folded'):
+            try:
+                os.remove(os.path.join(directory, name + suffix))
+            except FileNotFoundError:
+                pass
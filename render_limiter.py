@@ -0,0 +1,139 @@
+"""Admission control for PDF rendering, shared by every worker process on a host.
+
+Render slots and wait-queue slots are lock files held with flock(), so the
+limit applies across gunicorn workers and a slot is released by the kernel
+if its worker dies mid-render. A request that finds every render slot busy
+takes a queue slot and polls until its deadline; when the queue is full, or
+the deadline passes, RenderBusy is raised so the caller can answer 503.
+"""
+import fcntl
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class RenderBusy(Exception):
+    """Rendering is saturated; retry after retry_after seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RenderLimiter:
+    def __init__(self, lock_dir, concurrency, queue_size, timeout, poll_interval=0.02):
+        self.lock_dir = lock_dir
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        os.makedirs(lock_dir, exist_ok=True)
+
+        # Per-process statistics; gauges in snapshot() are read from the shared lock files
+        self.stats_lock = threading.Lock()
+        self.counters = {'admitted': 0, 'queued': 0, 'rejected_queue_full': 0, 'rejected_timeout': 0}
+        self.recent_waits = deque(maxlen=1000)
+        self.recent_renders = deque(maxlen=1000)
+
+    def _path(self, kind, index):
+        return os.path.join(self.lock_dir, f'{kind}-{index}.lock')
+
+    def _try_acquire(self, kind, count):
+        """Lock any free slot of the given kind without blocking; return its fd or None"""
+        offset = random.randrange(count) if count else 0
+        for i in range(count):
+            fd = os.open(self._path(kind, (offset + i) % count), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    @staticmethod
+    def _release(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _held(self, kind, count):
+        """Number of slots of a kind currently held by any process"""
+        held = 0
+        for i in range(count):
+            fd = os.open(self._path(kind, i), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            except BlockingIOError:
+                held += 1
+            finally:
+                os.close(fd)
+        return held
+
+    def _retry_after(self):
+        with self.stats_lock:
+            renders = list(self.recent_renders)
+        average = sum(renders) / len(renders) if renders else self.timeout
+        # Time for the current queue to drain through the available slots
+        return max(1, math.ceil(average * (self.queue_size + self.concurrency) / self.concurrency))
+
+    def _count(self, name):
+        with self.stats_lock:
+            self.counters[name] += 1
+
+    @contextmanager
+    def slot(self):
+        """Hold a render slot for the duration of the block, waiting in the queue if needed"""
+        start = time.monotonic()
+        render_fd = self._try_acquire('render', self.concurrency)
+        if render_fd is None:
+            queue_fd = self._try_acquire('queue', self.queue_size)
+            if queue_fd is None:
+                self._count('rejected_queue_full')
+                raise RenderBusy('render queue is full', self._retry_after())
+            self._count('queued')
+            try:
+                deadline = start + self.timeout
+                while render_fd is None:
+                    if time.monotonic() >= deadline:
+                        self._count('rejected_timeout')
+                        raise RenderBusy('timed out waiting for a render slot', self._retry_after())
+                    time.sleep(self.poll_interval)
+                    render_fd = self._try_acquire('render', self.concurrency)
+            finally:
+                self._release(queue_fd)
+
+        admitted = time.monotonic()
+        with self.stats_lock:
+            self.counters['admitted'] += 1
+            self.recent_waits.append(admitted - start)
+        try:
+            yield admitted - start
+        finally:
+            self._release(render_fd)
+            with self.stats_lock:
+                self.recent_renders.append(time.monotonic() - admitted)
+
+    def snapshot(self):
+        """Current limiter state for monitoring"""
+        with self.stats_lock:
+            counters = dict(self.counters)
+            waits = sorted(self.recent_waits)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 1) if waits else 0.0
+
+        return {
+            'concurrency': self.concurrency,
+            'queue_size': self.queue_size,
+            'timeout_seconds': self.timeout,
+            'renders_in_progress': self._held('render', self.concurrency),
+            'queue_depth': self._held('queue', self.queue_size),
+            'worker_pid': os.getpid(),
+            'worker_counters': counters,
+            'worker_wait_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'max': percentile(1.0)},
+        }
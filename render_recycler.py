@@ -0,0 +1,74 @@
+"""Recycling of rendering processes before they bloat.
+
+WeasyPrint, pango and fontconfig keep caches and leak a little per render, so
+a process that renders for days grows until the OOM killer takes it, with
+whatever requests it was serving. RenderRecycler counts renders and compares
+resident memory with what it was after the first render (once fonts and
+caches are warm). Once a process has done max_renders renders, or grown by
+max_growth_mb since then, it is due. The process then retires on its own
+terms: a gunicorn worker stops taking requests, finishes the ones in flight
+and is replaced by the arbiter; render_worker.py finishes its job and
+re-executes itself.
+"""
+import os
+import resource
+import sys
+import threading
+
+
+def rss_bytes():
+    """Current resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Peak rather than current RSS; KiB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def open_fd_count():
+    """Number of open file descriptors, or None where it cannot be listed"""
+    for directory in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(directory)) - 1  # the descriptor listdir itself opened
+        except OSError:
+            continue
+    return None
+
+
+class RenderRecycler:
+    def __init__(self, max_renders=0, max_growth_mb=0):
+        self.max_renders = max_renders
+        self.max_growth = max_growth_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.renders = 0
+        self.baseline_rss = None
+        self.reason = None
+        # Set once the process has started retiring, so it is only asked to once
+        self.retiring = False
+
+    @property
+    def due(self):
+        return self.reason is not None
+
+    def record(self):
+        """Count a finished render; returns why the process should be recycled, or None"""
+        rss = rss_bytes()
+        with self.lock:
+            self.renders += 1
+            if self.baseline_rss is None:
+                self.baseline_rss = rss
+            if self.reason is None:
+                if self.max_renders and self.renders >= self.max_renders:
+                    self.reason = f'{self.renders} renders'
+                elif self.max_growth and rss - self.baseline_rss >= self.max_growth:
+                    self.reason = f'RSS grew {(rss - self.baseline_rss) / 1048576:.0f} MB over {self.renders} renders'
+            return self.reason
+
+    def snapshot(self):
+        with self.lock:
+            return {'renders': self.renders, 'max_renders': self.max_renders,
+                    'rss_mb': round(rss_bytes() / 1048576, 1),
+                    'baseline_rss_mb': round(self.baseline_rss / 1048576, 1) if self.baseline_rss else None,
+                    'max_growth_mb': self.max_growth // 1048576, 'due': self.reason}
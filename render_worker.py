@@ -0,0 +1,262 @@
+"""Render worker: claims queued RenderJobs and writes their PDFs.
+
+With RENDER_MODE=queue the web app stores a contract and a RenderJob in one
+transaction and leaves rendering to any number of these workers, on any node
+that shares generated_contracts/ and the database. Each worker renders one
+job at a time; run more processes to render more in parallel.
+
+A job is claimed under a lease that a heartbeat thread keeps extending while
+the render runs. If a worker dies its lease expires and the job is queued
+again. Failed renders are retried with exponential backoff; a job that fails
+max_attempts times is marked dead. Claims use SELECT ... FOR UPDATE SKIP
+LOCKED on Postgres, and a compare-and-set UPDATE elsewhere (SQLite).
+
+After RENDER_RECYCLE_RENDERS renders or RENDER_RECYCLE_GROWTH_MB of memory
+growth the worker finishes its current job and re-executes itself, so
+renderer leaks never accumulate past that.
+
+    python render_worker.py [--lease 60] [--poll 1.0] [--once]
+"""
+import argparse
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app import (app, db, init_db, Contract, RenderJob, CONTRACTS_DIR, render_contract_pdf, add_usage,
+                 render_recycler)
+from thumbnails import schedule_thumbnail, wait_for_thumbnails
+
+DEFAULT_LEASE_SECONDS = 60
+DEFAULT_POLL_SECONDS = 1.0
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 600
+CLAIM_CANDIDATES = 10
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def backoff_seconds(attempts):
+    """Exponential backoff with jitter so failing jobs do not retry in lockstep"""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def requeue_expired_leases():
+    """Queue again (or dead-letter) running jobs whose worker stopped heartbeating"""
+    now = datetime.utcnow()
+    expired = (db.session.query(RenderJob.id, RenderJob.lease_owner, RenderJob.attempts, RenderJob.max_attempts)
+               .filter(RenderJob.status == 'running', RenderJob.lease_expires_at < now)
+               .with_for_update(skip_locked=True).all())
+    requeued = 0
+    for job_id, lease_owner, attempts, max_attempts in expired:
+        # Only while the lease is still the expired one: its worker may have renewed or finished it since
+        result = db.session.execute(update(RenderJob)
+                                    .where(RenderJob.id == job_id, RenderJob.status == 'running',
+                                           RenderJob.lease_owner == lease_owner, RenderJob.lease_expires_at < now)
+                                    .values(last_error=f'lease held by {lease_owner} expired',
+                                            **release_values(attempts, max_attempts, now)))
+        requeued += result.rowcount
+    db.session.commit()
+    return requeued
+
+
+def release_values(attempts, max_attempts, now):
+    """Columns that give up a claimed job: retry after a backoff, or dead-letter it after its last attempt"""
+    if attempts >= max_attempts:
+        return dict(status='dead', finished_at=now, lease_owner=None, lease_expires_at=None)
+    return dict(status='queued', run_after=now + timedelta(seconds=backoff_seconds(attempts)), lease_owner=None,
+                lease_expires_at=None)
+
+
+def release(job, now):
+    """Give up a claimed job: retry after a backoff, or dead-letter it after its last attempt"""
+    for column, value in release_values(job.attempts, job.max_attempts, now).items():
+        setattr(job, column, value)
+
+
+def claim_job(owner, lease_seconds):
+    """Claim the oldest runnable job and return its id, or None if there is nothing to do"""
+    now = datetime.utcnow()
+    claim = dict(status='running', lease_owner=owner, heartbeat_at=now,
+                 lease_expires_at=now + timedelta(seconds=lease_seconds), attempts=RenderJob.attempts + 1)
+    runnable = (RenderJob.query.filter(RenderJob.status == 'queued', RenderJob.run_after <= now)
+                .order_by(RenderJob.run_after, RenderJob.id))
+
+    if db.engine.dialect.name == 'postgresql':
+        # Rows locked by other workers are skipped rather than waited for
+        job = runnable.with_for_update(skip_locked=True).first()
+        if job is None:
+            db.session.rollback()
+            return None
+        db.session.execute(update(RenderJob).where(RenderJob.id == job.id).values(**claim))
+        db.session.commit()
+        return job.id
+
+    # No row locks: take a candidate only if it is still queued when the UPDATE runs
+    candidates = [job_id for (job_id,) in runnable.with_entities(RenderJob.id).limit(CLAIM_CANDIDATES)]
+    for job_id in candidates:
+        result = db.session.execute(update(RenderJob)
+                                    .where(RenderJob.id == job_id, RenderJob.status == 'queued')
+                                    .values(**claim))
+        db.session.commit()
+        if result.rowcount == 1:
+            return job_id
+    db.session.rollback()
+    return None
+
+
+class Heartbeat(threading.Thread):
+    """Extends a job's lease until stopped; lost is set if another worker took the job over"""
+
+    def __init__(self, job_id, owner, lease_seconds):
+        super().__init__(daemon=True, name=f'heartbeat-{job_id}')
+        self.job_id = job_id
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.engine = db.engine
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            now = datetime.utcnow()
+            # A connection of its own, independent of the rendering thread's session
+            with self.engine.begin() as connection:
+                result = connection.execute(
+                    update(RenderJob)
+                    .where(RenderJob.id == self.job_id, RenderJob.lease_owner == self.owner,
+                           RenderJob.status == 'running')
+                    .values(heartbeat_at=now, lease_expires_at=now + timedelta(seconds=self.lease_seconds)))
+            if result.rowcount != 1:
+                self.lost.set()
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def render_job(job_id, owner, lease_seconds, log=print):
+    """Render one claimed job; returns 'done', 'retry', 'dead' or 'lost'"""
+    job = db.session.get(RenderJob, job_id)
+    contract = db.session.get(Contract, job.contract_id) if job is not None else None
+    if contract is None:
+        # The contract was deleted (its job with it) after the claim
+        db.session.rollback()
+        return 'lost'
+    pdf_path = os.path.join(CONTRACTS_DIR, contract.pdf_filename)
+
+    heartbeat = Heartbeat(job_id, owner, lease_seconds)
+    heartbeat.start()
+    # Render next to the target and rename, so a retried or duplicated job never exposes a partial file
+    fd, tmp_path = tempfile.mkstemp(suffix='.pdf.tmp', dir=CONTRACTS_DIR)
+    os.close(fd)
+    try:
+        start = time.perf_counter()
+        signed = render_contract_pdf(tmp_path, contract.title, contract.filled_content, contract.signature_data,
+                                     contract.render_profile)
+        render_seconds = time.perf_counter() - start
+    except Exception as exc:
+        heartbeat.stop()
+        os.remove(tmp_path)
+        db.session.rollback()
+        job = db.session.get(RenderJob, job_id)
+        if job is None or job.lease_owner != owner:
+            return 'lost'
+        job.last_error = f'{type(exc).__name__}: {exc}'
+        release(job, datetime.utcnow())
+        db.session.commit()
+        log(f'job {job_id} (contract {contract.uuid}) failed on attempt {job.attempts}: {exc}')
+        return 'dead' if job.status == 'dead' else 'retry'
+    heartbeat.stop()
+
+    # Finish only if this worker still holds the lease (fencing against a takeover)
+    now = datetime.utcnow()
+    result = db.session.execute(update(RenderJob)
+                                .where(RenderJob.id == job_id, RenderJob.lease_owner == owner,
+                                       RenderJob.status == 'running')
+                                .values(status='done', finished_at=now, lease_owner=None, lease_expires_at=None))
+    if result.rowcount != 1 or heartbeat.lost.is_set():
+        db.session.rollback()
+        os.remove(tmp_path)
+        return 'lost'
+    pdf_size = os.path.getsize(tmp_path)
+    contract.pdf_size = pdf_size
+    contract.render_seconds = render_seconds
+    contract.pdf_signed_at = now if signed else None
+    # The save already counted the contract; add what only the render knows
+    add_usage(contract.created_at.date(), contract.template_id, None,
+              {'contracts': 0, 'pdf_bytes': pdf_size, 'renders': 1, 'render_seconds': render_seconds})
+    os.replace(tmp_path, pdf_path)
+    db.session.commit()
+    schedule_thumbnail(pdf_path)
+    return 'done'
+
+
+def run(lease_seconds=DEFAULT_LEASE_SECONDS, poll_seconds=DEFAULT_POLL_SECONDS, once=False, log=print):
+    """Process jobs until interrupted (or until the queue is empty with once=True)"""
+    owner = worker_id()
+    counts = {'done': 0, 'retry': 0, 'dead': 0, 'lost': 0}
+    next_reap = 0.0
+    while True:
+        if time.monotonic() >= next_reap:
+            requeued = requeue_expired_leases()
+            if requeued:
+                log(f'{requeued} jobs with expired leases requeued')
+            next_reap = time.monotonic() + lease_seconds / 2
+
+        job_id = claim_job(owner, lease_seconds)
+        if job_id is None:
+            if once:
+                return counts
+            time.sleep(poll_seconds)
+            continue
+        result = render_job(job_id, owner, lease_seconds, log)
+        counts[result] += 1
+        db.session.expunge_all()
+        log(f'job {job_id}: {result}')
+        if render_recycler.due:
+            recycle(log)
+
+
+def recycle(log=print):
+    """Replace this process with a fresh copy of itself; no job is held at this point"""
+    log(f'recycling worker after {render_recycler.reason}')
+    wait_for_thumbnails()
+    db.session.remove()
+    db.engine.dispose()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render queued contract PDFs')
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS,
+                        help='seconds a claimed job stays leased without a heartbeat')
+    parser.add_argument('--poll', type=float, default=DEFAULT_POLL_SECONDS,
+                        help='seconds to wait when the queue is empty')
+    parser.add_argument('--once', action='store_true', help='exit when no job is runnable')
+    args = parser.parse_args()
+
+    # Adds the render_job table
+    init_db()
+    with app.app_context():
+        try:
+            counts = run(args.lease, args.poll, args.once)
+            print(f'Queue empty: {counts}')
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Vector signatures: signature_pad stroke data -> simplified, compact SVG path.
+
+The browser posts the pad's strokes as JSON ([[[x, y], ...], ...] in CSS
+pixels). Each stroke is decimated with Ramer-Douglas-Peucker and written as
+a single <path> using relative integer coordinates, then stored as an
+image/svg+xml data URL so preview, view and PDF pages embed it as vector.
+"""
+import json
+import re
+from urllib.parse import quote, unquote
+
+SVG_DATA_URL_PREFIX = 'data:image/svg+xml,'
+# Maximum deviation, in CSS pixels, of the simplified stroke from the drawn one
+SIMPLIFY_TOLERANCE = 0.8
+STROKE_WIDTH = 2.5
+MAX_STROKES = 300
+MAX_POINTS = 20000
+MAX_CANVAS_SIZE = 4000
+
+SVG_TEMPLATE = ('<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+                'viewBox="0 0 {width} {height}"><path d="{path}" fill="none" stroke="black" '
+                'stroke-width="{stroke_width}" stroke-linecap="round" stroke-linejoin="round"/></svg>')
+SVG_PATTERN = re.compile(
+    r'<svg xmlns="http://www\.w3\.org/2000/svg" width="\d+" height="\d+" viewBox="0 0 \d+ \d+">'
+    r'<path d="[Ml0-9,\-]*" fill="none" stroke="black" stroke-width="[0-9.]+" '
+    r'stroke-linecap="round" stroke-linejoin="round"/></svg>')
+
+
+def _distance_to_segment(point, start, end):
+    (px, py), (ax, ay), (bx, by) = point, start, end
+    dx, dy = bx - ax, by - ay
+    if dx == 0 and dy == 0:
+        return ((px - ax) ** 2 + (py - ay) ** 2) ** 0.5
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)))
+    return ((px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2) ** 0.5
+
+
+def simplify(points, tolerance=SIMPLIFY_TOLERANCE):
+    """Ramer-Douglas-Peucker decimation, iterative so long strokes cannot hit the recursion limit"""
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, max_distance = None, tolerance
+        for i in range(first + 1, last):
+            distance = _distance_to_segment(points[i], points[first], points[last])
+            if distance > max_distance:
+                farthest, max_distance = i, distance
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _path_for_stroke(points):
+    """'M x,y' followed by relative integer 'l' moves, skipping moves that round to nothing"""
+    x, y = round(points[0][0]), round(points[0][1])
+    path = [f'M{x},{y}']
+    moves = []
+    for px, py in points[1:]:
+        nx, ny = round(px), round(py)
+        if (nx, ny) != (x, y):
+            moves.append(f'{nx - x},{ny - y}')
+            x, y = nx, ny
+    # A tap is drawn as a zero-length segment, which the round cap turns into a dot
+    path.append('l' + (','.join(moves) if moves else '0,0'))
+    return ''.join(path)
+
+
+def parse_strokes(strokes_json, width, height):
+    """Validate posted stroke JSON and return a list of strokes of (x, y) floats"""
+    if not (0 < width <= MAX_CANVAS_SIZE and 0 < height <= MAX_CANVAS_SIZE):
+        raise ValueError('Invalid signature canvas size')
+    try:
+        strokes = json.loads(strokes_json)
+    except (TypeError, json.JSONDecodeError):
+        raise ValueError('Invalid signature data')
+    if not isinstance(strokes, list) or not strokes or len(strokes) > MAX_STROKES:
+        raise ValueError('Invalid signature data')
+
+    parsed = []
+    total_points = 0
+    for stroke in strokes:
+        if not isinstance(stroke, list) or not stroke:
+            raise ValueError('Invalid signature data')
+        total_points += len(stroke)
+        if total_points > MAX_POINTS:
+            raise ValueError('Signature has too many points')
+        points = []
+        for point in stroke:
+            if (not isinstance(point, list) or len(point) < 2
+                    or not all(isinstance(v, (int, float)) for v in point[:2])):
+                raise ValueError('Invalid signature data')
+            points.append((min(max(float(point[0]), 0.0), width), min(max(float(point[1]), 0.0), height)))
+        parsed.append(points)
+    return parsed
+
+
+def strokes_to_svg(strokes, width, height, tolerance=SIMPLIFY_TOLERANCE):
+    """Compact SVG document for parsed strokes"""
+    path = ''.join(_path_for_stroke(simplify(stroke, tolerance)) for stroke in strokes)
+    return SVG_TEMPLATE.format(width=round(width), height=round(height), path=path, stroke_width=STROKE_WIDTH)
+
+
+def svg_data_url(svg):
+    return SVG_DATA_URL_PREFIX + quote(svg, safe='/:=,.-')
+
+
+def signature_from_strokes(strokes_json, width, height):
+    """Turn posted stroke JSON into a stored signature data URL; raises ValueError if invalid"""
+    return svg_data_url(strokes_to_svg(parse_strokes(strokes_json, width, height), width, height))
+
+
+def is_valid_signature(signature):
+    """Accept raster data URLs (legacy PNG capture) and SVG produced by strokes_to_svg() only"""
+    if not signature:
+        return False
+    if signature.startswith(SVG_DATA_URL_PREFIX):
+        return SVG_PATTERN.fullmatch(unquote(signature[len(SVG_DATA_URL_PREFIX):])) is not None
+    return signature.startswith('data:image/') and not signature.startswith('data:image/svg')
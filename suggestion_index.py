@@ -0,0 +1,78 @@
+"""Build the variable value index behind the generate form's suggestions.
+
+The index (one row per variable name and distinct value, with the number of
+contracts using it) is maintained incrementally by save_contract_pdf() and
+delete_contract(); suggestions are served from it alone, never from the
+contracts table. A rebuild is needed once after upgrading, to index
+contracts saved before the index existed, or if it is ever suspected to be
+wrong. Contracts are read in id-ordered batches and the old index is
+replaced in one transaction at the end, so suggestions never come from a
+partial rebuild.
+
+    python suggestion_index.py rebuild [--batch-size 1000]
+    python suggestion_index.py show <variable> [prefix]
+"""
+import argparse
+
+from app import (app, db, init_db, Contract, VariableValue, add_variable_values, contract_variables,
+                 variable_value_counts, variable_suggestions)
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def rebuild(batch_size=DEFAULT_BATCH_SIZE, log=print):
+    """Recount every value from scratch; returns (contracts read, distinct values indexed)"""
+    counts = {}
+    counted = 0
+    last_id = 0
+    query = Contract.query.options(db.undefer(Contract.stored_variables_json),
+                                   db.undefer(Contract.compressed_variables))
+    while True:
+        batch = query.filter(Contract.id > last_id).order_by(Contract.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for contract in batch:
+            variable_value_counts(contract_variables(contract), counts)
+        counted += len(batch)
+        db.session.expunge_all()
+        log(f'... up to contract id {last_id}: {counted} contracts, {len(counts)} distinct values')
+
+    VariableValue.query.delete()
+    # Contracts saved since the scan started incremented rows that were just deleted
+    for contract in query.filter(Contract.id > last_id).all():
+        variable_value_counts(contract_variables(contract), counts)
+    keys = list(counts)
+    for start in range(0, len(keys), batch_size):
+        add_variable_values({key: counts[key] for key in keys[start:start + batch_size]})
+    db.session.commit()
+    return counted, len(counts)
+
+
+def show(variable, prefix=''):
+    for value in variable_suggestions(variable, prefix):
+        print(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Variable value suggestion index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = subparsers.add_parser('rebuild', help='recount every value from the contracts table')
+    rebuild_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    show_parser = subparsers.add_parser('show', help='print the suggestions for a variable')
+    show_parser.add_argument('variable')
+    show_parser.add_argument('prefix', nargs='?', default='')
+    args = parser.parse_args()
+
+    # Adds the variable_value table
+    init_db()
+    with app.app_context():
+        if args.command == 'rebuild':
+            counted, values = rebuild(args.batch_size)
+            print(f'Rebuild finished: {counted} contracts, {values} distinct values indexed')
+        else:
+            show(args.variable, args.prefix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Reconcile generated_contracts/ against the Contract table.
+
+Finds PDF files with no contract row (orphan files) and contract rows whose
+PDF is missing on disk (missing files). Both sides are streamed in sorted
+order and merge-joined, so memory use stays flat however many contracts
+exist. Run it as a background job:
+
+    python sweeper.py                              # report only
+    python sweeper.py --orphan-files delete --missing-files rerender
+    python sweeper.py --interval 3600              # repeat every hour
+"""
+import argparse
+import heapq
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from app import (app, db, Contract, ArchivedPdf, CONTRACTS_DIR, render_contract_pdf, record_usage,
+                 record_variable_values, contract_variables)
+from thumbnails import remove_thumbnail, schedule_thumbnail
+
+# Number of filenames held in memory at once while sorting the directory listing
+SORT_CHUNK_SIZE = 10000
+# Rows fetched per round trip while streaming the pdf_filename column
+DB_BATCH_SIZE = 1000
+# Files younger than this may belong to a save_contract_pdf call that has
+# written its PDF but not committed its row yet
+DEFAULT_MIN_AGE_SECONDS = 3600
+
+
+class Throttle:
+    """Limit filesystem operations to a fixed rate so a sweep can run against a live volume"""
+
+    def __init__(self, ops_per_second):
+        self.interval = 1.0 / ops_per_second if ops_per_second else 0
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if now < self.next_slot:
+            time.sleep(self.next_slot - now)
+            now = self.next_slot
+        self.next_slot = now + self.interval
+
+
+def _write_run(names, tmp_dir):
+    """Write one sorted chunk of filenames to a temporary run file"""
+    names.sort()
+    run = tempfile.TemporaryFile(mode='w+', encoding='utf-8', dir=tmp_dir)
+    for name in names:
+        run.write(name + '\n')
+    run.seek(0)
+    return run
+
+
+def iter_pdf_files_sorted(directory, chunk_size=SORT_CHUNK_SIZE, tmp_dir=None):
+    """Yield PDF filenames in directory in sorted order using an external merge sort"""
+    runs = []
+    chunk = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.pdf') and entry.is_file(follow_symlinks=False):
+                    chunk.append(entry.name)
+                    if len(chunk) >= chunk_size:
+                        runs.append(_write_run(chunk, tmp_dir))
+                        chunk = []
+        if not runs:
+            chunk.sort()
+            yield from chunk
+            return
+        if chunk:
+            runs.append(_write_run(chunk, tmp_dir))
+        for line in heapq.merge(*runs):
+            yield line.rstrip('\n')
+    finally:
+        for run in runs:
+            run.close()
+
+
+def iter_contract_filenames_sorted(batch_size=DB_BATCH_SIZE):
+    """Yield (pdf_filename, contract id) ordered by pdf_filename, streamed from the database.
+    Contracts whose PDF was moved into a pack by pdf_archive.py are expected to have no file."""
+    column = Contract.pdf_filename
+    if db.engine.dialect.name == 'postgresql':
+        # Byte-wise ordering so it agrees with Python's sort of the directory listing
+        column = column.collate('C')
+    query = (db.session.query(Contract.pdf_filename, Contract.id)
+             .outerjoin(ArchivedPdf, ArchivedPdf.pdf_filename == Contract.pdf_filename)
+             .filter(ArchivedPdf.id.is_(None))
+             .order_by(column, Contract.id)
+             .execution_options(yield_per=batch_size))
+    for pdf_filename, contract_id in query:
+        yield pdf_filename, contract_id
+
+
+def merge_join(files, rows):
+    """Merge-join sorted filenames with sorted (filename, id) rows.
+
+    Yields ('orphan_file', filename, None) for files without a row and
+    ('missing_file', filename, contract_id) for rows without a file.
+    """
+    sentinel = object()
+    file_name = next(files, sentinel)
+    row = next(rows, sentinel)
+    while file_name is not sentinel or row is not sentinel:
+        if row is sentinel or (file_name is not sentinel and file_name < row[0]):
+            yield 'orphan_file', file_name, None
+            file_name = next(files, sentinel)
+        elif file_name is sentinel or row[0] < file_name:
+            yield 'missing_file', row[0], row[1]
+            row = next(rows, sentinel)
+        else:
+            # Matched; several rows could share a filename, so only advance the row side
+            matched = row[0]
+            row = next(rows, sentinel)
+            if row is sentinel or row[0] != matched:
+                file_name = next(files, sentinel)
+
+
+def repair_orphan_file(pdf_filename, min_age, now):
+    """Delete an orphan PDF unless it is recent enough to be an in-flight save"""
+    pdf_path = os.path.join(CONTRACTS_DIR, pdf_filename)
+    try:
+        if now - os.stat(pdf_path).st_mtime < min_age:
+            return 'skipped'
+        # Re-check: the row may have been committed since the join saw it
+        if Contract.query.filter_by(pdf_filename=pdf_filename).first() is not None:
+            return 'skipped'
+        os.remove(pdf_path)
+    except FileNotFoundError:
+        return 'skipped'
+    remove_thumbnail(pdf_path)
+    return 'deleted'
+
+
+def repair_missing_file(contract_id, action):
+    """Re-render or delete a contract row whose PDF file is missing"""
+    contract = db.session.get(Contract, contract_id)
+    if contract is None:
+        return 'skipped'
+    pdf_path = os.path.join(CONTRACTS_DIR, contract.pdf_filename)
+    if os.path.exists(pdf_path):
+        return 'skipped'
+    if contract.render_job is not None and contract.render_job.pending:
+        # Not missing, just not rendered yet by render_worker.py
+        return 'skipped'
+    if ArchivedPdf.query.filter_by(pdf_filename=contract.pdf_filename).first() is not None:
+        # Archived into a pack since the join saw it
+        return 'skipped'
+    if action == 'rerender':
+        signed = render_contract_pdf(pdf_path, contract.title, contract.filled_content, contract.signature_data,
+                                     contract.render_profile)
+        contract.pdf_signed_at = datetime.utcnow() if signed else None
+        db.session.commit()
+        schedule_thumbnail(pdf_path)
+        return 'rerendered'
+    record_usage(contract, sign=-1)
+    record_variable_values(contract_variables(contract), sign=-1)
+    db.session.delete(contract)
+    db.session.commit()
+    return 'deleted'
+
+
+def sweep(orphan_files='report', missing_files='report', ops_per_second=200,
+          min_age=DEFAULT_MIN_AGE_SECONDS, log=print):
+    """Run one reconciliation pass and return a summary of what was found and repaired"""
+    throttle = Throttle(ops_per_second)
+    summary = {'orphan_files': 0, 'missing_files': 0, 'deleted': 0, 'rerendered': 0, 'skipped': 0}
+    now = time.time()
+
+    for kind, pdf_filename, contract_id in merge_join(iter_pdf_files_sorted(CONTRACTS_DIR),
+                                                      iter_contract_filenames_sorted()):
+        summary[kind + 's'] += 1
+        action = orphan_files if kind == 'orphan_file' else missing_files
+        if action == 'report':
+            log(f'{kind}: {pdf_filename}' + (f' (contract id {contract_id})' if contract_id else ''))
+            continue
+        throttle.wait()
+        if kind == 'orphan_file':
+            result = repair_orphan_file(pdf_filename, min_age, now)
+        else:
+            try:
+                result = repair_missing_file(contract_id, action)
+            except Exception as exc:
+                db.session.rollback()
+                log(f'failed to repair {pdf_filename}: {exc}')
+                continue
+        summary[result] += 1
+        log(f'{kind}: {pdf_filename} -> {result}')
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile generated PDFs with contract rows')
+    parser.add_argument('--orphan-files', choices=['report', 'delete'], default='report',
+                        help='what to do with PDFs that have no contract row')
+    parser.add_argument('--missing-files', choices=['report', 'rerender', 'delete'], default='report',
+                        help='what to do with contract rows whose PDF is missing')
+    parser.add_argument('--ops-per-second', type=float, default=200,
+                        help='maximum repair operations per second (0 disables throttling)')
+    parser.add_argument('--min-age', type=int, default=DEFAULT_MIN_AGE_SECONDS,
+                        help='never delete orphan files younger than this many seconds')
+    parser.add_argument('--interval', type=int, default=0,
+                        help='repeat the sweep every N seconds instead of running once')
+    args = parser.parse_args()
+
+    with app.app_context():
+        while True:
+            summary = sweep(args.orphan_files, args.missing_files, args.ops_per_second, args.min_age)
+            print(f"Sweep finished: {summary}")
+            db.session.remove()
+            if not args.interval:
+                break
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Runs the app against a throwaway database and contract directory.
+
+The environment is set before app.py is imported, since it reads its paths
+and database URI at import time; instance/contracts.db and
+generated_contracts/ are never touched.
+"""
+import os
+import tempfile
+from html.parser import HTMLParser
+
+import pytest
+
+TEST_ROOT = tempfile.mkdtemp(prefix='contract-tests-')
+os.environ.update({
+    'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(TEST_ROOT, "contracts.db")}',
+    'CONTRACTS_DIR': os.path.join(TEST_ROOT, 'contracts'),
+    'TEMPLATE_CACHE_DIR': '',
+    'PROFILES_DIR': os.path.join(TEST_ROOT, 'profiles'),
+    'RENDER_LOCK_DIR': os.path.join(TEST_ROOT, 'render_slots'),
+})
+
+import app as app_module  # noqa: E402
+from app import (app, db, init_db, compose_template, record_template_revision, save_contract_pdf,  # noqa: E402
+                 Contract, Template)
+
+app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+init_db()
+
+
+@pytest.fixture
+def app_context():
+    with app.app_context():
+        yield
+        db.session.rollback()
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app_context):
+    return app.test_client()
+
+
+@pytest.fixture
+def template(app_context):
+    """A template with a date, a deadline date and a plain variable"""
+    template = Template(title='Service Agreement', category='Tests')
+    compose_template(template, 'Agreement dated {effective_date} between {client_name} and the provider.\n'
+                               'The work is to be completed by {completion_date}.')
+    db.session.add(template)
+    record_template_revision(template)
+    db.session.commit()
+    return template
+
+
+@pytest.fixture
+def queued_contract(monkeypatch, template):
+    """Save a contract with RENDER_MODE=queue, so its PDF is left to the render worker"""
+    monkeypatch.setattr(app_module, 'RENDER_MODE', 'queue')
+
+    def save(title='Queued contract'):
+        return save_contract_pdf(template.id, title, 'Rendered by the worker.', '', {})
+    return save
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    """Sets CONTRACT_STORAGE for the test"""
+    def set_storage(mode):
+        monkeypatch.setattr(app_module, 'CONTRACT_STORAGE', mode)
+    return set_storage
+
+
+class FormInputs(HTMLParser):
+    """Names and values of the inputs of the form posting to action"""
+
+    def __init__(self, action):
+        super().__init__()
+        self.action = action
+        self.in_form = False
+        self.fields = {}
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form':
+            self.in_form = attrs.get('action') == self.action
+        elif tag == 'input' and self.in_form and attrs.get('name'):
+            self.fields[attrs['name']] = attrs.get('value') or ''
+
+    def handle_endtag(self, tag):
+        if tag == 'form':
+            self.in_form = False
+
+
+@pytest.fixture
+def save_contract(client):
+    """Fill in a template on the generate page and submit the preview page's save form as rendered;
+    returns the saved Contract"""
+    def save(template, values):
+        preview = client.post(f'/generate-contract/{template.id}', data=values)
+        assert preview.status_code == 200
+        action = f'/save-and-download/{template.id}'
+        form = FormInputs(action)
+        form.feed(preview.get_data(as_text=True))
+        assert 'content' in form.fields
+        response = client.post(action, data=form.fields)
+        assert response.status_code == 302
+        contract_uuid = response.location.rsplit('/', 1)[1]
+        return Contract.query.filter_by(uuid=contract_uuid).one()
+    return save
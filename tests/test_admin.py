@@ -0,0 +1,20 @@
+import pytest
+
+import app as app_module
+
+MONITORING_ENDPOINTS = ['/admin/render-queue', '/admin/render-jobs', '/admin/mail-queue', '/admin/purge-status']
+
+
+@pytest.mark.parametrize('path', MONITORING_ENDPOINTS)
+def test_monitoring_is_hidden_without_admin_token(client, path):
+    assert client.get(path).status_code == 404
+
+
+@pytest.mark.parametrize('path', MONITORING_ENDPOINTS)
+def test_monitoring_needs_the_admin_token(client, monkeypatch, path):
+    monkeypatch.setattr(app_module, 'ADMIN_TOKEN', 'test-token')
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={'X-Admin-Token': 'wrong-token'}).status_code == 403
+    response = client.get(path, headers={'X-Admin-Token': 'test-token'})
+    assert response.status_code == 200
+    assert response.is_json
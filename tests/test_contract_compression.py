@@ -0,0 +1,46 @@
+import pytest
+
+import app as app_module
+from app import db, contract_variables, create_compression_dictionary, Contract
+
+VALUES = {'effective_date': '2030-03-01', 'client_name': 'Jane Doe', 'completion_date': '2031-06-30'}
+TEXT = 'Agreement dated March 01, 2030 between Jane Doe and the provider.\nThe work is to be completed by June 30, 2031.'
+
+
+@pytest.fixture
+def zstd(monkeypatch, template):
+    """CONTRACT_COMPRESSION=zstd with a dictionary built from the template revisions; returns its id"""
+    monkeypatch.setattr(app_module, 'CONTRACT_COMPRESSION', 'zstd')
+    return create_compression_dictionary().id
+
+
+def reloaded(contract_id):
+    db.session.expunge_all()
+    return db.session.get(Contract, contract_id)
+
+
+def test_compressed_round_trip(zstd, storage, template, save_contract, client):
+    storage('full')
+    contract = reloaded(save_contract(template, VALUES).id)
+    assert (contract.content_storage, contract.dictionary_id) == ('zstd', zstd)
+    assert (contract.stored_content, contract.stored_variables_json) == ('', None)
+    assert contract.filled_content == TEXT
+    assert contract_variables(contract)['client_name'] == 'Jane Doe'
+    assert contract.summary == TEXT[:app_module.CONTRACT_SUMMARY_LENGTH]
+    assert 'completed by June 30, 2031' in client.get(f'/contract/{contract.uuid}').get_data(as_text=True)
+
+    contract.decompress()
+    db.session.commit()
+    contract = reloaded(contract.id)
+    assert (contract.content_storage, contract.dictionary_id, contract.compressed_content) == ('full', None, None)
+    assert (contract.stored_content, contract_variables(contract)['client_name']) == (TEXT, 'Jane Doe')
+
+
+def test_compressed_delta_round_trip(zstd, storage, template, save_contract):
+    storage('delta')
+    contract = reloaded(save_contract(template, VALUES).id)
+    # Only the variables are stored, compressed; the text is rebuilt from the revision
+    assert (contract.content_storage, contract.dictionary_id) == ('delta', zstd)
+    assert (contract.stored_content, contract.compressed_content, contract.stored_variables_json) == ('', None, None)
+    assert contract.compressed_variables is not None
+    assert contract.filled_content == TEXT
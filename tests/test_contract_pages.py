@@ -0,0 +1,39 @@
+import os
+
+from app import db, CONTRACTS_DIR, Contract, ContractPage
+
+VALUES = {'effective_date': '2030-03-01', 'client_name': 'Jane <Doe> & Co', 'completion_date': '2031-06-30'}
+
+
+def test_view_page_is_stored_and_revalidated(template, save_contract, client):
+    contract = save_contract(template, VALUES)
+    first = client.get(f'/contract/{contract.uuid}')
+    assert first.status_code == 200
+    etag = first.get_etag()[0]
+    assert first.headers['Cache-Control'] in ('private, no-cache', 'no-cache, private')
+    page = first.get_data(as_text=True)
+    assert 'between Jane &lt;Doe&gt; &amp; Co and the provider' in page
+    assert ContractPage.query.filter_by(contract_id=contract.id).one().etag == etag
+
+    revalidated = client.get(f'/contract/{contract.uuid}', headers={'If-None-Match': f'"{etag}"'})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+    assert revalidated.get_etag()[0] == etag
+    again = client.get(f'/contract/{contract.uuid}')
+    assert (again.status_code, again.get_etag()[0], again.get_data(as_text=True)) == (200, etag, page)
+
+    db.session.delete(db.session.get(Contract, contract.id))
+    db.session.commit()
+    assert client.get(f'/contract/{contract.uuid}', headers={'If-None-Match': f'"{etag}"'}).status_code == 404
+
+
+def test_download_round_trip(template, save_contract, client):
+    contract = save_contract(template, VALUES)
+    download = client.get(f'/download/{contract.uuid}')
+    assert download.status_code == 200
+    assert download.mimetype == 'application/pdf'
+    assert download.headers['Content-Disposition'].startswith('attachment')
+    with open(os.path.join(CONTRACTS_DIR, contract.pdf_filename), 'rb') as pdf_file:
+        assert download.get_data() == pdf_file.read()
+    assert download.get_data().startswith(b'%PDF-')
+    assert contract.pdf_size == len(download.get_data())
@@ -0,0 +1,98 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import deadline_scheduler
+from app import db, save_contract_pdf, ContractDeadline, ProcessCursor
+from deadline_scheduler import CursorLost, load_cursor, process_due
+
+
+@pytest.fixture
+def cursor(app_context):
+    """The scheduler's cursor, with only this test's deadlines ahead of it"""
+    ContractDeadline.query.delete()
+    cursor = load_cursor()
+    cursor.position_at = datetime.utcnow()
+    cursor.position_id = 0
+    db.session.commit()
+    return cursor
+
+
+@pytest.fixture
+def deadline(template):
+    """Add a deadline notified at notify_at to a new contract"""
+    def add(notify_at, variable='due_date'):
+        contract = save_contract_pdf(template.id, 'Contract with a deadline', 'Due soon.', '', {})
+        row = ContractDeadline(contract_id=contract.id, variable=variable, kind='deadline',
+                               due_on=notify_at.date() + timedelta(days=7), notify_at=notify_at)
+        db.session.add(row)
+        db.session.commit()
+        return row
+    return add
+
+
+def test_due_notices_are_sent_in_batches_once(cursor, deadline):
+    soon = datetime.utcnow() + timedelta(minutes=1)
+    due = [deadline(soon), deadline(soon), deadline(soon + timedelta(seconds=1))]
+    later = deadline(soon + timedelta(days=1))
+    processed = cursor.processed
+    logged = []
+
+    assert process_due(cursor, 2, now=soon + timedelta(seconds=1), log=logged.append) == 3
+    assert len(logged) == 3
+    assert all(f'due {(soon.date() + timedelta(days=7)).isoformat()}: due_date of "Contract with a deadline"'
+               in line for line in logged)
+    assert (cursor.position_at, cursor.position_id) == (due[-1].notify_at, due[-1].id)
+    assert cursor.processed == processed + 3
+
+    assert process_due(cursor, 2, now=soon + timedelta(seconds=1), log=logged.append) == 0
+    assert process_due(cursor, 2, now=later.notify_at, log=logged.append) == 1
+    assert cursor.position_id == later.id
+
+
+def test_failed_delivery_keeps_the_cursor(cursor, deadline, monkeypatch):
+    soon = datetime.utcnow() + timedelta(minutes=1)
+    row = deadline(soon)
+    position = (cursor.position_at, cursor.position_id)
+
+    def fail(events, log):
+        raise OSError('webhook unreachable')
+    monkeypatch.setattr(deadline_scheduler, 'deliver', fail)
+    with pytest.raises(OSError):
+        process_due(cursor, 10, now=soon)
+    assert (cursor.position_at, cursor.position_id) == position
+
+    monkeypatch.undo()
+    sent = []
+    monkeypatch.setattr(deadline_scheduler, 'deliver', lambda events, log: sent.extend(events))
+    assert process_due(cursor, 10, now=soon) == 1
+    assert [(event['id'], event['kind'], event['due_on']) for event in sent] == [
+        (row.id, 'deadline', row.due_on.isoformat())]
+
+
+def test_cursor_moved_by_another_scheduler(cursor, deadline, monkeypatch):
+    soon = datetime.utcnow() + timedelta(minutes=1)
+    row = deadline(soon)
+
+    def deliver_while_another_scheduler_runs(events, log):
+        # The other scheduler delivered the same batch and moved the cursor past it meanwhile
+        ProcessCursor.query.filter_by(name=deadline_scheduler.CURSOR_NAME).update(
+            {ProcessCursor.position_at: row.notify_at, ProcessCursor.position_id: row.id},
+            synchronize_session=False)
+        db.session.commit()
+    monkeypatch.setattr(deadline_scheduler, 'deliver', deliver_while_another_scheduler_runs)
+    with pytest.raises(CursorLost):
+        process_due(cursor, 10, now=soon)
+
+
+def test_deadlines_from_saved_variables(template):
+    contract = save_contract_pdf(template.id, 'Contract with dates', 'Dates.', '',
+                                 {'completion_date': 'June 30, 2031', 'effective_date': 'March 01, 2030',
+                                  'renewal_date': 'January 15, 2032', 'closing_date': 'January 01, 2000'})
+    deadlines = sorted((row.variable, row.kind, row.due_on, row.notify_at)
+                       for row in ContractDeadline.query.filter_by(contract_id=contract.id))
+    # Past dates and dates that are not deadlines get no notice
+    assert deadlines == [
+        ('completion_date', 'deadline', date(2031, 6, 30), datetime(2031, 6, 23)),
+        ('renewal_date', 'renewal', date(2032, 1, 15), datetime(2031, 12, 16)),
+    ]
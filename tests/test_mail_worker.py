@@ -0,0 +1,196 @@
+import base64
+import email
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+import mail_worker
+from app import db, queue_delivery, save_contract_pdf, Contract, ContractDelivery, MAIL_DOMAIN_CONCURRENCY
+from mail_worker import claim_deliveries, finish, prepare, requeue_expired_leases, send
+
+OWNER = 'test-host:1'
+LEASE_SECONDS = 300
+
+
+class FakeSmtp:
+    """Accepts every command and answers the message data with data_reply"""
+
+    def __init__(self, data_reply=(250, b'2.0.0 Ok: queued as 4Xyz')):
+        self.data_reply = data_reply
+        self.data = b''
+        self.in_data = False
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, sender):
+        return 250, b'Ok'
+
+    def rcpt(self, recipient):
+        return 250, b'Ok'
+
+    def putcmd(self, command):
+        assert command == 'data'
+
+    def getreply(self):
+        if not self.in_data:
+            self.in_data = True
+            return 354, b'End data with <CR><LF>.<CR><LF>'
+        return self.data_reply
+
+    def send(self, data):
+        self.data += data
+
+    def rset(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, smtp):
+        self.smtp = smtp
+
+    @contextmanager
+    def connection(self):
+        yield self.smtp
+
+
+@pytest.fixture(autouse=True)
+def empty_queue(app_context):
+    """Only this test's deliveries are runnable"""
+    ContractDelivery.query.filter(ContractDelivery.status.in_(['queued', 'sending'])).update(
+        {ContractDelivery.status: 'sent'})
+    db.session.commit()
+
+
+@pytest.fixture
+def delivery(template):
+    """Queue a saved contract to recipient; returns the delivery"""
+    def queue(recipient='jane@example.com', title='Emailed contract'):
+        contract = save_contract_pdf(template.id, title, 'Sent by email.', '', {})
+        queue_delivery(contract, [recipient])
+        db.session.commit()
+        return contract.deliveries[0]
+    return queue
+
+
+def send_claimed(delivery_id, smtp):
+    message, outcome = prepare(delivery_id)
+    assert outcome is None
+    return finish(delivery_id, OWNER, *send(FakePool(smtp), *message))
+
+
+def test_claim_send_and_finish(delivery):
+    queued = delivery()
+    assert claim_deliveries(OWNER, LEASE_SECONDS, 10) == [queued.id]
+    assert claim_deliveries('other-host:2', LEASE_SECONDS, 10) == []
+    smtp = FakeSmtp()
+    assert send_claimed(queued.id, smtp) == 'sent'
+
+    db.session.expire_all()
+    sent = db.session.get(ContractDelivery, queued.id)
+    assert (sent.status, sent.attempts, sent.lease_owner, sent.smtp_reply) == ('sent', 1, None, '2.0.0 Ok: queued as 4Xyz')
+    contract = db.session.get(Contract, sent.contract_id)
+    assert contract.delivery_status == 'sent'
+    assert contract.delivered_at is not None
+    message = email.message_from_bytes(smtp.data)
+    assert (message['To'], message['Subject']) == ('jane@example.com', 'Emailed contract')
+    attachment = message.get_payload()[1]
+    assert attachment.get_filename() == contract.pdf_filename
+    assert base64.b64decode(attachment.get_payload()).startswith(b'%PDF-')
+
+
+def test_title_cannot_add_headers(delivery):
+    queued = delivery()
+    Contract.query.filter_by(id=queued.contract_id).update({Contract.title: 'Lease\r\nBcc: eve@example.net'})
+    db.session.commit()
+    claim_deliveries(OWNER, LEASE_SECONDS, 10)
+    smtp = FakeSmtp()
+    assert send_claimed(queued.id, smtp) == 'sent'
+    message = email.message_from_bytes(smtp.data)
+    assert message['Subject'] == 'Lease Bcc: eve@example.net'
+    assert message['Bcc'] is None
+
+
+def test_domain_concurrency(delivery):
+    queued = [delivery(f'user{number}@example.com') for number in range(MAIL_DOMAIN_CONCURRENCY + 1)]
+    other = delivery('someone@example.org')
+    claimed = claim_deliveries(OWNER, LEASE_SECONDS, 10)
+    assert claimed == [entry.id for entry in queued[:MAIL_DOMAIN_CONCURRENCY]] + [other.id]
+
+
+def test_temporary_failure_backs_off_then_fails(delivery):
+    queued = delivery()
+    queued.max_attempts = 2
+    db.session.commit()
+    claim_deliveries(OWNER, LEASE_SECONDS, 10)
+    assert send_claimed(queued.id, FakeSmtp((451, b'4.3.0 Try again later'))) == 'retry'
+    retried = db.session.get(ContractDelivery, queued.id)
+    assert retried.status == 'queued'
+    assert '451' in retried.last_error
+    assert retried.run_after > datetime.utcnow() + timedelta(seconds=mail_worker.BACKOFF_BASE_SECONDS * 0.5 - 1)
+    assert db.session.get(Contract, retried.contract_id).delivery_status == 'queued'
+    assert claim_deliveries(OWNER, LEASE_SECONDS, 10) == []
+
+    retried.run_after = datetime.utcnow()
+    db.session.commit()
+    assert claim_deliveries(OWNER, LEASE_SECONDS, 10) == [queued.id]
+    assert send_claimed(queued.id, FakeSmtp((451, b'4.3.0 Try again later'))) == 'failed'
+    failed = db.session.get(ContractDelivery, queued.id)
+    assert (failed.status, failed.attempts) == ('failed', 2)
+    assert db.session.get(Contract, failed.contract_id).delivery_status == 'failed'
+
+
+def test_permanent_failure_is_not_retried(delivery):
+    queued = delivery()
+    claim_deliveries(OWNER, LEASE_SECONDS, 10)
+    assert send_claimed(queued.id, FakeSmtp((554, b'5.7.1 Rejected'))) == 'failed'
+    assert db.session.get(ContractDelivery, queued.id).attempts == 1
+
+
+def test_delivery_of_deleted_contract_is_lost(delivery):
+    queued = delivery()
+    claim_deliveries(OWNER, LEASE_SECONDS, 10)
+    db.session.delete(db.session.get(Contract, queued.contract_id))
+    db.session.commit()
+    message, outcome = prepare(queued.id)
+    assert (message, outcome) == (None, ('lost', None))
+    assert finish(queued.id, OWNER, *outcome) == 'lost'
+
+
+def test_finish_after_takeover_is_lost(delivery):
+    queued = delivery()
+    claim_deliveries(OWNER, LEASE_SECONDS, 10)
+    message, _ = prepare(queued.id)
+    ContractDelivery.query.filter_by(id=queued.id).update({ContractDelivery.lease_owner: 'other-host:2'})
+    db.session.commit()
+    assert finish(queued.id, OWNER, *send(FakePool(FakeSmtp()), *message)) == 'lost'
+    taken = db.session.get(ContractDelivery, queued.id)
+    assert (taken.status, taken.lease_owner, taken.sent_at) == ('sending', 'other-host:2', None)
+
+
+def test_queued_render_is_waited_for(queued_contract):
+    contract = queued_contract()
+    queue_delivery(contract, ['jane@example.com'])
+    db.session.commit()
+    delivery_id = contract.deliveries[0].id
+    claim_deliveries(OWNER, LEASE_SECONDS, 10)
+    message, outcome = prepare(delivery_id)
+    assert (message, outcome) == (None, ('waiting', None))
+    assert finish(delivery_id, OWNER, *outcome) == 'waiting'
+    waiting = db.session.get(ContractDelivery, delivery_id)
+    assert (waiting.status, waiting.attempts) == ('queued', 0)
+    assert waiting.run_after > datetime.utcnow()
+
+
+def test_expired_leases_are_requeued(delivery):
+    expired, renewed = delivery('jane@example.com'), delivery('john@example.org')
+    assert claim_deliveries(OWNER, LEASE_SECONDS, 10) == [expired.id, renewed.id]
+    expired.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+    assert requeue_expired_leases() == 1
+    db.session.expire_all()
+    assert (expired.status, expired.lease_owner) == ('queued', None)
+    assert expired.last_error == f'lease held by {OWNER} expired'
+    assert (renewed.status, renewed.lease_owner) == ('sending', OWNER)
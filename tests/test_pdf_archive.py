@@ -0,0 +1,68 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import pdf_archive
+from app import db, save_contract_pdf, ArchivedPdf, Contract, PdfPack, CONTRACTS_DIR, PACKS_DIR
+from packfile import PackWriter, new_pack_name
+from thumbnails import legacy_thumbnail_path, thumbnail_path
+
+
+@pytest.fixture(autouse=True)
+def archive_lock(app_context):
+    lock = pdf_archive.acquire_archive_lock()
+    yield
+    lock.close()
+
+
+@pytest.fixture
+def old_contract(template):
+    """Save a contract dated before the archive cutoff"""
+    def save(title='Archived contract'):
+        contract = save_contract_pdf(template.id, title, f'{title}.', '', {})
+        contract.created_at = datetime.utcnow() - timedelta(days=pdf_archive.DEFAULT_MIN_AGE_DAYS + 1)
+        db.session.commit()
+        return contract
+    return save
+
+
+def pdf_path(contract):
+    return os.path.join(CONTRACTS_DIR, contract.pdf_filename)
+
+
+def test_archived_pdf_is_served_from_its_pack(old_contract, client):
+    contract = old_contract()
+    with open(pdf_path(contract), 'rb') as pdf_file:
+        original = pdf_file.read()
+    # A thumbnail written before thumbnails had their own directory
+    with open(legacy_thumbnail_path(pdf_path(contract)), 'wb') as thumbnail:
+        thumbnail.write(b'\x89PNG')
+
+    assert pdf_archive.archive(log=lambda message: None) == 1
+    assert not os.path.exists(pdf_path(contract))
+    assert not os.path.exists(legacy_thumbnail_path(pdf_path(contract)))
+    assert os.path.exists(thumbnail_path(pdf_path(contract)))
+    assert ArchivedPdf.query.filter_by(pdf_filename=contract.pdf_filename).count() == 1
+
+    download = client.get(f'/download/{contract.uuid}')
+    assert download.status_code == 200
+    assert download.get_data() == original
+    thumbnail = client.get(f'/contract/{contract.uuid}/thumbnail.png')
+    assert (thumbnail.mimetype, thumbnail.get_data()) == ('image/png', b'\x89PNG')
+
+
+def test_contract_deleted_while_packing_is_not_archived(old_contract):
+    kept, deleted = old_contract('Kept contract'), old_contract('Deleted contract')
+    writer = PackWriter(os.path.join(PACKS_DIR, new_pack_name()))
+    for contract in (kept, deleted):
+        writer.add_file(contract.pdf_filename, pdf_path(contract))
+    db.session.delete(db.session.get(Contract, deleted.id))
+    db.session.commit()
+
+    assert pdf_archive.commit_pack(writer) == 1
+    archived = ArchivedPdf.query.filter(ArchivedPdf.pdf_filename.in_([kept.pdf_filename, deleted.pdf_filename])).all()
+    assert [row.pdf_filename for row in archived] == [kept.pdf_filename]
+    pack = db.session.get(PdfPack, archived[0].pack_id)
+    assert (pack.live_count, pack.live_bytes) == (1, archived[0].length)
+    assert pack.size > pack.live_bytes
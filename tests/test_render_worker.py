@@ -0,0 +1,103 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import render_worker
+from app import db, CONTRACTS_DIR, Contract, RenderJob
+from render_worker import claim_job, render_job, requeue_expired_leases
+
+OWNER = 'test-host:1'
+LEASE_SECONDS = 60
+
+
+@pytest.fixture(autouse=True)
+def empty_queue(app_context):
+    """Only this test's jobs are runnable"""
+    RenderJob.query.filter(RenderJob.status.in_(['queued', 'running'])).update({RenderJob.status: 'done'})
+    db.session.commit()
+
+
+def pdf_path(contract):
+    return os.path.join(CONTRACTS_DIR, contract.pdf_filename)
+
+
+def test_claim_and_render(queued_contract):
+    contract = queued_contract()
+    assert not os.path.exists(pdf_path(contract))
+    job_id = claim_job(OWNER, LEASE_SECONDS)
+    assert job_id == contract.render_job.id
+    assert claim_job('other-host:2', LEASE_SECONDS) is None
+
+    assert render_job(job_id, OWNER, LEASE_SECONDS) == 'done'
+    db.session.expire_all()
+    job = db.session.get(RenderJob, job_id)
+    assert (job.status, job.attempts, job.lease_owner) == ('done', 1, None)
+    assert db.session.get(Contract, contract.id).pdf_size == os.path.getsize(pdf_path(contract))
+    with open(pdf_path(contract), 'rb') as pdf_file:
+        assert pdf_file.read(5) == b'%PDF-'
+
+
+def test_nothing_to_claim():
+    assert claim_job(OWNER, LEASE_SECONDS) is None
+
+
+def test_job_of_deleted_contract_is_lost(queued_contract):
+    contract = queued_contract()
+    job_id = claim_job(OWNER, LEASE_SECONDS)
+    db.session.delete(db.session.get(Contract, contract.id))
+    db.session.commit()
+    assert render_job(job_id, OWNER, LEASE_SECONDS) == 'lost'
+    assert not os.path.exists(pdf_path(contract))
+
+
+def test_render_after_takeover_is_lost(queued_contract):
+    contract = queued_contract()
+    job_id = claim_job(OWNER, LEASE_SECONDS)
+    # Another worker took the job over after this one's lease expired
+    RenderJob.query.filter_by(id=job_id).update({RenderJob.lease_owner: 'other-host:2'})
+    db.session.commit()
+    assert render_job(job_id, OWNER, LEASE_SECONDS) == 'lost'
+    assert not os.path.exists(pdf_path(contract))
+    assert db.session.get(RenderJob, job_id).status == 'running'
+    assert not [name for name in os.listdir(CONTRACTS_DIR) if name.endswith('.pdf.tmp')]
+
+
+def test_failed_render_backs_off_then_dies(queued_contract, monkeypatch):
+    def fail(*args):
+        raise RuntimeError('renderer crashed')
+    monkeypatch.setattr(render_worker, 'render_contract_pdf', fail)
+    contract = queued_contract()
+    job = contract.render_job
+    job.max_attempts = 2
+    db.session.commit()
+
+    job_id = claim_job(OWNER, LEASE_SECONDS)
+    assert render_job(job_id, OWNER, LEASE_SECONDS, log=lambda message: None) == 'retry'
+    job = db.session.get(RenderJob, job_id)
+    assert job.status == 'queued'
+    assert job.last_error == 'RuntimeError: renderer crashed'
+    assert job.run_after > datetime.utcnow() + timedelta(seconds=render_worker.BACKOFF_BASE_SECONDS * 0.5 - 1)
+    assert claim_job(OWNER, LEASE_SECONDS) is None
+
+    job.run_after = datetime.utcnow()
+    db.session.commit()
+    assert claim_job(OWNER, LEASE_SECONDS) == job_id
+    assert render_job(job_id, OWNER, LEASE_SECONDS, log=lambda message: None) == 'dead'
+    job = db.session.get(RenderJob, job_id)
+    assert (job.status, job.attempts) == ('dead', 2)
+    assert job.finished_at is not None
+
+
+def test_expired_leases_are_requeued(queued_contract):
+    expired, renewed = queued_contract().render_job, queued_contract().render_job
+    assert claim_job(OWNER, LEASE_SECONDS) == expired.id
+    assert claim_job(OWNER, LEASE_SECONDS) == renewed.id
+    expired.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+    assert requeue_expired_leases() == 1
+    db.session.expire_all()
+    assert (expired.status, expired.lease_owner) == ('queued', None)
+    assert expired.last_error == f'lease held by {OWNER} expired'
+    assert (renewed.status, renewed.lease_owner) == ('running', OWNER)
@@ -0,0 +1,43 @@
+from datetime import date
+
+from app import db, contract_variables, ContractDeadline, VariableValue
+
+VALUES = {'effective_date': '2030-03-01', 'client_name': 'Jane "JJ" O\'Brien & Co <Ltd>',
+          'completion_date': '2031-06-30'}
+
+
+def test_preview_form_posts_variables(template, save_contract):
+    contract = save_contract(template, VALUES)
+    assert contract_variables(contract) == {'effective_date': 'March 01, 2030',
+                                            'client_name': 'Jane "JJ" O\'Brien & Co <Ltd>',
+                                            'completion_date': 'June 30, 2031'}
+    suggested = [value for (value,) in db.session.query(VariableValue.value).filter_by(variable='client_name')]
+    assert 'Jane "JJ" O\'Brien & Co <Ltd>' in suggested
+
+
+def test_saved_deadline_is_scheduled(template, save_contract):
+    contract = save_contract(template, VALUES)
+    deadlines = ContractDeadline.query.filter_by(contract_id=contract.id).all()
+    # effective_date is a date but not a deadline
+    assert [(deadline.variable, deadline.kind, deadline.due_on) for deadline in deadlines] == [
+        ('completion_date', 'deadline', date(2031, 6, 30))]
+
+
+def test_delta_storage_keeps_only_the_revision_and_variables(template, save_contract, storage, client):
+    storage('delta')
+    contract = save_contract(template, VALUES)
+    assert contract.content_storage == 'delta'
+    assert contract.stored_content == ''
+    assert contract.template_revision_id == template.current_revision().id
+    assert contract.filled_content == ('Agreement dated March 01, 2030 between Jane "JJ" O\'Brien & Co <Ltd> and '
+                                       'the provider.\nThe work is to be completed by June 30, 2031.')
+    page = client.get(f'/contract/{contract.uuid}')
+    assert page.status_code == 200
+    assert 'completed by June 30, 2031' in page.get_data(as_text=True)
+
+
+def test_full_storage_keeps_the_text(template, save_contract, storage):
+    storage('full')
+    contract = save_contract(template, VALUES)
+    assert contract.content_storage == 'full'
+    assert contract.stored_content == contract.filled_content
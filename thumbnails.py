@@ -0,0 +1,171 @@
+"""First-page PNG thumbnails for the contracts gallery.
+
+A thumbnail is written to the thumbnails/ directory beside its PDF
+(Contract_ab12cd34.pdf -> thumbnails/Contract_ab12cd34.thumb.png), so it
+stays when pdf_archive.py moves the PDF into a pack, by a local rasteriser: pdftoppm (poppler) if
+installed, otherwise Ghostscript. Generation runs on a small background
+thread pool right after the PDF is saved; until it finishes the gallery
+shows a placeholder. Existing contracts are backfilled with:
+
+    python thumbnails.py backfill [--batch-size 100] [--pause 0.5]
+"""
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTH = 240
+RASTERISE_TIMEOUT = 60
+
+_executor = None
+
+
+def thumbnail_path(pdf_path):
+    directory, filename = os.path.split(pdf_path)
+    return os.path.join(directory, 'thumbnails', os.path.splitext(filename)[0] + '.thumb.png')
+
+
+def legacy_thumbnail_path(pdf_path):
+    """Where thumbnails were written before they had a directory of their own"""
+    return os.path.splitext(pdf_path)[0] + '.thumb.png'
+
+
+def find_thumbnail(pdf_path):
+    """Path of the PDF's thumbnail, in either location, or None if it has none yet"""
+    for path in (thumbnail_path(pdf_path), legacy_thumbnail_path(pdf_path)):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def move_legacy_thumbnail(pdf_path):
+    """Move a thumbnail written next to its PDF into the thumbnails directory"""
+    target = thumbnail_path(pdf_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.replace(legacy_thumbnail_path(pdf_path), target)
+    except FileNotFoundError:
+        pass
+
+
+def find_rasteriser():
+    """Name of the available rasteriser command, or None"""
+    for command in ('pdftoppm', 'gs'):
+        if shutil.which(command):
+            return command
+    return None
+
+
+def _rasterise(command, pdf_path, output_path):
+    if command == 'pdftoppm':
+        prefix = os.path.splitext(output_path)[0]
+        subprocess.run(['pdftoppm', '-png', '-f', '1', '-l', '1', '-singlefile',
+                        '-scale-to-x', str(THUMBNAIL_WIDTH), '-scale-to-y', '-1', pdf_path, prefix],
+                       check=True, capture_output=True, timeout=RASTERISE_TIMEOUT)
+        return
+    # Letter/A4 pages are ~8.3-8.5in wide, so this resolution gives ~THUMBNAIL_WIDTH pixels
+    resolution = THUMBNAIL_WIDTH / 8.5
+    subprocess.run(['gs', '-q', '-dSAFER', '-dBATCH', '-dNOPAUSE', '-sDEVICE=png16m',
+                    '-dFirstPage=1', '-dLastPage=1', '-dTextAlphaBits=4', '-dGraphicsAlphaBits=4',
+                    f'-r{resolution:.2f}', f'-sOutputFile={output_path}', pdf_path],
+                   check=True, capture_output=True, timeout=RASTERISE_TIMEOUT)
+
+
+def generate_thumbnail(pdf_path):
+    """Rasterise the first page of pdf_path; returns the thumbnail path or None if no rasteriser exists"""
+    command = find_rasteriser()
+    if command is None:
+        return None
+    target = thumbnail_path(pdf_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Render into a temporary file and rename, so a half-written thumbnail is never served
+    fd, tmp_path = tempfile.mkstemp(suffix='.png', dir=os.path.dirname(target))
+    os.close(fd)
+    try:
+        _rasterise(command, pdf_path, tmp_path)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return target
+
+
+def _generate_quietly(pdf_path):
+    try:
+        generate_thumbnail(pdf_path)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning('Thumbnail generation failed for %s: %s', pdf_path, e)
+
+
+def schedule_thumbnail(pdf_path):
+    """Generate the thumbnail on a background thread; the caller does not wait for it"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=int(os.environ.get('THUMBNAIL_WORKERS', '1')),
+                                       thread_name_prefix='thumbnail')
+    return _executor.submit(_generate_quietly, pdf_path)
+
+
+def wait_for_thumbnails():
+    """Block until every scheduled thumbnail is written"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def remove_thumbnail(pdf_path):
+    for path in (thumbnail_path(pdf_path), legacy_thumbnail_path(pdf_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def backfill(batch_size=100, pause=0.0, log=print):
+    """Generate missing thumbnails for existing contracts, one id-ordered batch at a time"""
+    from app import db, Contract, CONTRACTS_DIR
+
+    if find_rasteriser() is None:
+        raise RuntimeError('No rasteriser found; install poppler-utils (pdftoppm) or ghostscript (gs)')
+    generated = 0
+    last_id = 0
+    while True:
+        batch = (db.session.query(Contract.id, Contract.pdf_filename)
+                 .filter(Contract.id > last_id).order_by(Contract.id).limit(batch_size).all())
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for _, pdf_filename in batch:
+            pdf_path = os.path.join(CONTRACTS_DIR, pdf_filename)
+            if os.path.exists(pdf_path) and find_thumbnail(pdf_path) is None:
+                _generate_quietly(pdf_path)
+                generated += 1
+        log(f'... up to contract id {last_id}: {generated} thumbnails generated')
+        if pause:
+            time.sleep(pause)
+    return generated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Contract PDF thumbnails')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill', help='generate thumbnails for existing contracts')
+    backfill_parser.add_argument('--batch-size', type=int, default=100)
+    backfill_parser.add_argument('--pause', type=float, default=0.0, help='seconds to sleep between batches')
+    args = parser.parse_args()
+
+    from app import app
+    with app.app_context():
+        generated = backfill(args.batch_size, args.pause)
+    print(f'Backfill finished: {generated} thumbnails generated')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Rebuild the usage rollup shown on /admin from the contracts table.
+
+The rollup (the per-day rows and the per-template totals) is normally
+maintained incrementally by save_contract_pdf() and delete_contract(); a
+rebuild is needed once after upgrading (contracts saved before the rollup
+existed are not counted, and deleting them leaves the counters alone) or if the counters are ever
+suspected to be wrong. Contracts are read in id-ordered batches; PDF sizes
+missing on older rows are read from disk and stored along the way. The old
+rollup is replaced in one transaction at the end, so /admin never shows a
+partial rebuild. Contracts deleted while the rebuild runs may still be
+counted; run it again in a quiet period if that matters.
+
+    python usage_stats.py rebuild [--batch-size 1000]
+    python usage_stats.py show
+"""
+import argparse
+import os
+
+from app import (app, db, init_db, Contract, Template, UsageRollup, UsageTotal, CONTRACTS_DIR, add_usage,
+                 usage_increment, usage_summary)
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def aggregate(totals, contracts, categories):
+    for contract in contracts:
+        key = (contract.created_at.date(), contract.template_id)
+        increments = usage_increment(contract)
+        if key not in totals:
+            totals[key] = dict(increments, category=categories.get(contract.template_id))
+        else:
+            for name, value in increments.items():
+                totals[key][name] += value
+
+
+def rebuild(batch_size=DEFAULT_BATCH_SIZE, log=print):
+    """Recompute every rollup row from scratch and return the number of contracts counted"""
+    categories = dict(db.session.query(Template.id, Template.category))
+    totals = {}
+    counted = 0
+    last_id = 0
+    while True:
+        batch = (Contract.query.filter(Contract.id > last_id).order_by(Contract.id).limit(batch_size).all())
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for contract in batch:
+            if contract.pdf_size is None:
+                pdf_path = os.path.join(CONTRACTS_DIR, contract.pdf_filename)
+                if os.path.exists(pdf_path):
+                    contract.pdf_size = os.path.getsize(pdf_path)
+        aggregate(totals, batch, categories)
+        counted += len(batch)
+        db.session.commit()
+        db.session.expunge_all()
+        log(f'... up to contract id {last_id}: {counted} contracts counted')
+
+    UsageRollup.query.delete()
+    UsageTotal.query.delete()
+    # Contracts saved since the scan started incremented rows that were just deleted
+    aggregate(totals, Contract.query.filter(Contract.id > last_id).all(), categories)
+    for (day, template_id), increments in totals.items():
+        category = increments.pop('category')
+        add_usage(day, template_id, category, increments)
+    db.session.commit()
+    return counted
+
+
+def show():
+    usage = usage_summary()
+    print(f"{usage['total_contracts']} contracts, {usage['total_pdf_bytes']} bytes of PDFs")
+    for row in usage['templates']:
+        average = f"{row['average_render_ms']:.0f} ms" if row['average_render_ms'] is not None else 'n/a'
+        print(f"{row['contracts']:>8}  {row['pdf_bytes']:>12} bytes  {average:>8}  {row['title']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Usage statistics rollup')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = subparsers.add_parser('rebuild', help='recompute the rollup from the contracts table')
+    rebuild_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    subparsers.add_parser('show', help='print the per-template totals')
+    args = parser.parse_args()
+
+    # Adds the rollup table and the pdf_size/render_seconds columns
+    init_db()
+    with app.app_context():
+        if args.command == 'rebuild':
+            counted = rebuild(args.batch_size)
+            print(f'Rebuild finished: {counted} contracts counted')
+        else:
+            show()
+
+
+if __name__ == '__main__':
+    main()